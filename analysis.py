@@ -0,0 +1,308 @@
+"""
+analysis.py: Vectorized analysis kernels and a process-pool batch analysis of recorded sessions.
+
+Each kernel consumes samples block by block with update() and combines with the kernel of the following samples with
+merge(). This lets batch analysis split a session log into chunks, run fresh kernels over every chunk in a pool of
+worker processes and reduce the partial results in order, with the same results as a single pass:
+
+    stats - RunningStats: count, mean, standard deviation, RMS, min and max
+    spectrum - Spectrum: averaged power spectral density (Hann window, non-overlapping segments)
+    trigger - TriggerEvents: the trigger points LevelTrigger would capture, with hysteresis, hold-off and post-trigger
+              capture length taken into account
+
+The kernels only run on recorded sessions. Of the live processing, only the trigger code is shared: TriggerEvents uses
+the vectorized Schmitt trigger of trigger.py, so it finds the events a live LevelTrigger captures.
+
+Every worker memory-maps the binary log itself, so no sample data is pickled; only the small kernel states travel back.
+Usage:
+
+    python analysis.py Output_Data.bin
+    python analysis.py Output_Data.bin --nfft 8192 --trigger '{"mode": "rising", "level": 1.0, "post_samples": 400}'
+"""
+
+import argparse
+import collections
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from session_log import SessionLog
+from trigger import ARMED, FIRED, UNKNOWN, LevelTrigger, find_edges, schmitt_states
+
+
+class RunningStats:
+    """
+    Count, mean, variance, min and max of a stream of samples. Partial results are combined with the parallel variance
+    formula of Chan et al., so merging chunks is exact up to rounding.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # Sum of squared differences from the mean
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def update(self, samples):
+        n = samples.shape[0]
+        if n == 0:
+            return
+        block = RunningStats()
+        block.count = n
+        block.mean = float(np.mean(samples, dtype=np.float64))
+        block.m2 = float(np.sum(np.square(samples - block.mean), dtype=np.float64))
+        block.min = float(np.min(samples))
+        block.max = float(np.max(samples))
+        self.merge(block)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / self.count) if self.count else math.nan
+
+    @property
+    def rms(self):
+        return math.sqrt(self.mean * self.mean + self.m2 / self.count) if self.count else math.nan
+
+
+class Spectrum:
+    """
+    Averaged power spectrum over non-overlapping segments of nfft samples (Welch's method without overlap). Samples
+    that do not fill a segment are kept for the next update(). merge() drops them, so batch chunks are a multiple of
+    nfft long.
+    """
+
+    def __init__(self, nfft=4096):
+        """
+        :param nfft: Segment length in samples
+        """
+        self.nfft = int(nfft)
+        self.window = np.hanning(self.nfft)
+        self.power = np.zeros(shape=(self.nfft // 2 + 1,))
+        self.segments = 0
+        self._tail = np.empty(shape=(0,))
+
+    def update(self, samples):
+        if self._tail.shape[0]:
+            samples = np.concatenate((self._tail, samples))
+        k = samples.shape[0] // self.nfft
+        if k:
+            segments = samples[:k * self.nfft].reshape(k, self.nfft)
+            # Remove the mean of every segment so the DC level does not leak into the low frequencies
+            segments = (segments - segments.mean(axis=1, keepdims=True)) * self.window
+            self.power += np.square(np.abs(np.fft.rfft(segments, axis=1))).sum(axis=0)
+            self.segments += k
+        self._tail = np.array(samples[k * self.nfft:], dtype=np.float64)
+
+    def merge(self, other):
+        self.power += other.power
+        self.segments += other.segments
+        self._tail = other._tail
+
+    def density(self, dt):
+        """
+        Returns the one-sided power spectral density.
+
+        :param dt: Sample period in seconds
+        :return: (frequencies in Hz, density in V**2/Hz)
+        """
+        frequencies = np.fft.rfftfreq(self.nfft, dt)
+        density = self.power / max(self.segments, 1) * dt / np.sum(np.square(self.window))
+        # Fold the negative frequencies in, except for DC and (for even nfft) the Nyquist frequency
+        density[1:self.nfft - self.nfft // 2] *= 2
+        return frequencies, density
+
+
+class TriggerEvents:
+    """
+    Finds the trigger points LevelTrigger would capture, using the same vectorized Schmitt trigger. The state at the
+    start of a chunk is unknown, so each chunk records its first decisive sample; merge() uses it to restore the edge a
+    chunk boundary hides. Hold-off and the capture length are applied by trigger_samples(), once all edges are known.
+    """
+
+    def __init__(self, **trigger_configuration):
+        """
+        :param trigger_configuration: LevelTrigger keyword arguments, as in the 'trigger' task configuration entry
+        """
+        self.trigger = LevelTrigger(**trigger_configuration)
+        self.samples = 0
+        self.state = UNKNOWN
+        # (sample, code) of the first sample that is not in the hysteresis band
+        self.first = None
+        self._edges = []
+
+    def update(self, samples):
+        n = samples.shape[0]
+        if n == 0:
+            return
+        codes = self.trigger.codes(samples)
+        if self.first is None:
+            decisive = np.flatnonzero(codes != UNKNOWN)
+            if decisive.shape[0]:
+                self.first = (self.samples + int(decisive[0]), int(codes[decisive[0]]))
+        states = schmitt_states(codes, self.state)
+        self._edges.append(find_edges(states, self.state) + self.samples)
+        self.state = int(states[-1])
+        self.samples += n
+
+    def merge(self, other):
+        if other.first is not None:
+            sample, code = other.first
+            if self.state == ARMED and code == FIRED:
+                self._edges.append(np.array([self.samples + sample]))
+            if self.first is None:
+                self.first = (self.samples + sample, code)
+            self.state = other.state
+        self._edges.extend(edges + self.samples for edges in other._edges)
+        self.samples += other.samples
+
+    def trigger_samples(self):
+        """
+        Returns the sample numbers of the trigger points of all completed captures.
+        """
+        edges = np.concatenate(self._edges).tolist() if self._edges else []
+        post_samples, holdoff = self.trigger.post_samples, self.trigger.holdoff
+        accepted = []
+        next_allowed = 0
+        for edge in edges:
+            # Edges during a capture or its hold-off are ignored
+            if edge >= next_allowed:
+                accepted.append(edge)
+                next_allowed = edge + post_samples + holdoff
+        return [edge for edge in accepted if edge + post_samples <= self.samples]
+
+
+KERNELS = {'stats': RunningStats, 'spectrum': Spectrum, 'trigger': TriggerEvents}
+
+# Per worker process state, set up once by _init_worker
+_worker_log = None
+_worker_kernels = None
+
+
+def _init_worker(filename, kernels):
+    global _worker_log, _worker_kernels
+    _worker_log = SessionLog(filename)
+    _worker_kernels = kernels
+
+
+def _analyze_chunk(chunk):
+    """
+    Runs fresh kernels over samples[start:stop] of the worker's memory-mapped log.
+    """
+    start, stop = chunk
+    samples = _worker_log.samples[start:stop]
+    results = {}
+    for name, kwargs in _worker_kernels.items():
+        kernel = KERNELS[name](**kwargs)
+        kernel.update(samples)
+        results[name] = kernel
+    return results
+
+
+def plan_chunks(session_log, chunk_samples):
+    """
+    Splits a log into (start, stop) chunks of at most chunk_samples samples that never span two segments.
+    """
+    chunks = []
+    for segment in session_log.segments:
+        for start in range(segment.start, segment.stop, chunk_samples):
+            chunks.append((start, min(start + chunk_samples, segment.stop)))
+    return chunks
+
+
+def analyze(filename, kernels, workers=None, chunk_samples=1 << 20):
+    """
+    Runs analysis kernels over a binary session log in a pool of worker processes.
+
+    :param filename: Binary session log written by DataWriter
+    :param kernels: A dict of kernel name (see KERNELS) to the keyword arguments of the kernel
+    :param workers: Number of worker processes (default: one per core)
+    :param chunk_samples: Samples per chunk. It is rounded up to a multiple of the spectrum segment length.
+    :return: A dict of kernel name to the kernel holding the result for the whole log
+    """
+    session_log = SessionLog(filename)
+    if session_log.file_format != 'binary':
+        raise ValueError(filename + ' is not a binary session log')
+    for name in kernels:
+        if name not in KERNELS:
+            raise ValueError('Invalid kernel ' + name + '. Valid options include ' + ', '.join(KERNELS))
+    if 'spectrum' in kernels:
+        # Whole segments per chunk, so the spectrum of the chunks adds up to the spectrum of the log
+        nfft = Spectrum(**kernels['spectrum']).nfft
+        chunk_samples = -(-chunk_samples // nfft) * nfft
+    results = {name: KERNELS[name](**kwargs) for name, kwargs in kernels.items()}
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(filename, kernels)) as pool:
+        # Keep a bounded number of chunks in flight and reduce the results in order as they complete
+        pending = collections.deque()
+
+        def reduce_next():
+            for name, kernel in pending.popleft().result().items():
+                results[name].merge(kernel)
+
+        for chunk in plan_chunks(session_log, chunk_samples):
+            pending.append(pool.submit(_analyze_chunk, chunk))
+            if len(pending) >= 2 * workers:
+                reduce_next()
+        while pending:
+            reduce_next()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze a binary session log in parallel.')
+    parser.add_argument('log', help='Binary session log written by DataWriter')
+    parser.add_argument('--nfft', type=int, default=4096, help='Spectrum segment length, 0 to skip (default 4096)')
+    parser.add_argument('--trigger', help='JSON dict of LevelTrigger arguments to count trigger events')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: one per core)')
+    parser.add_argument('--chunk-samples', type=int, default=1 << 20, help='Samples per chunk (default 1048576)')
+    parser.add_argument('--peaks', type=int, default=5, help='Number of spectral peaks listed (default 5)')
+    args = parser.parse_args(argv)
+
+    kernels = {'stats': {}}
+    if args.nfft:
+        kernels['spectrum'] = {'nfft': args.nfft}
+    if args.trigger:
+        kernels['trigger'] = json.loads(args.trigger)
+    start = perf_counter()
+    results = analyze(args.log, kernels, workers=args.workers, chunk_samples=args.chunk_samples)
+    elapsed = perf_counter() - start
+
+    stats = results['stats']
+    print('{} samples: mean={:.6g} std={:.6g} rms={:.6g} min={:.6g} max={:.6g}'.format(
+        stats.count, stats.mean, stats.std, stats.rms, stats.min, stats.max))
+    session_log = SessionLog(args.log)
+    dt = session_log.segments[0].dt
+    if 'spectrum' in results and dt:
+        frequencies, density = results['spectrum'].density(dt)
+        peaks = np.argsort(density[1:])[::-1][:args.peaks] + 1
+        print('Spectral peaks: ' + ', '.join('{:.4g} Hz ({:.3g} V^2/Hz)'.format(frequencies[i], density[i])
+                                              for i in peaks))
+    if 'trigger' in results:
+        trigger_samples = results['trigger'].trigger_samples()
+        print('{} trigger events'.format(len(trigger_samples)))
+        for sample in trigger_samples[:10]:
+            print('  sample {}'.format(sample) + (' t={:.6f}s'.format(session_log.time_at(sample)) if dt else ''))
+    size = os.path.getsize(args.log)
+    print('Analyzed in {:.2f} s ({:.2f} s/GB of input)'.format(elapsed, elapsed / max(size / 1e9, 1e-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
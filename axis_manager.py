@@ -0,0 +1,128 @@
+"""
+axis_manager.py: Limits of the live graph while it follows the incoming data. Moving the x limits to the end of the
+data on every update makes the graph lay out its ticks and render the whole figure on every frame. AxisManager moves
+the limits in coarse steps instead: the x axis jumps ahead by a fraction of its width once the data reaches its end,
+and the y axis is fitted to the range of the data, tracked block by block as it arrives, with limits rounded to the
+tick step. The y axis grows as soon as the data leaves it but only shrinks once the data uses less than a fraction of
+it. Between steps the limits, and so the ticks and labels, stay the same and only the traces are redrawn.
+
+Only numpy and the standard library are imported, so the manager works with either graph backend.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+
+def nice_step(span, max_ticks=8):
+    """
+    Returns the smallest round step (1, 2 or 5 times a power of ten) dividing span into at most max_ticks intervals.
+    """
+    raw_step = span / max_ticks
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for multiple in (1, 2, 5, 10):
+        if multiple * magnitude >= raw_step:
+            return multiple * magnitude
+
+
+class AxisManager:
+    """
+    Computes the home limits of a graph following streaming data. Call add() with every block and update() once per
+    graph update; the limits only change when update() returns True.
+    """
+
+    def __init__(self, window=None, step_fraction=0.25, autoscale_y=True, y_margin=0.05, y_shrink=0.5, max_ticks=8):
+        """
+        :param window: Width of the x axis in seconds, scrolling with the data, or None to show all the data received
+        :param step_fraction: How far the x axis reaches past the newest data after a step, as a fraction of its width
+        :param autoscale_y: Fit the y axis to the data, otherwise it keeps the limits given to reset()
+        :param y_margin: Room left above and below the data, as a fraction of its range
+        :param y_shrink: The y axis shrinks to fit the data once the data spans less than this fraction of it. Keep it
+                    at 0.5 or below, so a fitted axis is not shrunk again right away.
+        :param max_ticks: Number of y ticks the limits are rounded for
+        """
+        if window is not None and not window > 0:
+            raise ValueError('Invalid window {}. Valid options include None and durations > 0'.format(window))
+        if not 0 < step_fraction <= 1:
+            raise ValueError('Invalid step fraction {}. Valid options include 0 < step_fraction <= 1'.format(
+                step_fraction))
+        self.window = window
+        self.step_fraction = step_fraction
+        self.autoscale_y = autoscale_y
+        self.y_margin = y_margin
+        self.y_shrink = y_shrink
+        self.max_ticks = max_ticks
+        self.reset(0.0, 1.0, -1.0, 1.0)
+
+    def reset(self, xmin, xmax, ymin, ymax):
+        """
+        Forgets the data and sets the limits shown until the first update.
+        """
+        self.xlim = (xmin, xmax)
+        self.ylim = (ymin, ymax)
+        # (t_end, min, max) of every block within the window, to fit the y axis to the samples still shown
+        self._ranges = collections.deque()
+        self._min = math.inf
+        self._max = -math.inf
+        self.updates = 0
+        self.steps = 0
+
+    def add(self, block):
+        """
+        Tracks the range of a WaveformBlock's samples, the only pass made over them.
+        """
+        if not self.autoscale_y or not len(block):
+            return
+        low, high = float(np.min(block.samples)), float(np.max(block.samples))
+        if not (math.isfinite(low) and math.isfinite(high)):
+            # NaN or infinite samples are not plotted, so they do not scale the axis
+            finite = block.samples[np.isfinite(block.samples)]
+            if not finite.shape[0]:
+                return
+            low, high = float(np.min(finite)), float(np.max(finite))
+        if self.window is not None:
+            self._ranges.append((block.t_end, low, high))
+        self._min = min(self._min, low)
+        self._max = max(self._max, high)
+
+    def update(self, t_start, t_end):
+        """
+        Moves the limits, if needed, to show the data from t_start to t_end.
+
+        :return: True if xlim or ylim changed
+        """
+        self.updates += 1
+        xlim, ylim = self.xlim, self.ylim
+        if self.window is None:
+            if t_end > xlim[1] or t_start != xlim[0]:
+                xlim = (t_start, t_end + (t_end - t_start) * self.step_fraction)
+        elif t_end > xlim[1] or t_end < xlim[1] - self.window:
+            xmax = t_end + self.window * self.step_fraction
+            xlim = (xmax - self.window, xmax)
+            # Forget the blocks that scrolled out of view, narrowing the tracked range
+            while self._ranges and self._ranges[0][0] <= xlim[0]:
+                self._ranges.popleft()
+            self._min = min([low for _, low, _ in self._ranges], default=math.inf)
+            self._max = max([high for _, _, high in self._ranges], default=-math.inf)
+        if self.autoscale_y and self._min <= self._max:
+            span = ylim[1] - ylim[0]
+            if self._min < ylim[0] or self._max > ylim[1] or self._max - self._min < self.y_shrink * span:
+                ylim = self._fit(self._min, self._max)
+        if xlim == self.xlim and ylim == self.ylim:
+            return False
+        self.xlim, self.ylim = xlim, ylim
+        self.steps += 1
+        return True
+
+    def _fit(self, low, high):
+        """
+        Returns y limits holding [low, high] with a margin, rounded outwards to the tick step.
+        """
+        margin = (high - low) * self.y_margin or max(abs(high) * self.y_margin, 1e-9)
+        low, high = low - margin, high + margin
+        step = nice_step(high - low, self.max_ticks)
+        return math.floor(low / step) * step, math.ceil(high / step) * step
+
+    def summary(self):
+        return 'limits changed {} times in {} updates'.format(self.steps, self.updates)
@@ -0,0 +1,349 @@
+"""
+capacity_sweep.py: Finds the highest sample rate this machine sustains for each combination of transport, log format
+and display mode. A SimulatedReader process acquires from a simulated device, clocked by the wall clock and with a
+buffer of the DAQmx default size, through the real pipeline (UI queue or stream server, trigger-free acquisition loop,
+DataWriter), while this process consumes the blocks like the graph or a stream subscriber does. Each combination is run
+at increasing sample rates until a step fails, which happens when:
+
+    - the reader falls behind the simulated device by more than its buffer (the DAQmx -200279 overflow)
+    - the consumer loses or decimates samples (counted by a ContinuityChecker from the block stamps)
+    - the consumer's lag behind the device keeps growing during the step
+
+The sustainable ceiling is the last rate that passed. CPU time and (with psutil installed) peak memory of the reader and
+the consumer are reported for every step. The simulated signal is seeded, so a sweep is reproduced by running the same
+command line again.
+
+Usage (from the top-level of the repository):
+
+    python benchmarks/capacity_sweep.py
+    python benchmarks/capacity_sweep.py --transports ui --formats binary --displays raster --max-rate 2000000
+    python benchmarks/capacity_sweep.py --rates 100000 500000 1000000 --duration 10 --json sweep.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import queue
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block_buffer import OVERFLOW_POLICIES, BlockQueue
+from reader_entry import GLOBAL_ACK, STARTED_ACK, ControlChannel, Process, run_reader
+from stream_server import BlockSubscriber
+from trace_raster import draw_trace
+from waveform import SAMPLE_DTYPES, ContinuityChecker, WaveformStore
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+TRANSPORTS = ('ui', 'stream', 'none')
+FORMATS = ('none', 'csv', 'binary')
+DISPLAYS = ('none', 'store', 'raster')
+
+
+def sweep_rates(args):
+    """
+    Returns the sample rates to try: the --rates list, or a geometric series from --start-rate to --max-rate.
+    """
+    if args.rates:
+        return sorted(args.rates)
+    rates = []
+    rate = args.start_rate
+    while rate <= args.max_rate:
+        rates.append(int(rate))
+        rate *= args.factor
+    return rates
+
+
+def free_port():
+    """
+    Returns a TCP port on the loopback interface that is free right now.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class ResourceMonitor:
+    """
+    CPU time and peak resident memory of the reader process and of this (consumer) process during one step. Memory is
+    only sampled with psutil; without it CPU time comes from os.times(), which only counts the reader once it has been
+    joined and is not available on Windows.
+    """
+
+    def __init__(self, process):
+        self._process = psutil.Process(process.pid) if psutil else None
+        self._self = psutil.Process() if psutil else None
+        self._times = os.times()
+        self._reader_cpu = 0.0
+        self.reader_rss = None
+        self.consumer_rss = None
+
+    def sample(self):
+        """
+        Updates the CPU time and the peak memory. Call it regularly while the reader runs.
+        """
+        if self._process is None:
+            return
+        try:
+            cpu = self._process.cpu_times()
+            self._reader_cpu = cpu.user + cpu.system
+            self.reader_rss = max(self.reader_rss or 0, self._process.memory_info().rss)
+        except psutil.Error:
+            # The reader has exited, keep its last figures
+            pass
+        self.consumer_rss = max(self.consumer_rss or 0, self._self.memory_info().rss)
+
+    def cpu_times(self):
+        """
+        Returns the (reader, consumer) CPU time in seconds since the monitor was created. Call it after the reader has
+        been joined.
+        """
+        times = os.times()
+        consumer = (times.user - self._times.user) + (times.system - self._times.system)
+        if self._process is not None:
+            return self._reader_cpu, consumer
+        reader = (times.children_user - self._times.children_user) + (times.children_system -
+                                                                      self._times.children_system)
+        return reader, consumer
+
+
+def stream_receiver(address, blocks):
+    """
+    Subscriber thread: puts every block received from the stream server on the blocks queue, and END_OF_DATA (None)
+    once the server closes.
+    """
+    try:
+        with BlockSubscriber(address) as subscriber:
+            for block in subscriber:
+                blocks.put(block)
+    except OSError:
+        pass
+    blocks.put(None)
+
+
+def run_step(args, transport, file_format, display, rate, output_dir):
+    """
+    Acquires from the simulated device at one sample rate for args.duration seconds and returns the step's figures.
+    """
+    samples_per_read = max(1, int(rate // args.reads_per_second))
+    if args.buffer_samples:
+        # Like with DAQmx, reads of more than a fraction of the buffer overflow it while waiting for the samples
+        samples_per_read = min(samples_per_read, max(1, args.buffer_samples // 2))
+    task_configuration = {'sample_clock_source': 'OnBoardClock', 'sample_rate': rate,
+                          'samples_per_read': samples_per_read, 'channel': 0, 'dev_name': 'Simulated',
+                          'max_voltage': 10, 'min_voltage': -10, 'terminal_configuration': 'DEFAULT',
+                          'simulate': {'frequency': args.frequency, 'amplitude': 1.0, 'noise': args.noise,
+                                       'seed': args.seed, 'buffer_samples': args.buffer_samples},
+                          'output_file': None, 'stream_buffer_bytes': args.buffer_bytes,
+                          'stream_policy': args.policy, 'sample_dtype': args.sample_dtype}
+    if file_format != 'none':
+        task_configuration['file_format'] = file_format
+        task_configuration['output_file'] = os.path.join(output_dir, 'capacity_sweep.' +
+                                                         ('bin' if file_format == 'binary' else 'csv'))
+    ui_queue = None
+    if transport == 'ui':
+        ui_queue = BlockQueue(args.buffer_bytes, args.policy)
+    elif transport == 'stream':
+        task_configuration['stream_address'] = 'tcp://127.0.0.1:{}'.format(free_port())
+
+    control = ControlChannel()
+    process = Process(target=run_reader, args=(task_configuration, ui_queue, control))
+    process.start()
+    if not control.wait_for_ack(STARTED_ACK, process):
+        process.join()
+        raise RuntimeError('The simulated reader failed to start: ' + str(process.exception))
+    t_start = perf_counter()
+    monitor = ResourceMonitor(process)
+
+    blocks = ui_queue
+    receiver = None
+    if transport == 'stream':
+        blocks = queue.Queue()
+        receiver = threading.Thread(target=stream_receiver, args=(task_configuration['stream_address'], blocks),
+                                    daemon=True)
+        receiver.start()
+
+    continuity = ContinuityChecker(join_late=transport == 'stream')
+    store = WaveformStore(dtype=args.sample_dtype)
+    rgba = np.zeros(shape=(args.height, args.width, 4), dtype=np.uint8)
+    # (seconds since the start, seconds the consumer is behind the device) for every block received
+    lags = []
+    next_frame = next_sample = perf_counter()
+    deadline = t_start + args.duration
+    while process.is_alive():
+        now = perf_counter()
+        if now >= deadline:
+            break
+        if now >= next_sample:
+            monitor.sample()
+            next_sample = now + 0.25
+        if blocks is None:
+            # Nothing to consume, the reader only logs
+            process.join(0.05)
+            continue
+        try:
+            block = blocks.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        if block is None:
+            break
+        now = perf_counter()
+        if not continuity.check(block):
+            continue
+        lags.append((now - t_start, now - t_start - (block.first_sample + block.source_samples) / rate))
+        if display != 'none':
+            store.append(block)
+            if now >= next_frame:
+                next_frame = now + 1 / args.fps
+                x, y = store.visible(store.t_end - args.window, store.t_end, max_points=2 * args.width)
+                if display == 'raster':
+                    rgba[:] = 0
+                    draw_trace(rgba, x, y, (store.t_end - args.window, store.t_end), (-2.0, 2.0),
+                               (31, 119, 180, 255))
+    monitor.sample()
+    elapsed = perf_counter() - t_start
+
+    control.stop()
+    control.wait_for_ack(GLOBAL_ACK, process)
+    if ui_queue is not None:
+        ui_queue.discard(process)
+    process.join()
+    if receiver is not None:
+        receiver.join(timeout=5.0)
+    reader_cpu, consumer_cpu = monitor.cpu_times()
+
+    # Compare the lag at the start and at the end of the step, ignoring the first second of warm-up
+    settled = [lag for t, lag in lags if t >= min(1.0, args.duration / 4)]
+    quarter = max(len(settled) // 4, 1)
+    lag_growth = statistics.median(lag for lag in settled[-quarter:]) - statistics.median(
+        lag for lag in settled[:quarter]) if settled else 0.0
+    dropped = ui_queue.dropped_samples if ui_queue is not None else 0
+    result = {'transport': transport, 'format': file_format, 'display': display, 'rate': rate,
+              'samples_per_read': samples_per_read, 'elapsed': elapsed, 'received': continuity.samples,
+              'throughput': continuity.samples / elapsed, 'lost_samples': continuity.lost_samples,
+              'lost_blocks': continuity.lost_blocks, 'decimated_samples': continuity.decimated_samples,
+              'dropped_samples': dropped, 'max_backlog': continuity.max_backlog, 'lag_growth': lag_growth,
+              'reader_cpu': reader_cpu / elapsed, 'consumer_cpu': consumer_cpu / elapsed,
+              'reader_rss': monitor.reader_rss, 'consumer_rss': monitor.consumer_rss, 'error': process.exception}
+
+    if result['error']:
+        result['failure'] = 'reader overflow' if '-200279' in result['error'] else 'reader failed'
+    elif transport != 'none' and not continuity.blocks:
+        result['failure'] = 'no data received'
+    elif not continuity.ok or continuity.decimated_samples or dropped:
+        result['failure'] = 'samples lost'
+    elif lag_growth > args.max_lag_growth:
+        result['failure'] = 'backlog growing'
+    else:
+        result['failure'] = None
+    return result
+
+
+def format_result(result):
+    """
+    Returns one line of the results table.
+    """
+    def megabytes(value):
+        return '{:7.0f}'.format(value / 2 ** 20) if value is not None else '    n/a'
+
+    return '{:>6} {:>6} {:>6} {:>10} {:>12.0f} {:>5.0f}% {:>5.0f}% {} {} {:>8.3f}  {}'.format(
+        result['transport'], result['format'], result['display'], result['rate'], result['throughput'],
+        100 * result['reader_cpu'], 100 * result['consumer_cpu'], megabytes(result['reader_rss']),
+        megabytes(result['consumer_rss']), result['lag_growth'], result['failure'] or 'ok')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transports', nargs='+', choices=TRANSPORTS, default=list(TRANSPORTS),
+                        help='How blocks reach the consumer (default: all)')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=list(FORMATS),
+                        help='Log file formats (default: all)')
+    parser.add_argument('--displays', nargs='+', choices=DISPLAYS, default=list(DISPLAYS),
+                        help='Consumer display work: none, store (WaveformStore and decimated visible range per frame) '
+                             'or raster (store plus drawing the trace) (default: all)')
+    parser.add_argument('--rates', nargs='+', type=int, help='Sample rates to try, instead of a geometric series')
+    parser.add_argument('--start-rate', type=float, default=10000, help='First sample rate (default 10000)')
+    parser.add_argument('--factor', type=float, default=2.0, help='Ratio between successive rates (default 2)')
+    parser.add_argument('--max-rate', type=float, default=10000000, help='Highest sample rate (default 10000000)')
+    parser.add_argument('--reads-per-second', type=float, default=20,
+                        help='Reads per second; samples_per_read is the rate divided by it. The default 20 keeps the '
+                             'reads at most half the default DAQmx buffer up to 10 MS/s')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per step (default 5)')
+    parser.add_argument('--buffer-samples', type=int,
+                        help='Simulated device buffer (default: the DAQmx default for the sample rate)')
+    parser.add_argument('--buffer-bytes', type=int, default=64 * 2 ** 20,
+                        help='Memory budget of the UI queue or stream subscriber in bytes (default 64 MiB)')
+    parser.add_argument('--policy', choices=OVERFLOW_POLICIES, default='decimate',
+                        help='Overflow policy of the UI queue or stream subscriber (default decimate)')
+    parser.add_argument('--sample-dtype', choices=SAMPLE_DTYPES, default='float64',
+                        help='Sample dtype of the pipeline (default float64)')
+    parser.add_argument('--max-lag-growth', type=float, default=0.25,
+                        help='Largest growth of the consumer lag during a step, in seconds (default 0.25)')
+    parser.add_argument('--fps', type=float, default=30, help='Simulated display frame rate (default 30)')
+    parser.add_argument('--window', type=float, default=10.0, help='Visible time window in seconds (default 10)')
+    parser.add_argument('--width', type=int, default=1000, help='Simulated plot width in pixels (default 1000)')
+    parser.add_argument('--height', type=int, default=400, help='Simulated plot height in pixels (default 400)')
+    parser.add_argument('--frequency', type=float, default=50.0, help='Simulated signal frequency (default 50 Hz)')
+    parser.add_argument('--noise', type=float, default=0.1, help='Simulated noise in volts RMS (default 0.1)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the simulated noise (default 0)')
+    parser.add_argument('--keep-going', action='store_true',
+                        help='Keep raising the rate of a combination after a failed step')
+    parser.add_argument('--json', help='Also write the configuration and every step to this JSON file')
+    args = parser.parse_args()
+    if args.policy == 'block' and 'stream' in args.transports:
+        parser.error("the 'block' policy only applies to the ui transport, stream subscribers never slow the reader")
+
+    combinations = [(transport, file_format, display if transport != 'none' else 'none')
+                    for transport, file_format, display in itertools.product(args.transports, args.formats,
+                                                                              args.displays)]
+    # Without a consumer the display mode does not apply
+    combinations = list(dict.fromkeys(combinations))
+    rates = sweep_rates(args)
+    print('{} on {} ({} cores), Python {}'.format(platform.platform(), platform.processor() or platform.machine(),
+                                                  os.cpu_count(), platform.python_version()))
+    if psutil is None:
+        print('Install psutil to measure memory and the reader CPU time on every platform')
+    print('{:>6} {:>6} {:>6} {:>10} {:>12} {:>6} {:>6} {:>7} {:>7} {:>8}  {}'.format(
+        'trans', 'format', 'disp', 'rate', 'samples/s', 'reader', 'consum', 'MiB rdr', 'MiB con', 'lag +s', 'result'))
+
+    results = []
+    ceilings = []
+    for transport, file_format, display in combinations:
+        ceiling = None
+        for rate in rates:
+            with tempfile.TemporaryDirectory() as output_dir:
+                result = run_step(args, transport, file_format, display, rate, output_dir)
+            results.append(result)
+            print(format_result(result), flush=True)
+            if result['failure'] is None:
+                ceiling = rate
+            elif not args.keep_going:
+                break
+        ceilings.append({'transport': transport, 'format': file_format, 'display': display, 'ceiling': ceiling})
+
+    print('\nSustainable sample rate:')
+    for entry in ceilings:
+        print('  {transport:>6} {format:>6} {display:>6}  '.format(**entry) +
+              ('{} S/s'.format(entry['ceiling']) if entry['ceiling'] else 'below {} S/s'.format(rates[0])))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                       'steps': results, 'ceilings': ceilings}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+replay_benchmark.py: Repeatable throughput benchmark for the transport and display processing stages. A recorded
+session log is replayed as fast as possible (or at a given speed) by a ReplayReader process, exactly like live data,
+and this process consumes the blocks the way the UI does: appending them to a WaveformStore and extracting the decimated
+visible range once per simulated frame.
+
+Usage (from the top-level of the repository):
+
+    python benchmarks/replay_benchmark.py Output_Data.bin
+    python benchmarks/replay_benchmark.py Output_Data.csv --sample-rate 1000 --block-size 1000 --window 10
+"""
+
+import argparse
+import os
+import queue
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from block_buffer import BlockQueue
+from reader_entry import GLOBAL_ACK, STARTED_ACK, ControlChannel, Process, run_reader
+from session_log import SessionLog
+from waveform import ContinuityChecker, WaveformStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help='Session log written by DataWriter')
+    parser.add_argument('--block-size', type=int, default=1000, help='Samples per replayed block (default 1000)')
+    parser.add_argument('--speed', type=float, default=0, help='Replay speed, 0 for as fast as possible (default)')
+    parser.add_argument('--sample-rate', type=float, help='Sample rate for logs without block markers')
+    parser.add_argument('--window', type=float, default=10.0, help='Visible time window in seconds (default 10)')
+    parser.add_argument('--frame-blocks', type=int, default=10,
+                        help='Blocks consumed per simulated display frame (default 10)')
+    parser.add_argument('--width', type=int, default=1000, help='Simulated plot width in pixels (default 1000)')
+    parser.add_argument('--buffer-bytes', type=int, default=64 * 2 ** 20,
+                        help='Memory budget of the UI queue in bytes (default 64 MiB)')
+    args = parser.parse_args()
+
+    session_log = SessionLog(args.log, sample_rate=args.sample_rate)
+    total_samples = len(session_log)
+    task_configuration = {'sample_clock_source': 'OnBoardClock', 'sample_rate': args.sample_rate or 1000,
+                          'samples_per_read': args.block_size, 'channel': 0, 'dev_name': 'Replay',
+                          'max_voltage': 10, 'min_voltage': -10, 'terminal_configuration': 'DEFAULT',
+                          'replay_file': args.log, 'replay_speed': args.speed}
+    # The 'block' policy makes the replay wait for this process, so every sample is measured
+    ui_queue = BlockQueue(args.buffer_bytes, 'block')
+    control = ControlChannel()
+    process = Process(target=run_reader, args=(task_configuration, ui_queue, control))
+    process.start()
+    if not control.wait_for_ack(STARTED_ACK, process):
+        print('Replay failed to start: ' + str(process.exception))
+        return 1
+
+    # Binary logs are replayed in the dtype they were recorded in
+    store = WaveformStore(dtype=session_log.dtype)
+    continuity = ContinuityChecker()
+    received = blocks = 0
+    display_time = 0.0
+    start = perf_counter()
+    while received < total_samples:
+        try:
+            block = ui_queue.get(timeout=5.0)
+        except queue.Empty:
+            print('Timed out waiting for data after {} of {} samples'.format(received, total_samples))
+            break
+        t = perf_counter()
+        continuity.check(block)
+        store.append(block)
+        blocks += 1
+        received += len(block)
+        if blocks % args.frame_blocks == 0:
+            store.visible(store.t_end - args.window, store.t_end, max_points=2 * args.width)
+        display_time += perf_counter() - t
+    elapsed = perf_counter() - start
+
+    control.stop()
+    control.wait_for_ack(GLOBAL_ACK, process)
+    ui_queue.discard(process)
+    process.join()
+
+    print('Replayed {} samples in {} blocks in {:.3f} s'.format(received, blocks, elapsed))
+    print('  throughput     {:12.0f} samples/s {:10.0f} blocks/s'.format(received / elapsed, blocks / elapsed))
+    print('  display stage  {:12.3f} s ({:.1f}% of the time)'.format(display_time, 100 * display_time / elapsed))
+    print('  continuity     ' + continuity.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+startup_benchmark.py: Measures how long the modules of this app take to import in a fresh interpreter and how long the
+Kivy app takes to show its first frame and its first plot.
+
+The import time of daqmx_with_kivy is the cost every spawned reader process pays, since under the spawn start method
+the child re-imports the main script before running its target.
+
+Usage (from the top-level of the repository):
+
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --repeat 10 --no-app
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ('reader_entry', 'daqmx_with_kivy', 'daqmx_reader', 'graph_generator', 'graph_widget')
+
+IMPORT_SNIPPET = '''
+from time import perf_counter
+start = perf_counter()
+import {module}
+print(perf_counter() - start)
+'''
+
+
+def time_import(module, repeat):
+    """
+    Returns the median import time of module in seconds, or None if it cannot be imported here.
+    """
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET.format(module=module)], cwd=REPO_DIR,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return statistics.median(times)
+
+
+def time_app_startup(timeout):
+    """
+    Launches the app in benchmark mode and returns a dict with the first_frame and first_plot times in seconds,
+    measured from app start, plus the total wall time including interpreter startup and shutdown.
+    """
+    env = dict(os.environ, DAQMX_STARTUP_BENCHMARK='1')
+    start = perf_counter()
+    result = subprocess.run([sys.executable, 'daqmx_with_kivy.py'], cwd=REPO_DIR, env=env, capture_output=True,
+                            text=True, timeout=timeout)
+    timings = {'wall': perf_counter() - start}
+    for line in result.stdout.splitlines():
+        name, _, value = line.partition(' ')
+        if name in ('first_frame', 'first_plot'):
+            timings[name] = float(value)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='Number of fresh interpreters per import measurement')
+    parser.add_argument('--no-app', action='store_true', help='Skip launching the Kivy app')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Seconds to wait for the app to exit')
+    args = parser.parse_args()
+
+    print('Import time (median of {} runs)'.format(args.repeat))
+    for module in MODULES:
+        seconds = time_import(module, args.repeat)
+        if seconds is None:
+            print('  {:<20} unavailable (missing dependency?)'.format(module))
+        else:
+            print('  {:<20} {:8.1f} ms'.format(module, seconds * 1000))
+
+    if not args.no_app:
+        timings = time_app_startup(args.timeout)
+        print('App startup')
+        for name in ('first_frame', 'first_plot', 'wall'):
+            if name in timings:
+                print('  {:<20} {:8.1f} ms'.format(name, timings[name] * 1000))
+            else:
+                print('  {:<20} not reported'.format(name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+"""
+block_buffer.py: Bounded buffering of WaveformBlocks between the reader and its consumers. Every transport that can fall
+behind the acquisition (the UI queue and each stream subscriber) gets a memory budget and an overflow policy:
+
+    'block' - wait for the consumer to catch up (the acquisition waits too)
+    'drop-oldest' - drop the oldest buffered blocks to make room
+    'drop-newest' - drop the incoming block
+    'decimate' - halve the sample rate of the buffered blocks, oldest first, so the display degrades gracefully
+
+Every dropped sample is counted. The data writer is not a buffered transport: it writes each block in the acquisition
+loop, so logging is lossless whatever happens to the display.
+
+Only the standard library is imported, so the app can create a BlockQueue without importing numpy.
+"""
+
+import collections
+import multiprocessing
+import queue
+import threading
+
+from reader_entry import END_OF_DATA, discard_blocks
+
+OVERFLOW_POLICIES = ('block', 'drop-oldest', 'drop-newest', 'decimate')
+
+
+def block_nbytes(block):
+    return 0 if block is END_OF_DATA else block.samples.nbytes
+
+
+class BlockBuffer:
+    """
+    Thread-safe FIFO of blocks holding at most memory_budget bytes of samples. A single block larger than the budget is
+    still accepted into an empty buffer.
+    """
+
+    def __init__(self, memory_budget, policy='drop-oldest'):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Invalid overflow policy. Valid options include ' + ', '.join(OVERFLOW_POLICIES))
+        self.memory_budget = memory_budget
+        self.policy = policy
+        self.nbytes = 0
+        self.dropped_samples = 0
+        self.dropped_blocks = 0
+        self._blocks = collections.deque()
+        self._condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def _drop(self, block):
+        self.dropped_samples += len(block)
+        self.dropped_blocks += 1
+
+    def _decimate(self, incoming):
+        """
+        Halves the sample rate of buffered blocks, oldest first, until incoming more bytes fit in the budget. Returns
+        False if no block could be decimated any further.
+        """
+        decimated = False
+        for i, block in enumerate(self._blocks):
+            if self.nbytes + incoming <= self.memory_budget:
+                break
+            if block is END_OF_DATA or len(block) < 2:
+                continue
+            # Copy, so the memory of the full rate samples is actually released
+            samples = block.samples[::2].copy()
+            self.nbytes -= block.samples.nbytes - samples.nbytes
+            self.dropped_samples += len(block) - samples.shape[0]
+            self._blocks[i] = type(block)(block.seq, block.t0, block.dt * 2, samples, block.first_sample,
+                                          block.acquired, block.source_samples)
+            decimated = True
+        return decimated
+
+    def put(self, block, abort=None):
+        """
+        Adds a block, applying the overflow policy when it does not fit in the budget.
+
+        :param block: The block to add. END_OF_DATA always fits.
+        :param abort: For the 'block' policy, a function returning True when waiting should be given up (e.g. on a stop
+                    request). The block is then dropped.
+        :return: True if the block was added
+        """
+        n = block_nbytes(block)
+        with self._condition:
+            # A buffered block larger than the budget leaves the buffer over it, so END_OF_DATA is not checked at all
+            while block is not END_OF_DATA and self._blocks and self.nbytes + n > self.memory_budget:
+                if self.policy == 'block':
+                    if abort is not None and abort():
+                        self._drop(block)
+                        return False
+                    self._condition.wait(0.05)
+                elif self.policy == 'drop-newest':
+                    self._drop(block)
+                    return False
+                elif self.policy == 'decimate' and self._decimate(n):
+                    # Decimating the buffered blocks may not have freed enough yet, the loop checks again
+                    continue
+                else:
+                    oldest = self._blocks.popleft()
+                    self.nbytes -= block_nbytes(oldest)
+                    if oldest is not END_OF_DATA:
+                        self._drop(oldest)
+            self._blocks.append(block)
+            self.nbytes += n
+            self._condition.notify_all()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest block, waiting up to timeout seconds (forever for None) for one.
+
+        :raises queue.Empty: if no block arrived in time
+        """
+        with self._condition:
+            if not self._blocks and not self._condition.wait_for(lambda: self._blocks, timeout):
+                raise queue.Empty
+            block = self._blocks.popleft()
+            self.nbytes -= block_nbytes(block)
+            self._condition.notify_all()
+        return block
+
+    def wait_nonempty(self, timeout=None):
+        """
+        Waits up to timeout seconds (forever for None) until the buffer holds a block, without removing it.
+
+        :return: True if the buffer holds a block
+        """
+        with self._condition:
+            return bool(self._condition.wait_for(lambda: self._blocks, timeout))
+
+    def peek_nbytes(self):
+        """
+        Returns the size of the oldest block, or None when the buffer is empty.
+        """
+        with self._condition:
+            return block_nbytes(self._blocks[0]) if self._blocks else None
+
+    def clear(self):
+        """
+        Removes every block without counting them as dropped (e.g. at the end of an acquisition).
+        """
+        with self._condition:
+            self._blocks.clear()
+            self.nbytes = 0
+            self._condition.notify_all()
+
+
+class BlockQueue:
+    """
+    Bounded replacement for a multiprocessing.Queue carrying blocks from a reader process to a consumer process.
+
+    The budget covers the blocks buffered in the reader process plus the blocks on their way through the pipe. A
+    sender thread in the reader process moves blocks into the pipe while less than a quarter of the budget is in
+    transit, so the overflow policy acts on the blocks the consumer has not received yet. The consumer reports what it
+    takes, which frees budget. Pass the queue to the reader process as a Process argument.
+    """
+
+    def __init__(self, memory_budget=64 * 2 ** 20, policy='decimate'):
+        """
+        :param memory_budget: Bytes of samples the queue may hold
+        :param policy: One of OVERFLOW_POLICIES
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Invalid overflow policy. Valid options include ' + ', '.join(OVERFLOW_POLICIES))
+        self.memory_budget = memory_budget
+        self.policy = policy
+        self._queue = multiprocessing.Queue()
+        # Bytes of samples in the pipe, not taken by the consumer yet
+        self._in_flight = multiprocessing.Value('q', 0)
+        # Released by the consumer when it frees budget while the sender thread waits for it. Notifying a
+        # multiprocessing.Condition hangs once a waiter died with its process, so a semaphore is used instead.
+        self._sender_waiting = multiprocessing.Value('b', 0, lock=False)
+        self._space = multiprocessing.Semaphore(0)
+        self._dropped_samples = multiprocessing.Value('q', 0, lock=False)
+        self._dropped_blocks = multiprocessing.Value('q', 0, lock=False)
+        # Reader side state, created by the first put()
+        self._buffer = None
+        self._flushing = False
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_buffer'] = None
+        state['_flushing'] = False
+        return state
+
+    @property
+    def dropped_samples(self):
+        """
+        Number of samples dropped (or removed by decimation) so far.
+        """
+        return self._dropped_samples.value
+
+    @property
+    def dropped_blocks(self):
+        return self._dropped_blocks.value
+
+    def put(self, block, abort=None):
+        """
+        Reader side: queues a block, applying the overflow policy. See BlockBuffer.put. After END_OF_DATA, the remaining
+        blocks are sent regardless of the budget: the consumer either takes them all or discards them in bulk, without
+        accounting for them.
+        """
+        if self._buffer is None:
+            # The budget left for the reader side buffer once a quarter of it is in transit
+            self._buffer = BlockBuffer(self.memory_budget - self.memory_budget // 4, self.policy)
+            threading.Thread(target=self._send_loop, name='block-queue', daemon=True).start()
+        if block is END_OF_DATA:
+            self._flushing = True
+        added = self._buffer.put(block, abort)
+        self._dropped_samples.value = self._buffer.dropped_samples
+        self._dropped_blocks.value = self._buffer.dropped_blocks
+        return added
+
+    def _send_loop(self):
+        window = max(self.memory_budget // 4, 1)
+        while True:
+            n = self._buffer.peek_nbytes()
+            if n is None:
+                # Wait for the next block without holding it, so the overflow policy can still act on it
+                self._buffer.wait_nonempty(0.05)
+                continue
+            with self._in_flight.get_lock():
+                full = not self._flushing and self._in_flight.value and self._in_flight.value + n > window
+                self._sender_waiting.value = bool(full)
+            if full:
+                self._space.acquire(timeout=0.05)
+                continue
+            block = self._buffer.get()
+            with self._in_flight.get_lock():
+                self._in_flight.value += block_nbytes(block)
+            self._queue.put(block)
+            if block is END_OF_DATA:
+                self._flushing = False
+
+    def get(self, block=True, timeout=None):
+        """
+        Consumer side: removes and returns the next block. Mirrors queue.Queue.get.
+
+        :raises queue.Empty: if no block is available
+        """
+        item = self._queue.get(block, timeout)
+        self._free(block_nbytes(item))
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def discard(self, process):
+        """
+        Consumer side: discards everything up to the END_OF_DATA of the reader's acquisition, or until the reader dies,
+        in bulk. See reader_entry.discard_blocks.
+        """
+        discard_blocks(self._queue, process)
+        # Nothing is in transit any more: the reader sends nothing between END_OF_DATA and the next start
+        self._free(None)
+
+    def _free(self, nbytes):
+        """
+        Consumer side: frees nbytes of the budget (all of it for None) and wakes up the sender thread if it waits.
+        """
+        with self._in_flight.get_lock():
+            if nbytes is None:
+                self._in_flight.value = 0
+            else:
+                self._in_flight.value -= nbytes
+            waiting = self._sender_waiting.value
+            self._sender_waiting.value = 0
+        if waiting:
+            self._space.release()
@@ -0,0 +1,184 @@
+"""
+daqmx_headless.py: Headless entry point for running a DAQmx acquisition without Kivy, e.g. on a DAQ box without a
+display. The task configuration is read from a JSON file and/or command line flags (flags take precedence), the
+AnalogInputReader runs in a background thread while the main thread logs periodic throughput statistics, and SIGINT or
+SIGTERM stop the acquisition cleanly so the log file is always closed.
+
+Usage:
+
+    python daqmx_headless.py --dev-name PXI1Slot2 --sample-rate 1000 --samples-per-read 100
+    python daqmx_headless.py --config task.json --output run1.csv --stats-interval 10
+    python daqmx_headless.py --stream tcp://127.0.0.1:5555
+    python daqmx_headless.py --replay Output_Data.bin --replay-speed 10 --stream tcp://127.0.0.1:5555
+    python daqmx_headless.py --cpu-affinity 2,3 --nice -10
+
+The JSON file uses the same keys as the task configuration of the Kivy app, for example:
+
+    {"dev_name": "PXI1Slot2", "channel": 0, "sample_rate": 1000, "samples_per_read": 100,
+     "min_voltage": -5, "max_voltage": 5, "terminal_configuration": "DEFAULT",
+     "trigger": {"mode": "rising", "level": 1.0, "pre_samples": 100, "post_samples": 400},
+     "stages": [{"function": "scale", "kwargs": {"gain": 100.0}}]}
+"""
+
+import argparse
+import json
+import logging
+import signal
+import sys
+import threading
+from time import perf_counter
+
+from reader_entry import GLOBAL_ACK, STARTED_ACK, ControlChannel, reader_class
+
+log = logging.getLogger('daqmx_headless')
+
+
+def parse_cores(text):
+    """
+    Parses a comma separated list of cores and core ranges, e.g. '2,3' or '0-3,6'.
+    """
+    cores = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def parse_rates(text):
+    """
+    Parses a comma separated list of rates in Hz, e.g. '1000,10'.
+    """
+    return [float(rate) for rate in text.split(',')]
+
+
+# Defaults matching the Kivy app
+DEFAULT_TASK_CONFIGURATION = {'sample_clock_source': 'OnBoardClock', 'sample_rate': 1000, 'samples_per_read': 100,
+                              'channel': 0, 'dev_name': 'PXI1Slot2', 'max_voltage': 5, 'min_voltage': -5,
+                              'terminal_configuration': 'DEFAULT', 'trigger': None,
+                              'output_file': 'Output_Data.csv', 'file_format': 'csv', 'sample_dtype': 'float64'}
+
+# Command line flags overriding task configuration keys: (flag, key, type)
+CONFIGURATION_FLAGS = (
+    ('--dev-name', 'dev_name', str),
+    ('--channel', 'channel', int),
+    ('--sample-rate', 'sample_rate', int),
+    ('--samples-per-read', 'samples_per_read', int),
+    ('--min-voltage', 'min_voltage', float),
+    ('--max-voltage', 'max_voltage', float),
+    ('--terminal-configuration', 'terminal_configuration', str),
+    ('--sample-clock-source', 'sample_clock_source', str),
+    ('--output', 'output_file', str),
+    ('--file-format', 'file_format', str),
+    ('--sample-dtype', 'sample_dtype', str),
+    ('--summary-rates', 'summary_rates', parse_rates),
+    ('--stream', 'stream_address', str),
+    ('--stream-buffer-bytes', 'stream_buffer_bytes', int),
+    ('--stream-policy', 'stream_policy', str),
+    ('--replay', 'replay_file', str),
+    ('--replay-speed', 'replay_speed', float),
+    ('--cpu-affinity', 'cpu_affinity', parse_cores),
+    ('--nice', 'nice', int),
+    ('--realtime-priority', 'realtime_priority', int),
+)
+
+
+class ReaderThread(threading.Thread):
+    """
+    Thread running AnalogInputReader.run() which keeps any exception for the main thread to report.
+    """
+
+    def __init__(self, reader):
+        super().__init__(name='daqmx-reader', daemon=True)
+        self.reader = reader
+        self.exception = None
+
+    def run(self):
+        try:
+            self.reader.run()
+        except Exception as e:
+            self.exception = e
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Run a continuous DAQmx analog input acquisition without a UI.')
+    parser.add_argument('--config', help='JSON file holding the task configuration')
+    for flag, key, value_type in CONFIGURATION_FLAGS:
+        parser.add_argument(flag, dest=key, type=value_type, help='Overrides ' + key)
+    parser.add_argument('--stats-interval', type=float, default=5.0,
+                        help='Seconds between throughput log messages (default 5)')
+    parser.add_argument('--log-level', default='INFO', help='Logging level (default INFO)')
+    return parser.parse_args(argv)
+
+
+def load_task_configuration(args):
+    """
+    Builds the task configuration from the defaults, the optional JSON file and the command line flags.
+    """
+    task_configuration = dict(DEFAULT_TASK_CONFIGURATION)
+    if args.config:
+        with open(args.config) as f:
+            task_configuration.update(json.load(f))
+    for _, key, _ in CONFIGURATION_FLAGS:
+        value = getattr(args, key)
+        if value is not None:
+            task_configuration[key] = value
+    return task_configuration
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(message)s')
+    task_configuration = load_task_configuration(args)
+    log.info('Task configuration: %s', task_configuration)
+
+    control = ControlChannel()
+    # Nothing displays the data, so the reader does not need a UI queue
+    # reader_class imports the reader lazily, so --help works without the DAQmx driver installed
+    reader = reader_class(task_configuration)(task_configuration, None, control)
+    reader_thread = ReaderThread(reader)
+
+    shutdown = threading.Event()
+
+    def request_shutdown(signum, _):
+        log.info('Received %s, stopping acquisition', signal.Signals(signum).name)
+        shutdown.set()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+
+    reader_thread.start()
+    if not control.wait_for_ack(STARTED_ACK, reader_thread):
+        log.error('Reader failed to start: %s', reader_thread.exception)
+        return 1
+    log.info('Acquisition started, logging to %s', reader.output_file or 'nothing')
+
+    start_time = last_time = perf_counter()
+    last_samples = 0
+    while not shutdown.wait(args.stats_interval):
+        if not reader_thread.is_alive():
+            break
+        now = perf_counter()
+        samples = reader.samples_read
+        log.info('%d samples acquired, %.1f S/s (average %.1f S/s), read jitter: %s', samples,
+                 (samples - last_samples) / (now - last_time), samples / (now - start_time),
+                 reader.read_jitter.summary())
+        pipeline = reader.pipeline
+        if pipeline is not None:
+            log.info('Processing: %s', '; '.join(pipeline.summary()))
+        if reader.stream_server is not None and reader.stream_server.dropped_samples:
+            log.warning('%d samples dropped for slow stream subscribers', reader.stream_server.dropped_samples)
+        last_time, last_samples = now, samples
+
+    if reader_thread.is_alive():
+        control.stop()
+        control.wait_for_ack(GLOBAL_ACK, reader_thread)
+    reader_thread.join()
+    if reader_thread.exception is not None:
+        log.error('Reader stopped on error: %s', reader_thread.exception)
+        return 1
+    log.info('Acquisition stopped after %d samples', reader.samples_read)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
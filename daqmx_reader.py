@@ -5,44 +5,97 @@ parameters. In a sense it is a mini API allowing a caller to very easily launch
 Inspiration and assistance provided by the following:
 https://github.com/pbellino/daq_nidaqmx_example
 https://nidaqmx-python.readthedocs.io
+
+nidaqmx is only imported by the methods driving the DAQmx task, so the readers built on AnalogInputReader that replace
+them (ReplayReader, SimulatedReader) run on machines without NI-DAQmx.
 """
 
-import multiprocessing
-import queue
+from time import perf_counter
 
-import nidaqmx
 import numpy as np
-from nidaqmx.constants import AcquisitionType
-from nidaqmx.stream_readers import AnalogSingleChannelReader
 
 from file_writer import DataWriter
+from log_index import DEFAULT_CHUNK_SAMPLES
+from processing import ProcessingPipeline
+# The protocol constants and the Process wrapper live in the lightweight reader_entry module. They are re-exported here
+# for callers that already import them from this module.
+from reader_entry import GLOBAL_ACK, CMD_START, CMD_CONFIGURE, CMD_QUIT, READY_ACK, STARTED_ACK, END_OF_DATA, \
+    ControlChannel, Process, discard_blocks
+from scheduling import JitterMonitor, apply_scheduling
+from stream_server import BlockServer
+from trigger import LevelTrigger
+from waveform import SAMPLE_DTYPES, WaveformBlock
 
-# Global Constants
-# TODO: These should be defined elsewhere as they are reused in multiple files in this app
-GLOBAL_STOP = 'S'
-GLOBAL_ACK = 'F'
+# Longest time, in seconds, a pending read waits before checking for a stop request
+MAX_STOP_LATENCY = 0.05
 
 
 class AnalogInputReader:
     """
     Class for creating, configuring, running, and closing a DAQmx task. You must initialize, run and close the reader
     in a separate thread or process to allow the run_process to run independently of your main application.
+
+    The reader can be used in two ways. run() performs a single acquisition from task creation until the caller asks it
+    to stop. serve() keeps the process alive across acquisitions: the task is committed (its resources reserved) ahead
+    of time and the caller starts, stops and reconfigures it over the ControlChannel, waiting for its ACKs for readiness
+    instead of sleeping.
     """
 
-    def __init__(self, task_configuration, ui_queue, cmd_queue, ack_queue):
+    def __init__(self, task_configuration, ui_queue, control):
         """
-        Creates a new AnalogInputReader with the specified task configuration and queue references.
+        Creates a new AnalogInputReader with the specified task configuration, UI queue and control channel.
 
         :param task_configuration:
                     self.task_configuration = {'sample_clock_source': 'OnBoardClock', 'sample_rate': 60,
                                        'samples_per_read': 30,
                                        'channel': 0, 'dev_name': 'PXI1Slot2', 'max_voltage': 5, 'min_voltage': -5,
                                        'terminal_configuration': TerminalConfiguration.DEFAULT}
-        :param ui_queue: A multiprocessing queue that sends acquired float_64 data back to the caller
-        :param cmd_queue: A multiprocessing queue that receives a stop command character from the caller
-        :param ack_queue: A multiprocessing queue that send an ACK command back to the caller
+                    An optional 'trigger' entry holding a dict of LevelTrigger keyword arguments enables trigger mode,
+                    in which only the captured events are sent to the UI queue and the data writer. An optional
+                    'output_file' entry sets the log file name (default Output_Data.csv, None disables logging) and
+                    'file_format' selects the DataWriter format ('csv' or 'binary'), 'index_chunk_samples' the chunk
+                    size of a binary log's summary index (None disables it) and 'summary_rates' a list of rates in Hz of
+                    decimated min/max/mean summary streams written next to the log. An optional 'stream_address'
+                    entry ('tcp://host:port' or 'unix:///path') publishes every block to local subscribers, with
+                    'stream_buffer_bytes' (the memory budget per subscriber) and 'stream_policy' (the slow client
+                    policy) passed on to the BlockServer. Optional 'cpu_affinity' (a list of cores), 'nice' and
+                    'realtime_priority' entries set the scheduling of the reader, see scheduling.apply_scheduling.
+                    An optional 'sample_dtype' entry ('float64' or 'float32', default 'float64') sets the dtype of
+                    the samples in the blocks, and so in the UI queue, the stream, the log and the plot. An optional
+                    'stages' entry lists processing stages (e.g. calibration) every block runs through before it
+                    reaches the consumers, see processing.Stage; in trigger mode they process the captured events.
+        :param ui_queue: A BlockQueue that sends acquired WaveformBlocks back to the caller within its memory budget,
+                    or None when nothing displays the data (e.g. when running headless)
+        :param control: The ControlChannel the caller uses to send commands and stop requests and to receive ACKs
         """
         self._exception = None
+        self.reader_task = None
+        self.ui_queue = ui_queue
+        self.control = control
+        # Number of samples read from the DAQmx buffer during the current acquisition
+        self.samples_read = 0
+        self.stream_server = None
+        self.stream_settings = None
+        self.pipeline = None
+        self.pipeline_settings = None
+        # Sequence number of the next block sent during the current acquisition
+        self.block_count = 0
+        # Samples acquired by the hardware when the last block was read, counted from the start of the acquisition
+        self.samples_acquired = 0
+        # Time of the first sample since the task was last (re)started, and samples_read at that point. Live
+        # reconfiguration restarts the task, so sample numbers from read() count from the restart.
+        self.t_offset = 0.0
+        self.sample_offset = 0
+        self._last_read_time = None
+        self.writer = None
+        self.configure(task_configuration)
+        # Deviation of the intervals between reads from samples_per_read / sample_rate
+        self.read_jitter = JitterMonitor(self.samples_per_read / self.sample_rate)
+
+    def configure(self, task_configuration):
+        """
+        Stores a new task configuration. It takes effect the next time the task is created.
+        """
         self.sample_clock_source = task_configuration['sample_clock_source']
         self.sample_rate = task_configuration['sample_rate']
         self.samples_per_read = task_configuration['samples_per_read']
@@ -51,101 +104,433 @@ class AnalogInputReader:
         self.min_voltage = task_configuration['min_voltage']
         self.max_voltage = task_configuration['max_voltage']
         self.terminal_configuration = task_configuration['terminal_configuration']
-        self.ui_queue = ui_queue
-        self.cmd_queue = cmd_queue
-        self.ack_queue = ack_queue
-        # Create an empty numpy array of proper size to use for DAQmx stream reading
+        self.output_file = task_configuration.get('output_file', 'Output_Data.csv')
+        self.file_format = task_configuration.get('file_format', 'csv')
+        self.index_chunk_samples = task_configuration.get('index_chunk_samples', DEFAULT_CHUNK_SAMPLES)
+        self.summary_rates = task_configuration.get('summary_rates') or ()
+        self.stream_address = task_configuration.get('stream_address')
+        self.stream_buffer_bytes = task_configuration.get('stream_buffer_bytes', 16 * 2 ** 20)
+        self.stream_policy = task_configuration.get('stream_policy', 'drop-oldest')
+        self.cpu_affinity = task_configuration.get('cpu_affinity')
+        self.nice = task_configuration.get('nice')
+        self.realtime_priority = task_configuration.get('realtime_priority')
+        self.stages = task_configuration.get('stages') or []
+        sample_dtype = task_configuration.get('sample_dtype', 'float64')
+        if sample_dtype not in SAMPLE_DTYPES:
+            raise ValueError('Invalid sample dtype. Valid options include ' + ', '.join(SAMPLE_DTYPES))
+        self.sample_dtype = np.dtype(sample_dtype)
+        # Only create a trigger when trigger mode is requested, otherwise every sample is passed on
+        trigger_configuration = task_configuration.get('trigger')
+        self.trigger = LevelTrigger(dtype=self.sample_dtype, **trigger_configuration) if trigger_configuration else None
+        # Create an empty numpy array of proper size to use for DAQmx stream reading. The DAQmx stream reader only
+        # reads into float64 arrays; make_block converts each block to sample_dtype.
         self.input_data = np.empty(shape=(self.samples_per_read,))
 
-    def run(self):
+    def apply_scheduling(self):
         """
-        Read from the DAQmx task which is acquiring at sample_rate.Each loop iteration acquires samples_per_read and
-        adds the samples to both the io and ui queues for logging and display. The default timeout is 10 seconds.
-        """
-        with nidaqmx.Task() as self.reader_task:
-            # Create a temp dict to pass multiple arguments more easily
-            chan_args = {
-                "min_val": self.min_voltage,
-                "max_val": self.max_voltage,
-                "terminal_config": self.terminal_configuration
-            }
-            # Build the proper channel name using the device + channel
-            channel_name = self.dev_name + "/ai" + str(self.channel)
-
-            # Add the DAQmx channel to the task
-            self.reader_task.ai_channels.add_ai_voltage_chan(channel_name, **chan_args)
-
-            # Configure the timing of the task. Notice we do not specify the samples per channel. As this program only
-            # supports continuous acquisitions, samples per channel simply specifies the DAQmx PC buffer size which
-            # is usually ignored anyway as the default is sufficient.
-            # For more info, see: https://knowledge.ni.com/KnowledgeArticleDetails?id=kA03q000000YHpECAW&l=en-US
-            self.reader_task.timing.cfg_samp_clk_timing(rate=self.sample_rate, sample_mode=AcquisitionType.CONTINUOUS)
-
-            # Run the task if it was created successfully
-            self.reader_task.start()
-            self.reader = AnalogSingleChannelReader(self.reader_task.in_stream)
-
-            # Initialize the data writer for logging
-            self.writer = DataWriter()
+        Applies the configured CPU affinity and priority to the calling thread, and so to the threads it starts
+        afterwards (the UI queue and stream senders). Sender threads started before a reconfiguration keep the
+        settings they started with.
+        """
+        apply_scheduling(self.cpu_affinity, self.nice, self.realtime_priority, name='reader')
 
-            while True:
-                # Read from the DAQmx buffer the required number of samples on the configured channel, waiting,
-                # if needed, up to timeout for the requested number_of_samples_per_channel becomes available
-                self.reader.read_many_sample(data=self.input_data,
-                                             number_of_samples_per_channel=self.samples_per_read,
-                                             timeout=10.0)
-                # Use the map keyword to more quickly append our data to the UI queue
-                list(map(self.ui_queue.put, self.input_data))
-                # Write our data to the data writer
-                self.writer.write_data(self.input_data)
-                try:
-                    msg = self.cmd_queue.get(block=False)
-                except queue.Empty:
-                    # The queue get method will throw this exception if empty. We don't care if it's empty,
-                    # so we ignore it
-                    msg = ""
-                if msg == GLOBAL_STOP:
-                    # Exit when the caller sends a global stop
-                    break
-            self.writer.close_file()
-        self.stop_process()
+    def daqmx_terminal_configuration(self):
+        """
+        Returns the configured nidaqmx TerminalConfiguration. Callers that avoid importing nidaqmx pass its name
+        instead.
+        """
+        from nidaqmx.constants import TerminalConfiguration
+        if isinstance(self.terminal_configuration, str):
+            return TerminalConfiguration[self.terminal_configuration]
+        return self.terminal_configuration
+
+    def create_task(self):
+        """
+        Creates the DAQmx task from the current configuration and commits it, so that starting it later only has to
+        start the hardware.
+        """
+        import nidaqmx
+        from nidaqmx.constants import AcquisitionType, TaskMode
+        from nidaqmx.stream_readers import AnalogSingleChannelReader
 
+        self.reader_task = nidaqmx.Task()
+        # Create a temp dict to pass multiple arguments more easily
+        chan_args = {
+            "min_val": self.min_voltage,
+            "max_val": self.max_voltage,
+            "terminal_config": self.daqmx_terminal_configuration()
+        }
+        # Build the proper channel name using the device + channel
+        channel_name = self.dev_name + "/ai" + str(self.channel)
 
-    def stop_process(self):
+        # Add the DAQmx channel to the task
+        self.reader_task.ai_channels.add_ai_voltage_chan(channel_name, **chan_args)
+
+        # Configure the timing of the task. Notice we do not specify the samples per channel. As this program only
+        # supports continuous acquisitions, samples per channel simply specifies the DAQmx PC buffer size which
+        # is usually ignored anyway as the default is sufficient.
+        # For more info, see: https://knowledge.ni.com/KnowledgeArticleDetails?id=kA03q000000YHpECAW&l=en-US
+        self.reader_task.timing.cfg_samp_clk_timing(rate=self.sample_rate, sample_mode=AcquisitionType.CONTINUOUS)
+
+        # Verify and reserve the hardware now. A committed task returns to the committed state when stopped, so it
+        # can be started again quickly.
+        self.reader_task.control(TaskMode.TASK_COMMIT)
+        self.reader = AnalogSingleChannelReader(self.reader_task.in_stream)
+
+    def update_task(self, previous_configuration):
         """
-        Flush the queues and send the final message back to the caller.
+        Applies the current configuration to the existing, stopped task where DAQmx allows it: voltage range, terminal
+        configuration and sample rate are channel and timing properties that can be changed in place, followed by a new
+        commit. A different device or channel needs a new task.
+
+        :param previous_configuration: The (dev_name, channel) the task was created with
+        :return: True if the task was updated, False if it has to be recreated
         """
-        while not self.ui_queue.empty():
-            self.ui_queue.get()
-        while not self.cmd_queue.empty():
-            self.cmd_queue.get()
-        while not self.ack_queue.empty():
-            self.ack_queue.get()
-        # Send the global ACK back to the caller letting it know we are ready to die
-        self.ack_queue.put(GLOBAL_ACK)
+        from nidaqmx.constants import AcquisitionType, TaskMode
 
+        if previous_configuration != (self.dev_name, self.channel):
+            return False
+        channel = self.reader_task.ai_channels[0]
+        # Set the limits in an order that never makes the range empty
+        if self.min_voltage >= channel.ai_max:
+            channel.ai_max = self.max_voltage
+            channel.ai_min = self.min_voltage
+        else:
+            channel.ai_min = self.min_voltage
+            channel.ai_max = self.max_voltage
+        channel.ai_term_cfg = self.daqmx_terminal_configuration()
+        self.reader_task.timing.cfg_samp_clk_timing(rate=self.sample_rate, sample_mode=AcquisitionType.CONTINUOUS)
+        self.reader_task.control(TaskMode.TASK_COMMIT)
+        return True
 
-class Process(multiprocessing.Process):
-    """
-    Class which returns child Exceptions to Parent.
-    https://stackoverflow.com/a/33599967/4992248
-    """
+    def close_task(self):
+        """
+        Clears the DAQmx task, releasing its resources.
+        """
+        if self.reader_task is not None:
+            self.reader_task.close()
+            self.reader_task = None
 
-    def __init__(self, *args, **kwargs):
-        multiprocessing.Process.__init__(self, *args, **kwargs)
-        self._parent_conn, self._child_conn = multiprocessing.Pipe()
-        self._exception = None
+    def update_stream(self):
+        """
+        Starts, restarts or stops the block server so it matches the current configuration. Subscribers stay
+        connected across acquisitions as long as the stream settings do not change.
+        """
+        settings = (self.stream_address, self.stream_buffer_bytes, self.stream_policy)
+        if self.stream_server is not None and settings != self.stream_settings:
+            self.close_stream()
+        if self.stream_address and self.stream_server is None:
+            self.stream_server = BlockServer(self.stream_address, max_buffered_bytes=self.stream_buffer_bytes,
+                                             slow_client_policy=self.stream_policy)
+            self.stream_server.start()
+            self.stream_settings = settings
+
+    def close_stream(self):
+        """
+        Disconnects all subscribers and stops the block server.
+        """
+        if self.stream_server is not None:
+            self.stream_server.close()
+            self.stream_server = None
+
+    def update_pipeline(self):
+        """
+        Creates, recreates or closes the processing pipeline so it matches the current configuration. Blocks still in
+        the previous pipeline are delivered first. The pools stay up across acquisitions as long as the stages do not
+        change.
+        """
+        if self.pipeline is not None and self.stages != self.pipeline_settings:
+            self.close_pipeline()
+        if self.stages and self.pipeline is None:
+            self.pipeline = ProcessingPipeline(self.stages)
+            self.pipeline_settings = self.stages
+
+    def flush_pipeline(self):
+        """
+        Waits for the blocks in the processing pipeline and delivers them.
+        """
+        if self.pipeline is not None:
+            for block in self.pipeline.drain():
+                self.deliver_block(block)
+
+    def close_pipeline(self):
+        """
+        Delivers the blocks in the processing pipeline and shuts its pools down.
+        """
+        if self.pipeline is not None:
+            try:
+                self.flush_pipeline()
+            finally:
+                self.pipeline.close()
+                self.pipeline = None
+
+    def make_block(self, samples, first_sample, sample_number):
+        """
+        Wraps acquired samples in a WaveformBlock with the next sequence number, stamped with its sample number and the
+        samples acquired so far, so consumers can account for every sample.
+
+        :param samples: The samples of the block. They are copied (converted to sample_dtype), as the DAQmx read
+                    buffer is reused.
+        :param first_sample: The sample number, counted from the last (re)start of the task, of the first sample
+        :param sample_number: The sample number of the first sample, counted from the start of the acquisition
+        """
+        dt = 1 / self.sample_rate
+        block = WaveformBlock(self.block_count, self.t_offset + first_sample * dt, dt,
+                              samples.astype(self.sample_dtype), first_sample=sample_number,
+                              acquired=self.samples_acquired)
+        self.block_count += 1
+        return block
+
+    def send_block(self, block):
+        """
+        Passes a block to the processing pipeline, if any, and delivers the blocks it has finished. Without stages the
+        block is delivered right away.
+        """
+        if self.pipeline is None:
+            self.deliver_block(block)
+            return
+        self.pipeline.submit(block)
+        for processed in self.pipeline.ready():
+            self.deliver_block(processed)
+
+    def deliver_block(self, block):
+        """
+        Hands a block to every consumer: the UI queue, the stream subscribers and the data writer. The UI queue and the
+        subscribers apply their overflow policies when they fall behind, while the writer is written here, in the
+        acquisition loop, so the log never loses a sample.
+        """
+        if self.ui_queue is not None:
+            self.ui_queue.put(block, abort=self.control.stop_requested)
+        if self.stream_server is not None:
+            self.stream_server.publish(block)
+        if self.writer is not None:
+            self.writer.write_block(block)
+
+    def start_task(self):
+        """
+        Starts the committed DAQmx task.
+        """
+        self.reader_task.start()
+
+    def stop_task(self):
+        """
+        Stops the DAQmx task, returning it to the committed state.
+        """
+        self.reader_task.stop()
+
+    def wait_for_samples(self, timeout=10.0):
+        """
+        Waits until samples_per_read samples are available in the DAQmx buffer, in slices of at most MAX_STOP_LATENCY
+        so that a stop request interrupts the wait.
+
+        :return: False if a stop was requested first. On timeout True is returned and the read raises the DAQmx error.
+        """
+        deadline = perf_counter() + timeout
+        while True:
+            missing = self.samples_per_read - self.reader_task.in_stream.avail_samp_per_chan
+            if missing <= 0 or perf_counter() >= deadline:
+                return not self.control.stop_requested()
+            # Sleep until the missing samples should have arrived, waking up immediately on a stop request
+            if self.control.wait_for_stop(min(missing / self.sample_rate, MAX_STOP_LATENCY)):
+                return False
+
+    def read(self):
+        """
+        Reads the next block of samples from the DAQmx buffer.
+
+        :return: A (samples, first_sample) tuple, where first_sample is the sample number of samples[0] counted from
+                 the last (re)start of the task, or None once the source has no more data or a stop was requested
+        """
+        if not self.wait_for_samples():
+            return None
+        # Read from the DAQmx buffer the required number of samples on the configured channel, waiting,
+        # if needed, up to timeout for the requested number_of_samples_per_channel becomes available. They already are,
+        # so this does not block.
+        self.reader.read_many_sample(data=self.input_data,
+                                     number_of_samples_per_channel=self.samples_per_read,
+                                     timeout=10.0)
+        # The hardware counter restarts with the task, so add the samples read before the last restart
+        self.samples_acquired = self.sample_offset + self.reader_task.in_stream.total_samp_per_chan_acquired
+        return self.input_data, self.samples_read - self.sample_offset
+
+    def wait_for_stop(self):
+        """
+        Blocks until the caller asks to stop.
+        """
+        self.control.wait_for_stop()
+
+    def reconfigure(self, task_configuration):
+        """
+        Applies a new configuration during an acquisition. The task is stopped, updated in place (or recreated if the
+        device or channel changed) and restarted, while the UI queue, the stream subscribers and the data writer carry
+        on. The time axis continues after the gap, and a marker recording the change and the gap is logged.
+
+        :return: The gap in the data, in milliseconds
+        """
+        # Time just after the last sample read so far
+        t_end = self.t_offset + (self.samples_read - self.sample_offset) / self.sample_rate
+        previous_configuration = (self.dev_name, self.channel)
+        # The writer session stays open, so output_file and file_format changes apply to the next acquisition
+        self.stop_task()
+        self.configure(task_configuration)
+        if not self.update_task(previous_configuration):
+            self.close_task()
+            self.create_task()
+        self.update_stream()
+        self.update_pipeline()
+        self.apply_scheduling()
+        self.read_jitter.reset(self.samples_per_read / self.sample_rate)
+        self.start_task()
+        # The last read returned about when its last sample was acquired, and the restarted task acquires its first
+        # sample about now
+        gap = perf_counter() - self._last_read_time
+        self.t_offset = t_end + gap
+        self.sample_offset = self.samples_read
+        self._last_read_time = perf_counter()
+        if self.writer is not None:
+            self.writer.write_marker("Configuration changed: sample_rate={} samples_per_read={} min_voltage={} "
+                                     "max_voltage={} gap={:.3f} ms".format(self.sample_rate, self.samples_per_read,
+                                                                           self.min_voltage, self.max_voltage,
+                                                                           gap * 1e3))
+        return gap * 1e3
+
+    def acquire(self):
+        """
+        Read from the DAQmx task which is acquiring at sample_rate.Each loop iteration acquires samples_per_read and
+        sends them as one WaveformBlock to the ui queue and the data writer for logging and display. The default
+        timeout is 10 seconds. Returns once the caller asks to stop, leaving the task committed. A stop request
+        interrupts a pending read, so it is handled within MAX_STOP_LATENCY. A (CMD_CONFIGURE, task_configuration)
+        command received meanwhile is applied with reconfigure() and answered with READY_ACK; other commands are
+        ignored until the acquisition has stopped.
+        """
+        if self.trigger is not None:
+            self.trigger.reset()
+        self.samples_read = 0
+        self.samples_acquired = 0
+        self.block_count = 0
+        self.t_offset = 0.0
+        self.sample_offset = 0
+        self.read_jitter.reset(self.samples_per_read / self.sample_rate)
+        self.update_stream()
+        self.update_pipeline()
+        if self.pipeline is not None:
+            self.pipeline.reset_timing()
+        # A stop request left over from an earlier acquisition must not end this one
+        self.control.clear_stop()
+
+        # Run the task if it was created successfully
+        self.start_task()
+
+        # Initialize the data writer for logging, unless logging is disabled
+        if self.output_file:
+            # The decimations are fixed for the whole log, so a later change of the sample rate changes the rate of
+            # the summary streams
+            summary_decimations = [max(1, round(self.sample_rate / rate)) for rate in self.summary_rates]
+            # Trigger events are not contiguous
+            self.writer = DataWriter(self.output_file, self.file_format, self.index_chunk_samples,
+                                     contiguous=self.trigger is None, summary_decimations=summary_decimations)
+        else:
+            self.writer = None
+        self._last_read_time = perf_counter()
+        self.read_jitter.tick(self._last_read_time)
+        self.control.ack(STARTED_ACK)
+
+        # The log is closed even when a read fails, so it and its sidecar files are complete up to the error
+        try:
+            while True:
+                data = self.read()
+                self._last_read_time = perf_counter()
+                if data is None:
+                    # Nothing more to read, keep the acquisition open until the caller stops it
+                    self.wait_for_stop()
+                    break
+                samples, first_sample = data
+                self.read_jitter.tick(self._last_read_time)
+                if self.trigger is None:
+                    # Send the whole block to the UI, the stream subscribers and the data writer
+                    self.send_block(self.make_block(samples, first_sample, self.samples_read))
+                else:
+                    # In trigger mode only the captured events are displayed and logged
+                    for trigger_sample, event in self.trigger.process(samples):
+                        if self.writer is not None:
+                            self.writer.write_marker("Trigger at sample " + str(self.sample_offset + trigger_sample))
+                        # The event starts with the captured pre-trigger samples
+                        first_sample = trigger_sample - (event.shape[0] - self.trigger.post_samples)
+                        self.send_block(self.make_block(event, first_sample, self.sample_offset + first_sample))
+                self.samples_read += samples.shape[0]
+                if self.control.stop_requested():
+                    # Exit when the caller asks to stop
+                    break
+                message = self.control.poll_command()
+                if message is not None and message[0] == CMD_CONFIGURE:
+                    self.reconfigure(message[1])
+                    self.control.ack(READY_ACK)
+            self.stop_task()
+            self.flush_pipeline()
+            if self.writer is not None:
+                if self.pipeline is not None:
+                    for line in self.pipeline.summary():
+                        self.writer.write_marker("Processing: " + line)
+                self.writer.write_marker("Read jitter: " + self.read_jitter.summary())
+        finally:
+            if self.writer is not None:
+                self.writer.close_file()
+                self.writer = None
 
     def run(self):
+        """
+        Creates the task, acquires until the caller asks to stop and then clears the task.
+        """
+        self.apply_scheduling()
+        self.create_task()
         try:
-            multiprocessing.Process.run(self)
-            self._child_conn.send(None)
-        except Exception as e:
-            exception = str(e)
-            self._child_conn.send(exception)
-
-    @property
-    def exception(self):
-        if self._parent_conn.poll():
-            self._exception = self._parent_conn.recv()
-        return self._exception
+            self.acquire()
+        finally:
+            self.close_task()
+            self.close_pipeline()
+            self.close_stream()
+        self.stop_process()
+
+    def serve(self):
+        """
+        Persistent reader loop. The task is created and committed immediately and READY_ACK is sent once it can be
+        started. Afterwards the loop waits for commands from the caller:
+
+            (CMD_START, None) - start acquiring, answering STARTED_ACK, until ControlChannel.stop() answers GLOBAL_ACK
+            (CMD_CONFIGURE, task_configuration) - recreate and commit the task, answering READY_ACK. During an
+                                                  acquisition the running task is reconfigured in place instead.
+            (CMD_QUIT, None) - clear the task, answer GLOBAL_ACK and return
+        """
+        try:
+            self.apply_scheduling()
+            self.create_task()
+            self.control.ack(READY_ACK)
+            while True:
+                command, argument = self.control.receive()
+                if command == CMD_START:
+                    self.acquire()
+                    self.stop_process()
+                elif command == CMD_CONFIGURE:
+                    self.close_task()
+                    self.configure(argument)
+                    self.apply_scheduling()
+                    self.create_task()
+                    self.control.ack(READY_ACK)
+                elif command == CMD_QUIT:
+                    break
+        finally:
+            self.close_task()
+            self.close_pipeline()
+            self.close_stream()
+        self.control.ack(GLOBAL_ACK)
+
+    def stop_process(self):
+        """
+        Mark the end of the acquisition's data and send the final message back to the caller. Blocks the caller has not
+        taken yet are left for it to discard (see BlockQueue.discard) rather than flushed here one by one.
+        """
+        if self.ui_queue is not None:
+            self.ui_queue.put(END_OF_DATA)
+        self.control.clear_stop()
+        # Send the global ACK back to the caller letting it know the acquisition has finished
+        self.control.ack(GLOBAL_ACK)
@@ -17,21 +17,40 @@ UI Portions of this code (the graph_widget.py and graph_generator.py files) orig
 Source: https://github.com/mp-007/kivy_matplotlib_widget
 """
 import queue
-from multiprocessing import Queue
-from time import sleep
 
-import numpy as np
-from nidaqmx.constants import TerminalConfiguration
+# Only the lightweight reader entry and block buffer modules are imported here. Under the spawn start method every
+# child process re-imports this file, so numpy, nidaqmx, matplotlib and Kivy are imported lazily where they are needed
+# instead.
+from block_buffer import BlockQueue
+from scheduling import JitterMonitor, apply_scheduling
+from reader_entry import ControlChannel, Process, serve_reader, GLOBAL_ACK, CMD_START, CMD_CONFIGURE, CMD_QUIT, \
+    STARTED_ACK
+
+# Most blocks taken from the UI queue per graph update
+MAX_BLOCKS_PER_UPDATE = 100
+# Memory budget of the queue carrying blocks to the graph. When the graph falls behind, the queued blocks are decimated,
+# so the display degrades gracefully while the log file keeps every sample.
+UI_BUFFER_BYTES = 64 * 2 ** 20
+UI_OVERFLOW_POLICY = 'decimate'
+# Interval of the graph updates in seconds
+UI_UPDATE_INTERVAL = 1 / 120
+# Longest wait in seconds for the reader worker to acknowledge a stop or quit. A worker that does not answer in time is
+# terminated, so a lost ACK cannot freeze the UI, and a fresh worker is spawned on the next start.
+ACK_TIMEOUT = 10.0
+# CPU affinity (a list of cores) and nice level of the UI process, None to leave them unchanged. Keeping the UI off the
+# reader's cores (see the 'cpu_affinity' task configuration entry) stops redraw spikes from delaying reads.
+UI_CPU_AFFINITY = None
+UI_NICE = None
+# Width of the graph's time axis in seconds while it follows the data, None to show everything received. The limits move
+# in steps (see axis_manager.py), and with GRAPH_AUTOSCALE_Y the voltage axis is fitted to the data.
+GRAPH_WINDOW = None
+GRAPH_AUTOSCALE_Y = True
+# Valid terminal configuration names. The reader converts the name to a nidaqmx TerminalConfiguration.
+TERMINAL_CONFIGURATIONS = ('DEFAULT', 'RSE', 'NRSE', 'DIFFERENTIAL', 'PSEUDODIFFERENTIAL')
 
-from daqmx_reader import AnalogInputReader, Process
-
-# Global Constants
-GLOBAL_STOP = 'S'
 # Define the entire UI layout and event functionality with the KV language. This could also be its own .kv file.
 KV = '''
-#:import MatplotFigure graph_widget
 Screen
-    figure_wgt:figure_wgt
     BoxLayout:
         orientation:'vertical'
         padding: [20, 20, 20, 20]
@@ -73,9 +92,8 @@ Screen
                 text: "Stop Acquisition"
                 on_release: app.stop_acquisition()
         BoxLayout:
+            id: graph_box
             size_hint_y: 1
-            MatplotFigure:
-                id:figure_wgt 
         BoxLayout:
             size_hint_y: .5
             GridLayout:
@@ -193,6 +211,12 @@ Screen
 # all Kivy imports here to prevent Windows from launching another window when we launch a new process. This is
 # discussed in detail here: https://github.com/kivy/kivy/issues/4744
 if __name__ == "__main__":
+    import os
+    from time import perf_counter
+
+    # Reference point for the startup benchmark (see benchmarks/startup_benchmark.py)
+    APP_START_TIME = perf_counter()
+
     from kivy.config import Config
 
     Config.set('input', 'mouse', 'mouse,disable_on_activity')
@@ -206,7 +230,7 @@ if __name__ == "__main__":
     from kivy.lang import Builder
     from kivy.app import App
     from kivy.clock import Clock
-    from graph_generator import GraphGenerator
+    from kivy.logger import Logger
 
 
     class MyApp(App):
@@ -216,40 +240,92 @@ if __name__ == "__main__":
 
         def build(self):
             """ Kivy method for building the app by returning a widget """
-            # Counter that counts loop iterations of the update_graph method which corresponds directly to sample #
-            self.i = 0
-            # Floating point variable we use for updating the graph
-            self.y = float(0)
+            # Store of the samples received from the reader process. Time values are derived from each block's t0 and
+            # dt only for the visible range.
+            self.plot_store = None
             # Default configuration parameters for the DAQmx task
             # TODO: Replace these hard-coded default values with the kivy utilities for creating and reading from an INI
             #  file at init
             self.task_configuration = {'sample_clock_source': 'OnBoardClock', 'sample_rate': 60,
                                        'samples_per_read': 30,
                                        'channel': 0, 'dev_name': 'PXI1Slot2', 'max_voltage': 5, 'min_voltage': -5,
-                                       'terminal_configuration': TerminalConfiguration.DEFAULT}
+                                       'terminal_configuration': 'DEFAULT',
+                                       # Set to e.g. {'mode': 'rising', 'level': 1.0, 'hysteresis': 0.1,
+                                       # 'pre_samples': 100, 'post_samples': 400} to only capture triggered events
+                                       'trigger': None,
+                                       # Set to the path of a log written by DataWriter to replay it instead of
+                                       # acquiring, see replay.py
+                                       'replay_file': None,
+                                       # Scheduling of the reader process, see scheduling.py. E.g. 'cpu_affinity': [2,
+                                       # 3] with UI_CPU_AFFINITY = [0, 1] isolates acquisition from rendering.
+                                       'cpu_affinity': None, 'nice': None, 'realtime_priority': None,
+                                       # 'float32' halves the memory and bandwidth of the whole pipeline
+                                       'sample_dtype': 'float64',
+                                       # Set to e.g. [1000] to also write a 1 kHz min/max/mean summary stream next
+                                       # to the log, see summary_stream.py
+                                       'summary_rates': None}
             self.task_running = False
+            self.touch_mode = 'pan'
+            # Graph widget backend: 'matplotlib' (graph_widget.py) or 'kivy' (kivy_graph.py, native vertex
+            # instructions)
+            self.graph_backend = 'matplotlib'
+            # Set to True to draw the live trace with the numpy rasterizer (trace_raster.py) instead of matplotlib
+            self.fast_renderer = False
             self.screen = Builder.load_string(KV)
+            # The graph widget is created by load_graph() once the first frame has been shown
+            self.screen.figure_wgt = None
             return self.screen
 
         def on_start(self, *args):
             """ Called right after build() """
+            # Child processes inherit these settings, so give the reader its own 'cpu_affinity' when the UI is pinned
+            apply_scheduling(UI_CPU_AFFINITY, UI_NICE, name='UI')
+            self.start_reader_worker()
+            # Importing matplotlib dominates startup, so show the window first and build the graph on the next frame
+            Clock.schedule_once(self.load_graph, 0)
+
+        def load_graph(self, *args):
+            """ Imports the graph widget of the selected backend and creates the graph, unless this was already
+            done """
+            if self.screen.figure_wgt is not None:
+                return
+            if os.environ.get('DAQMX_STARTUP_BENCHMARK'):
+                print('first_frame', perf_counter() - APP_START_TIME, flush=True)
+            if self.graph_backend == 'kivy':
+                from kivy_graph import KivyGraph
+                self.screen.figure_wgt = KivyGraph()
+                self.screen.figure_wgt.bind(xlim=self.on_xlim_changed)
+            else:
+                from graph_widget import MatplotFigure
+                self.screen.figure_wgt = MatplotFigure()
+                self.screen.figure_wgt.fast_renderer = self.fast_renderer
+            self.screen.figure_wgt.touch_mode = self.touch_mode
+            self.screen.ids.graph_box.add_widget(self.screen.figure_wgt)
             self.reset_graph()
+            if os.environ.get('DAQMX_STARTUP_BENCHMARK'):
+                print('first_plot', perf_counter() - APP_START_TIME, flush=True)
+                self.stop()
 
         def on_stop(self):
             """ Called at app exit """
             if self.task_running:
                 self.stop_acquisition()
+            self.stop_reader_worker()
 
         def set_touch_mode(self, mode):
             """ Sets the touch mode """
-            self.screen.figure_wgt.touch_mode = mode
+            self.touch_mode = mode
+            if self.screen.figure_wgt is not None:
+                self.screen.figure_wgt.touch_mode = mode
 
         def home(self):
             """ Returns the graph widget to its home pan position """
-            self.screen.figure_wgt.home()
+            if self.screen.figure_wgt is not None:
+                self.screen.figure_wgt.home()
 
         def update_graph(self, _):
-            """ Updates the graph widget with the newest sample from the reader process """
+            """ Updates the graph widget with the newest blocks from the reader process """
+            self.frame_jitter.tick()
             if self.reader_process.is_alive():
                 # If the reader process is alive, we can keep reading data from our queue and checking for errors
                 if self.reader_process.exception:
@@ -257,89 +333,171 @@ if __name__ == "__main__":
                     self.read_error()
                     self.stop_acquisition()
                 else:
-                    try:
-                        # Try to get from our queue immediately. Only plot if we get data.
-                        self.y = self.ui_queue.get_nowait()
-                        # Update our x data with our current sample count
-                        xdata = np.append(self.screen.figure_wgt.line1.get_xdata(), self.i)
-                        # Update the y data
-                        self.screen.figure_wgt.line1.set_data(xdata,
-                                                              np.append(self.screen.figure_wgt.line1.get_ydata(),
-                                                                        self.y))
-                        if self.i > 2:
-                            self.screen.figure_wgt.xmax = np.max(xdata)
-                            if self.screen.figure_wgt.axes.get_xlim()[0] == self.screen.figure_wgt.xmin:
-                                self.home()
-                            else:
-                                self.screen.figure_wgt.figure.canvas.draw_idle()
-                                self.screen.figure_wgt.figure.canvas.flush_events()
-                        self.i += 1
-                    except queue.Empty:
-                        # Do not update the graph when we don't have data.
-                        pass
+                    # Take every block that has arrived, up to a limit so a backlog cannot stall the UI
+                    received = 0
+                    while received < MAX_BLOCKS_PER_UPDATE:
+                        try:
+                            block = self.ui_queue.get_nowait()
+                        except queue.Empty:
+                            # Do not update the graph when we don't have data.
+                            break
+                        # Duplicates and late blocks are left out, so the store stays in time order
+                        if self.continuity.check(block):
+                            self.plot_store.append(block)
+                            self.axis_manager.add(block)
+                        received += 1
+                    if received and len(self.plot_store) > 2:
+                        figure_wgt = self.screen.figure_wgt
+                        # Keep following the data while the view is at its home position
+                        at_home = tuple(figure_wgt.get_xlim()) == self.axis_manager.xlim
+                        # The home limits only change in steps, so most updates leave the ticks alone
+                        stepped = self.axis_manager.update(self.plot_store.t_start, self.plot_store.t_end)
+                        if stepped:
+                            figure_wgt.xmin, figure_wgt.xmax = self.axis_manager.xlim
+                            figure_wgt.ymin, figure_wgt.ymax = self.axis_manager.ylim
+                        if at_home and stepped:
+                            # home() sets the limits, which refreshes the visible data through on_xlim_changed
+                            self.home()
+                        else:
+                            # The limits are unchanged, so only the line is redrawn over the cached background, at
+                            # the next frame together with any pan or zoom. The store keeps the decimated buckets of
+                            # the visible range and only reduces the samples received since the last update.
+                            self.on_xlim_changed()
+                            figure_wgt.request_update_lines([figure_wgt.line1])
             else:
                 # This catches the first call to update_graph
                 self.read_error()
                 self.stop_acquisition()
 
+        def on_xlim_changed(self, *args):
+            """ Loads the samples of the visible time range into the line. Called whenever the x limits change, e.g. by
+            panning, zooming or home() """
+            if self.plot_store is None:
+                return
+            figure_wgt = self.screen.figure_wgt
+            xmin, xmax = figure_wgt.get_xlim()
+            # Decimate to about two points per horizontal pixel
+            xdata, ydata = self.plot_store.visible(xmin, xmax, max_points=2 * int(figure_wgt.plot_width))
+            figure_wgt.line1.set_data(xdata, ydata)
+
         def reset_graph(self):
-            mygraph = GraphGenerator()
-            self.screen.figure_wgt.figure = mygraph.fig
-            self.screen.figure_wgt.axes = mygraph.ax1
-            self.screen.figure_wgt.xmin = 0
-            self.screen.figure_wgt.xmax = 50
-            self.screen.figure_wgt.ymin = -5
-            self.screen.figure_wgt.ymax = 5
-            self.screen.figure_wgt.line1 = mygraph.line1
+            from axis_manager import AxisManager
+            from waveform import ContinuityChecker, WaveformStore
+            self.plot_store = WaveformStore(dtype=self.task_configuration.get('sample_dtype', 'float64'))
+            # Trigger events are not contiguous, so only their sequence numbers can be checked
+            self.continuity = ContinuityChecker(contiguous=not self.task_configuration.get('trigger'))
+            figure_wgt = self.screen.figure_wgt
+            if self.graph_backend == 'kivy':
+                figure_wgt.line1.set_data([], [])
+            else:
+                from graph_generator import GraphGenerator
+                mygraph = GraphGenerator()
+                mygraph.ax1.callbacks.connect('xlim_changed', self.on_xlim_changed)
+                figure_wgt.figure = mygraph.fig
+                figure_wgt.axes = mygraph.ax1
+                figure_wgt.line1 = mygraph.line1
+            figure_wgt.xmin = 0
+            # Show the first 50 samples worth of time until more data arrives
+            figure_wgt.xmax = 50 / self.task_configuration['sample_rate']
+            figure_wgt.ymin = -5
+            figure_wgt.ymax = 5
+            self.axis_manager = AxisManager(GRAPH_WINDOW, autoscale_y=GRAPH_AUTOSCALE_Y)
+            self.axis_manager.reset(figure_wgt.xmin, figure_wgt.xmax, figure_wgt.ymin, figure_wgt.ymax)
             self.home()
 
-        def start_acquisition(self):
-            """ Initialize the needed objects for the daqmx_reader AnalogInputReader() """
-            self.ui_queue = Queue()
-            self.cmd_queue = Queue()
-            self.ack_queue = Queue()
-            # Create a new instance of the reader class with the provided configuration and queues
-            self.new_reader = AnalogInputReader(task_configuration=self.task_configuration,
-                                                ui_queue=self.ui_queue, cmd_queue=self.cmd_queue,
-                                                ack_queue=self.ack_queue)
-            # Create a new multiprocessing process using the Process class of daqmx_reader.py. This is simply a
-            # wrapper around the regular multiprocessing Process but with the ability to return an error
-            self.reader_process = Process(target=self.new_reader.run)
+        def start_reader_worker(self):
+            """ Spawns the long-lived reader process. It creates and commits the DAQmx task right away and then waits
+            for commands, so acquisitions can be started and stopped without respawning it """
+            self.ui_queue = BlockQueue(UI_BUFFER_BYTES, UI_OVERFLOW_POLICY)
+            self.control = ControlChannel()
+            # Remember the configuration the worker was built with so changes can be sent before the next start
+            self.worker_configuration = dict(self.task_configuration)
+            # Create a new multiprocessing process using the Process class of reader_entry.py. This is simply a
+            # wrapper around the regular multiprocessing Process but with the ability to return an error. The reader
+            # itself is created inside the child, so only the configuration, the queue and the control channel are sent
+            # to it.
+            self.reader_process = Process(target=serve_reader,
+                                          args=(self.worker_configuration, self.ui_queue, self.control))
             # The DAQmx reader process will start at this call
             self.reader_process.start()
-            # Give the task a second to configure itself
-            sleep(1)
+
+        def stop_reader_worker(self):
+            """ Asks the reader worker to clear its task and exit """
+            if self.reader_process.is_alive():
+                self.control.send(CMD_QUIT)
+                if not self.control.wait_for_ack(GLOBAL_ACK, self.reader_process, timeout=ACK_TIMEOUT):
+                    self.terminate_reader_worker()
+            self.reader_process.join()
+
+        def terminate_reader_worker(self):
+            """ Kills a reader worker that stopped answering """
+            if self.reader_process.is_alive():
+                Logger.error('Reader: no answer from the reader worker within {} s, terminating it'.format(
+                    ACK_TIMEOUT))
+                self.reader_process.terminate()
+
+        def start_acquisition(self):
+            """ Starts an acquisition on the reader worker, respawning or reconfiguring the worker if needed """
+            if self.task_running:
+                return
+            self.load_graph()
+            if not self.reader_process.is_alive():
+                # The previous worker exited on an error, so start a fresh one
+                self.reader_process.join()
+                self.start_reader_worker()
+            elif self.task_configuration.get('replay_file') != self.worker_configuration.get('replay_file'):
+                # Switching between live and replayed data needs a different reader class
+                self.stop_reader_worker()
+                self.start_reader_worker()
+            elif self.task_configuration != self.worker_configuration:
+                # Commands are handled in order, so the start command below will wait for the new task to be committed
+                self.worker_configuration = dict(self.task_configuration)
+                self.control.send(CMD_CONFIGURE, self.worker_configuration)
+            self.control.send(CMD_START)
+            # Wait until the task is actually running instead of sleeping for a fixed time
+            if not self.control.wait_for_ack(STARTED_ACK, self.reader_process):
+                self.read_error()
+                return
             # Schedule the rate at which we update our graph and
-            Clock.schedule_interval(self.update_graph, 1 / 120)
+            self.frame_jitter = JitterMonitor(UI_UPDATE_INTERVAL)
+            Clock.schedule_interval(self.update_graph, UI_UPDATE_INTERVAL)
             self.task_running = True
 
         def stop_acquisition(self):
-            """ Properly shuts down the task currently running, in turn destroying the currently running MultiProcessing
-            process """
+            """ Properly stops the acquisition currently running. The reader worker stays alive with its task committed,
+            ready for the next start """
+            if not self.task_running:
+                # The idle worker is waiting for a command and would never answer a stop request
+                return
             # Stop the graph from updating
             Clock.unschedule(self.update_graph)
-            # Reset the counter and y value
-            self.i = 0
-            self.y = float(0)
 
             if self.reader_process.is_alive():
-                # After the command queue sends the stop message 'S', we wait for the finished message 'F'. When we
-                # receive it, we know the DAQmx task has safely cleared and closed itself, thus we can safely close the
-                # reader process.
-                self.cmd_queue.put(GLOBAL_STOP)
-                self.ack_queue.get(block=True, timeout=None)
-                self.reader_process.terminate()
-                self.reader_process.join()
+                # The stop request interrupts the pending read, then we wait for the finished message 'F'. When we
+                # receive it, we know the DAQmx task has stopped and the log file is closed.
+                self.control.stop()
+                if not self.control.wait_for_ack(GLOBAL_ACK, self.reader_process, timeout=ACK_TIMEOUT):
+                    self.terminate_reader_worker()
+                # A stop request left set would cut the next acquisition short
+                self.control.clear_stop()
+                # Drop the blocks that were still on their way to the graph
+                self.ui_queue.discard(self.reader_process)
             else:
-                # Since the reader terminated on error, it's our job to empty the queues for proper shutdown
-                while not self.ui_queue.empty():
-                    self.ui_queue.get()
-                while not self.cmd_queue.empty():
-                    self.cmd_queue.get()
-                while not self.ack_queue.empty():
-                    self.ack_queue.get()
+                # Since the reader terminated on error, it's our job to empty the UI queue for proper shutdown. A new
+                # worker gets a new control channel.
+                self.ui_queue.discard(self.reader_process)
                 self.reader_process.join()
 
+            Logger.info('Graph: update jitter ' + self.frame_jitter.summary())
+            Logger.info('Graph: ' + self.axis_manager.summary())
+            if self.continuity.max_backlog:
+                # How late the reader's reads were, as seen in the samples left in the DAQmx buffer
+                Logger.info('Graph: reads up to {:.3f} ms behind the hardware'.format(
+                    self.continuity.max_backlog / self.task_configuration['sample_rate'] * 1e3))
+            if not self.continuity.ok:
+                # Decimation under load is expected, lost or reordered blocks are not
+                Logger.warning('Graph: ' + self.continuity.summary())
+                self.update_error_display('Data lost on the way to the graph: ' + self.continuity.summary())
             self.task_running = False
             self.reset_graph()
 
@@ -347,9 +505,22 @@ if __name__ == "__main__":
             self.error = self.reader_process.exception
             self.update_error_display(self.error)
 
+        def apply_configuration(self):
+            """ Sends a changed configuration to the running acquisition. The reader reconfigures its task in place
+            and keeps streaming into the same graph and log file, recording the change and the gap in the log. When
+            no acquisition is running, the change is sent with the next start instead """
+            if not self.task_running or self.task_configuration == self.worker_configuration:
+                return
+            if self.task_configuration.get('replay_file') != self.worker_configuration.get('replay_file'):
+                # Switching between live and replayed data needs a new worker, so it waits for the next start
+                return
+            self.worker_configuration = dict(self.task_configuration)
+            self.control.send(CMD_CONFIGURE, self.worker_configuration)
+
         def update_device_name(self, new_value):
             """ Updates the real or simulated DAQmx device to be used for the DAQmx task """
             self.task_configuration['dev_name'] = new_value
+            self.apply_configuration()
 
         def update_channel_number(self, new_value):
             """ Updates the physical analog input channel to be used for the DAQmx task """
@@ -358,6 +529,7 @@ if __name__ == "__main__":
             except Exception as e:
                 e = 'Input must be an integer'
                 self.update_error_display(e)
+            self.apply_configuration()
 
         def update_max_voltage(self, new_value):
             """ Updates the max voltage to be used for the DAQmx task """
@@ -366,6 +538,7 @@ if __name__ == "__main__":
             except Exception as e:
                 e = 'Input must be an integer'
                 self.update_error_display(e)
+            self.apply_configuration()
 
         def update_min_voltage(self, new_value):
             """ Updates the min voltage to be used for the DAQmx task """
@@ -374,27 +547,22 @@ if __name__ == "__main__":
             except Exception as e:
                 e = 'Input must be an integer'
                 self.update_error_display(e)
+            self.apply_configuration()
 
         def update_terminal_configuration(self, new_value):
             """ Updates the terminal configuration to be used for the DAQmx task """
-            if new_value == 'DEFAULT':
-                self.task_configuration['terminal_configuration'] = TerminalConfiguration.DEFAULT
-            elif new_value == 'RSE':
-                self.task_configuration['terminal_configuration'] = TerminalConfiguration.RSE
-            elif new_value == 'NRSE':
-                self.task_configuration['terminal_configuration'] = TerminalConfiguration.NRSE
-            elif new_value == 'DIFFERENTIAL':
-                self.task_configuration['terminal_configuration'] = TerminalConfiguration.DIFFERENTIAL
-            elif new_value == 'PSEUDODIFFERENTIAL':
-                self.task_configuration['terminal_configuration'] = TerminalConfiguration.PSEUDODIFFERENTIAL
+            if new_value in TERMINAL_CONFIGURATIONS:
+                self.task_configuration['terminal_configuration'] = new_value
             else:
-                self.task_configuration['terminal_configuration'] = TerminalConfiguration.DEFAULT
+                self.task_configuration['terminal_configuration'] = 'DEFAULT'
                 self.update_error_display('Invalid terminal configuration. Valid options include DEFAULT, RSE, NRSE, '
                                           'DIFFERENTIAL,PSEUDODIFFERENTIAL')
+            self.apply_configuration()
 
         def update_sample_clock_source(self, new_value):
             """ Updates the sample clock source to be used for the DAQmx task """
             self.task_configuration['sample_clock_source'] = new_value
+            self.apply_configuration()
 
         def update_sample_rate(self, new_value):
             """ Updates the sample rate to be used for the DAQmx task """
@@ -403,6 +571,7 @@ if __name__ == "__main__":
             except Exception as e:
                 e = 'Input must be an integer'
                 self.update_error_display(e)
+            self.apply_configuration()
 
         def update_number_of_samples(self, new_value):
             """ Updates the sample rate to be used for the DAQmx task """
@@ -411,6 +580,7 @@ if __name__ == "__main__":
             except Exception as e:
                 e = 'Input must be an integer'
                 self.update_error_display(e)
+            self.apply_configuration()
 
         def update_error_display(self, error):
             """ Updates the error display with a new error string """
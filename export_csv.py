@@ -0,0 +1,204 @@
+"""
+export_csv.py: Offline export of binary session logs (DataWriter file_format 'binary') to CSV or other delimited text.
+
+Writing text live with np.savetxt is slow, so the recommended setup is to log in binary and export afterwards. The log
+is split into chunks that a pool of worker processes formats in parallel. Each worker memory-maps the log itself, so no
+sample data is pickled, and formats its chunk with a vectorized fixed-precision formatter that builds the text directly
+in a numpy byte array. The parent writes the formatted chunks to the output in order.
+
+Usage:
+
+    python export_csv.py Output_Data.bin Output_Data.csv
+    python export_csv.py Output_Data.bin Output_Data.tsv --delimiter tab --time --precision 4 --workers 8
+"""
+
+import argparse
+import collections
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+from session_log import SessionLog
+
+NEWLINE = ord('\n')
+DELIMITERS = {'comma': ',', 'tab': '\t', 'semicolon': ';', 'space': ' '}
+
+
+def _fixed_columns(values, precision):
+    """
+    Formats values with a fixed number of decimals into a 2-D uint8 array of characters (one row per value) and a mask
+    of the characters to keep. Dropping the unmasked characters (leading zeros and the sign of positive values) gives
+    the same text as '%.{precision}f', except that values rounding to zero never get a minus sign.
+    """
+    scale = 10 ** precision
+    product = np.abs(values) * scale
+    scaled = np.rint(product).astype(np.uint64)
+    # The product is rounded, so one within a few units in the last place of a half may round the other way than the
+    # exact decimal value of the sample does. '%.{precision}f' rounds those few itself.
+    near_half = np.abs(product - np.floor(product) - 0.5) <= 2 * np.spacing(product)
+    for i in np.flatnonzero(near_half).tolist():
+        scaled[i] = int(('%.{}f'.format(precision) % abs(values[i])).replace('.', ''))
+    integer_part = scaled // np.uint64(scale)
+    fraction = scaled % np.uint64(scale)
+    integer_digits = len(str(int(integer_part.max()))) if integer_part.shape[0] else 1
+    width = 1 + integer_digits + (1 + precision if precision else 0)
+    chars = np.empty(shape=(values.shape[0], width), dtype=np.uint8)
+    keep = np.ones(shape=chars.shape, dtype=bool)
+
+    # Sign, kept only for values that do not round to zero
+    chars[:, 0] = ord('-')
+    keep[:, 0] = (values < 0) & (scaled != 0)
+
+    # Integer digits, right-aligned, without leading zeros (the last digit is always kept)
+    remaining = integer_part.copy()
+    for column in range(integer_digits, 0, -1):
+        chars[:, column] = remaining % np.uint64(10) + np.uint64(ord('0'))
+        remaining //= np.uint64(10)
+        if column < integer_digits:
+            keep[:, column] = integer_part >= np.uint64(10 ** (integer_digits - column))
+
+    if precision:
+        chars[:, integer_digits + 1] = ord('.')
+        remaining = fraction
+        for column in range(width - 1, integer_digits + 1, -1):
+            chars[:, column] = remaining % np.uint64(10) + np.uint64(ord('0'))
+            remaining //= np.uint64(10)
+    return chars, keep
+
+
+def format_fixed(columns, precision, delimiter=','):
+    """
+    Formats one or more equally long columns of values as delimited text lines with a fixed number of decimals.
+
+    :param columns: A list of 1-D arrays, one per output column
+    :param precision: Number of decimals
+    :param delimiter: The column delimiter
+    :return: The formatted lines as bytes
+    """
+    limit = 2.0 ** 63 / 10 ** precision
+    if not all(np.isfinite(column).all() and np.abs(column).max(initial=0) < limit for column in columns):
+        # NaN, infinity and huge values are rare enough to simply fall back to Python formatting
+        line = delimiter.join(['%.{}f'.format(precision)] * len(columns)) + '\n'
+        return ''.join(line % values for values in zip(*(column.tolist() for column in columns))).encode('ascii')
+    parts = []
+    n = columns[0].shape[0]
+    for i, column in enumerate(columns):
+        chars, keep = _fixed_columns(np.asarray(column, dtype=np.float64), precision)
+        parts.append((chars, keep))
+        separator = np.full(shape=(n, 1), fill_value=ord(delimiter) if i + 1 < len(columns) else NEWLINE,
+                            dtype=np.uint8)
+        parts.append((separator, np.ones(shape=(n, 1), dtype=bool)))
+    chars = np.hstack([part[0] for part in parts])
+    keep = np.hstack([part[1] for part in parts])
+    # Boolean indexing walks the rows in order, which concatenates the lines
+    return chars[keep].tobytes()
+
+
+# Per worker process state, set up once by _init_worker
+_worker_log = None
+
+
+def _init_worker(filename):
+    global _worker_log
+    _worker_log = SessionLog(filename)
+
+
+def _format_chunk(task):
+    """
+    Formats samples[start:stop] of the worker's memory-mapped log.
+    """
+    start, stop, t0, dt, prefix, precision, delimiter, with_time = task
+    values = _worker_log.samples[start:stop]
+    columns = [values]
+    if with_time:
+        columns.insert(0, t0 + np.arange(stop - start) * dt)
+    return prefix.encode('ascii') + format_fixed(columns, precision, delimiter)
+
+
+def plan_chunks(session_log, chunk_samples, with_time):
+    """
+    Splits a log into (start, stop, t0, dt, prefix) chunks. Chunks never span a segment boundary or a marker, so each
+    chunk starts with the comment lines (block markers, trigger or configuration markers) that precede it. Markers
+    after the last sample get a final chunk without samples.
+    """
+    markers = collections.defaultdict(list)
+    for sample, text in session_log.markers:
+        markers[sample].append(text)
+    marker_positions = sorted(markers)
+    chunks = []
+    for index, segment in enumerate(session_log.segments):
+        boundaries = {segment.start, segment.stop}
+        boundaries.update(range(segment.start, segment.stop, chunk_samples))
+        boundaries.update(p for p in marker_positions if segment.start < p < segment.stop)
+        boundaries = sorted(boundaries)
+        for start, stop in zip(boundaries, boundaries[1:]):
+            prefix = ''
+            if start == segment.start and not with_time:
+                # Keep the time axis recoverable, in the same form DataWriter writes CSV block markers
+                prefix += '# Block {} t0={!r} dt={!r}\n'.format(index, segment.t0, segment.dt)
+            prefix += ''.join('# ' + text + '\n' for text in markers.get(start, []))
+            chunks.append((start, stop, segment.t0 + (start - segment.start) * segment.dt, segment.dt, prefix))
+    # Markers after the last sample, such as the statistics written when the acquisition stopped, end the export
+    end = session_log.segments[-1].stop if session_log.segments else 0
+    trailing = ''.join('# ' + text + '\n' for p in marker_positions if p >= end for text in markers[p])
+    if trailing:
+        last = session_log.segments[-1]
+        chunks.append((end, end, last.t0 + (end - last.start) * last.dt, last.dt, trailing))
+    return chunks
+
+
+def export(input_file, output_file, precision=6, delimiter=',', with_time=False, workers=None,
+           chunk_samples=1000000):
+    """
+    Exports a binary session log to delimited text.
+
+    :return: The number of samples exported
+    """
+    session_log = SessionLog(input_file)
+    if session_log.file_format != 'binary':
+        raise ValueError(input_file + ' is not a binary session log')
+    if session_log.segments[0].dt is None:
+        with_time = False
+    chunks = plan_chunks(session_log, chunk_samples, with_time)
+    workers = workers or os.cpu_count()
+    with open(output_file, 'wb') as f, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(input_file,)) as pool:
+        header = ('Time (s)' + delimiter if with_time else '# ') + 'Voltage (V)\n'
+        f.write(header.encode('ascii'))
+        # Keep a bounded number of chunks in flight and write the results in order as they complete
+        pending = collections.deque()
+        for start, stop, t0, dt, prefix in chunks:
+            pending.append(pool.submit(_format_chunk, (start, stop, t0, dt, prefix, precision, delimiter, with_time)))
+            if len(pending) >= 2 * workers:
+                f.write(pending.popleft().result())
+        while pending:
+            f.write(pending.popleft().result())
+    return len(session_log)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export a binary session log to CSV or other delimited text.')
+    parser.add_argument('input', help='Binary session log written by DataWriter')
+    parser.add_argument('output', help='Text file to write')
+    parser.add_argument('--precision', type=int, default=6, help='Number of decimals (default 6)')
+    parser.add_argument('--delimiter', choices=sorted(DELIMITERS), default='comma', help='Column delimiter')
+    parser.add_argument('--time', action='store_true', help='Add a time column derived from the block markers')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: one per core)')
+    parser.add_argument('--chunk-samples', type=int, default=1000000, help='Samples per chunk (default 1000000)')
+    args = parser.parse_args(argv)
+
+    start = perf_counter()
+    samples = export(args.input, args.output, precision=args.precision, delimiter=DELIMITERS[args.delimiter],
+                     with_time=args.time, workers=args.workers, chunk_samples=args.chunk_samples)
+    elapsed = perf_counter() - start
+    size = os.path.getsize(args.input)
+    print('Exported {} samples in {:.2f} s ({:.2f} s/GB of input)'.format(samples, elapsed,
+                                                                          elapsed / max(size / 1e9, 1e-9)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
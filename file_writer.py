@@ -3,30 +3,127 @@ This code is originally authored by: pbellino
 Source: https://github.com/pbellino/daq_nidaqmx_example
 """
 
+import json
 import os
 import numpy as np
 
+from log_index import DEFAULT_CHUNK_SAMPLES, IndexWriter, index_filename
+from summary_stream import SummaryWriter, remove_summaries, summary_filename
+from waveform import ContinuityChecker
+
+FILE_FORMATS = ('csv', 'binary')
+# File name extension of each format
+FILE_EXTENSIONS = {'csv': '.csv', 'binary': '.bin'}
+
 
 class DataWriter:
     """
     Write data to file
+
+    Two formats are supported. 'csv' writes one sample per line with '#' comment lines for markers. 'binary' writes
+    the raw samples to the data file and the block and marker information as JSON lines to a '<filename>.meta' sidecar,
+    which lets session_log.SessionLog memory-map the data.
+
+    Binary logs also get a '<filename>.idx' chunk summary index (see log_index.py) unless index_chunk_samples is None.
+    CSV logs are parsed in full when opened, so an index would not save any reading and none is written. Both formats
+    get a '<filename>.<decimation>.sum' decimated summary stream (see summary_stream.py) for every decimation in
+    summary_decimations.
+
+    The continuity of the written blocks is checked; lost blocks and sample ranges are recorded as markers. Pass
+    contiguous=False when the blocks are not meant to follow each other (trigger events).
     """
 
-    def __init__(self, filename="Output_Data.csv"):
+    def __init__(self, filename="Output_Data.csv", file_format='csv', index_chunk_samples=DEFAULT_CHUNK_SAMPLES,
+                 contiguous=True, summary_decimations=()):
         super().__init__()
+        if file_format not in FILE_FORMATS:
+            raise ValueError('Invalid file format. Valid options include ' + ', '.join(FILE_FORMATS))
+        self.file_format = file_format
+        self.samples_written = 0
+        if index_chunk_samples and file_format == 'binary':
+            self._index = IndexWriter(index_filename(filename), index_chunk_samples)
+        else:
+            self._index = None
+            if os.path.exists(index_filename(filename)):
+                # An index left by a previous log of the same name would not match the new data
+                os.remove(index_filename(filename))
+        remove_summaries(filename, keep=summary_decimations)
+        self._summaries = [SummaryWriter(summary_filename(filename, decimation), decimation)
+                           for decimation in sorted(set(summary_decimations))]
+
+        if file_format == 'binary':
+            self._file = open(filename, 'wb')
+            self._meta = open(filename + '.meta', 'w')
+            self._dtype = None
+        else:
+            if os.path.exists(filename):
+                f = open(filename, 'w')
+                f.close()
+            self._file = open(filename, 'a')
+            self._meta = None
 
-        if os.path.exists(filename):
-            f = open(filename, 'w')
-            f.close()
-        self._file = open(filename, 'a')
+            self._file.write("# Voltage (V)\n")
+        # Time just after the last written block, used to mark discontinuities
+        self._t_end = None
+        self.continuity = ContinuityChecker(contiguous)
 
-        self._file.write("# Voltage (V)\n")
+    def _write_meta(self, record):
+        self._meta.write(json.dumps(record) + "\n")
 
     def write_data(self, incoming_data):
-        write_data = incoming_data.T
-        np.savetxt(self._file, write_data, fmt='%s', delimiter=',')
+        if self._meta is not None:
+            if self._dtype is None:
+                # The sample dtype is recorded once, before the first samples
+                self._dtype = incoming_data.dtype
+                self._write_meta({'dtype': self._dtype.str})
+            self._file.write(np.ascontiguousarray(incoming_data, dtype=self._dtype).tobytes())
+        else:
+            write_data = incoming_data.T
+            np.savetxt(self._file, write_data, fmt='%s', delimiter=',')
+        if self._index is not None:
+            self._index.add(incoming_data)
+        self.samples_written += incoming_data.shape[0]
+
+    def write_block(self, block):
+        """
+        Write the samples of a WaveformBlock. The time axis is implicit: a marker with the block's t0 and dt is written
+        at the start of the file and wherever a block does not directly follow the previous one.
+        """
+        lost_blocks, lost_samples = self.continuity.lost_blocks, self.continuity.lost_samples
+        if not self.continuity.check(block):
+            self.write_marker("Ignored duplicate or out of order block " + str(block.seq))
+            return
+        if self.continuity.lost_blocks > lost_blocks or self.continuity.lost_samples > lost_samples:
+            text = "Lost " + str(self.continuity.lost_blocks - lost_blocks) + " blocks"
+            if self.continuity.lost_samples > lost_samples:
+                text += ", samples {}-{}".format(*self.continuity.gaps[-1])
+            self.write_marker(text)
+        if self._t_end is None or abs(block.t0 - self._t_end) > block.dt / 2:
+            if self._meta is not None:
+                self._write_meta({'sample': self.samples_written, 'seq': block.seq, 't0': block.t0, 'dt': block.dt})
+            else:
+                self.write_marker("Block " + str(block.seq) + " t0=" + repr(block.t0) + " dt=" + repr(block.dt))
+        self._t_end = block.t_end
+        self.write_data(block.samples)
+        for summary in self._summaries:
+            summary.add(block.samples, block.t0, block.dt)
+
+    def write_marker(self, text):
+        """
+        Write a comment line (e.g. a trigger or configuration marker) between blocks of data
+        """
+        if self._meta is not None:
+            self._write_meta({'sample': self.samples_written, 'marker': text})
+        else:
+            self._file.write("# " + text + "\n")
 
     def close_file(self):
         self._file.close()
+        if self._meta is not None:
+            self._meta.close()
+        if self._index is not None:
+            self._index.close()
+        for summary in self._summaries:
+            summary.close()
 
 
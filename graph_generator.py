@@ -27,22 +27,35 @@ class GraphGenerator(object):
     Class that generate Matplotlib graph.
     """
 
-    def __init__(self):
+    def __init__(self, n_traces=1, n_axes=1):
         """
         Create empty structure plot.
+
+        :param n_traces: Number of lines (traces) to create
+        :param n_axes: Number of vertically stacked axes sharing the time axis. Trace i is drawn on axes i % n_axes,
+                    so n_axes=1 overlays every trace and n_axes=n_traces stacks them.
         """
         super().__init__()
 
-        self.fig, self.ax1 = plt.subplots(1, 1)
+        self.fig, axes = plt.subplots(n_axes, 1, sharex=True, squeeze=False)
+        self.axes = list(axes[:, 0])
+        self.ax1 = self.axes[0]
 
-        self.line1, = self.ax1.plot([], [], label='line1')
+        # The lines are animated: they are left out of full draws and blitted over the cached background of their axes
+        # by MatplotFigure, so only changed traces cost rendering time
+        self.lines = []
+        for i in range(n_traces):
+            line, = self.axes[i % n_axes].plot([], [], label='line' + str(i + 1), animated=True)
+            self.lines.append(line)
+        self.line1 = self.lines[0]
 
         self.xmin, self.xmax = self.ax1.get_xlim()
         self.ymin, self.ymax = self.ax1.get_ylim()
 
         self.fig.subplots_adjust(left=0.13, top=0.96, right=0.93, bottom=0.2)
 
-        self.ax1.set_xlim(self.xmin, self.xmax)
-        self.ax1.set_ylim(self.ymin, self.ymax)
-        self.ax1.set_xlabel("Samples", fontsize=font_size_axis_title)
-        self.ax1.set_ylabel("Voltage (V)", fontsize=font_size_axis_title)
+        for ax in self.axes:
+            ax.set_xlim(self.xmin, self.xmax)
+            ax.set_ylim(self.ymin, self.ymax)
+            ax.set_ylabel("Voltage (V)", fontsize=font_size_axis_title)
+        self.axes[-1].set_xlabel("Time (s)", fontsize=font_size_axis_title)
@@ -8,8 +8,10 @@ and kivy scatter
 
 import math
 import matplotlib
+import numpy as np
 
 matplotlib.use('Agg')
+from kivy.clock import Clock
 from kivy.graphics.texture import Texture
 from kivy.graphics.transformation import Matrix
 from kivy.lang import Builder
@@ -18,13 +20,27 @@ from kivy.properties import ObjectProperty, ListProperty, BooleanProperty, Bound
 from kivy.uix.widget import Widget
 from kivy.vector import Vector
 from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgba
 from kivy.metrics import dp
 
+from trace_raster import draw_trace
+
 
 class MatplotFigure(Widget):
     """Widget to show a matplotlib figure in kivy.
     The figure is rendered internally in an AGG backend then
     the rgba data is obtained and blitted into a kivy texture
+
+    The figure may hold several axes with several lines each. Lines marked
+    animated are left out of full draws: after each full draw the background
+    of every axes is cached, and update_lines() then redraws only the axes of
+    the lines that changed and uploads only their region to the texture.
+    With fast_renderer enabled, animated lines are drawn by trace_raster
+    straight into the Agg buffer instead of through matplotlib.
+
+    Pan and zoom input is coalesced: touch moves and scroll steps only
+    accumulate a pending view, which is applied to the axes limits and
+    rendered once at the next frame, however many events arrive in between.
     """
 
     figure = ObjectProperty(None)
@@ -56,14 +72,16 @@ class MatplotFigure(Widget):
         self.width = w
         self.height = h
 
-        # Texture
+        # Texture, flipped like every texture made by _draw_bitmap so it can be updated in place
         self._img_texture = Texture.create(size=(w, h))
+        self._img_texture.flip_vertical()
 
     def __init__(self, **kwargs):
         super(MatplotFigure, self).__init__(**kwargs)
 
         # figure info
         self.figure = None
+        # axes used for touch interactions (the other axes of the figure share its x axis)
         self.axes = None
         self.xmin = None
         self.xmax = None
@@ -74,6 +92,7 @@ class MatplotFigure(Widget):
         self.zoompan = None
         self.fast_draw = True
         self.draw_left_spline = False  # available only when fast_draw is True
+        self.fast_renderer = False  # draw animated lines with trace_raster
         self.touch_mode = 'pan'
 
         # zoom box coordonnate
@@ -86,6 +105,16 @@ class MatplotFigure(Widget):
         self._touches = []
         self._last_touch_pos = {}
 
+        # cached background of each axes and the limits it was drawn with, set by every full draw
+        self._backgrounds = {}
+
+        # pan and zoom accumulated since the last frame: the view as display pixels of the current limits
+        self._pending_view = None
+        # render requested for the next frame: None, 'blit' or 'full', and lines to redraw
+        self._pending_render = None
+        self._pending_lines = []
+        self._trigger_render = Clock.create_trigger(self._render)
+
         self.bind(size=self._onSize)
 
     def home(self) -> None:
@@ -95,11 +124,190 @@ class MatplotFigure(Widget):
             None
         """
         ax = self.axes
-        ax.set_xlim(self.xmin, self.xmax)
-        ax.set_ylim(self.ymin, self.ymax)
+        self._pending_view = None
+        for axes in ax.figure.axes:
+            axes.set_xlim(self.xmin, self.xmax)
+            axes.set_ylim(self.ymin, self.ymax)
+
+        self.request_render(full=True)
+
+    def get_xlim(self):
+        """ x limits of the axes used for touch interactions, including pending pan and zoom """
+        self._apply_pending_view()
+        return self.axes.get_xlim()
+
+    @property
+    def plot_width(self):
+        """ width of the plot area in pixels """
+        return self.axes.bbox.width
+
+    def store_backgrounds(self):
+        """ cache the background (everything but the animated artists) of every axes after a full draw """
+        canvas = self.figure.canvas
+        self._backgrounds = {ax: (canvas.copy_from_bbox(ax.bbox), ax.get_xlim(), ax.get_ylim())
+                             for ax in self.figure.axes}
+
+    def update_lines(self, lines):
+        """ redraw changed lines over the cached backgrounds
+
+        Only the axes holding one of the lines are redrawn (with all of
+        their lines, as they may overlap) and only their regions are uploaded
+        to the texture. Falls back to a full draw when an axes has no valid
+        cached background, e.g. because its limits changed.
+
+        Args:
+            lines: the matplotlib lines whose data changed
+
+        Return:
+            None
+        """
+        canvas = self.figure.canvas
+        changed_axes = []
+        for line in lines:
+            if line.axes not in changed_axes:
+                changed_axes.append(line.axes)
+        for ax in changed_axes:
+            background = self._backgrounds.get(ax)
+            if background is None or background[1] != ax.get_xlim() or background[2] != ax.get_ylim():
+                canvas.draw()
+                return
+        for ax in changed_axes:
+            canvas.restore_region(self._backgrounds[ax][0])
+            for line in ax.lines:
+                self.draw_line(line)
+            canvas.blit(ax.bbox)
+
+    def request_update_lines(self, lines):
+        """ redraw changed lines at the next frame, together with any pending pan and zoom
+
+        Args:
+            lines: the matplotlib lines whose data changed
+
+        Return:
+            None
+        """
+        for line in lines:
+            if line not in self._pending_lines:
+                self._pending_lines.append(line)
+        self._trigger_render()
+
+    def request_render(self, full=False):
+        """ render the figure at the next frame
+
+        Requests made before the frame are merged into one render: a full
+        draw if any of them asked for one (or fast_draw is off), otherwise a
+        blit of the data areas.
+
+        Args:
+            full: redraw the whole figure, ticks included
+
+        Return:
+            None
+        """
+        if full or not self.fast_draw:
+            self._pending_render = 'full'
+        elif self._pending_render is None:
+            self._pending_render = 'blit'
+        self._trigger_render()
+
+    def _render(self, *args):
+        """ apply the pending view and render once, called by the clock at the next frame """
+        if self.figure is None:
+            return
+        render, lines = self._pending_render, self._pending_lines
+        self._pending_render = None
+        self._pending_lines = []
+        self._apply_pending_view()
+        if render == 'full':
+            self.figure.canvas.draw_idle()
+            self.figure.canvas.flush_events()
+        elif render == 'blit':
+            # use blit method
+            self._fast_draw()
+        elif lines:
+            self.update_lines(lines)
+
+    def _view(self):
+        """ the pending view as [x0, y0, x1, y1] in display pixels of the current limits """
+        if self._pending_view is None:
+            self._pending_view = list(self.axes.bbox.extents)
+        return self._pending_view
+
+    def _pan_view(self, dx, dy):
+        """ move the pending view so the data follows a (dx, dy) pixel drag """
+        view = self._view()
+        x0, y0, x1, y1 = self.axes.bbox.extents
+        dx *= (view[2] - view[0]) / (x1 - x0)
+        dy *= (view[3] - view[1]) / (y1 - y0)
+        view[0] -= dx
+        view[2] -= dx
+        view[1] -= dy
+        view[3] -= dy
+
+    def _zoom_view(self, scale_factor, x, y):
+        """ scale the pending view by scale_factor around the display pixel (x, y) """
+        view = self._view()
+        x0, y0, x1, y1 = self.axes.bbox.extents
+        # the pixel of the current limits shown at (x, y)
+        u = view[0] + (x - x0) * (view[2] - view[0]) / (x1 - x0)
+        v = view[1] + (y - y0) * (view[3] - view[1]) / (y1 - y0)
+        view[:] = [u - (u - view[0]) * scale_factor, v - (v - view[1]) * scale_factor,
+                   u + (view[2] - u) * scale_factor, v + (view[3] - v) * scale_factor]
+
+    def _apply_pending_view(self):
+        """ set the limits of the pending view, once for all the input since the last frame """
+        if self._pending_view is None:
+            return
+        view, self._pending_view = self._pending_view, None
+        ax = self.axes
+        (xmin, ymin), (xmax, ymax) = ax.transData.inverted().transform([view[:2], view[2:]])
+        ax.set_xlim(xmin, xmax)
+        ax.set_ylim(ymin, ymax)
+
+    def draw_line(self, line):
+        """ draw a line into the Agg buffer
 
-        ax.figure.canvas.draw_idle()
-        ax.figure.canvas.flush_events()
+        With fast_renderer, animated lines (streaming traces with sorted x
+        values) are rasterized by trace_raster into the plot area of their
+        axes. Other lines, and lines on non-linear scales, are drawn by
+        matplotlib.
+
+        Args:
+            line: a matplotlib line
+
+        Return:
+            None
+        """
+        ax = line.axes
+        if not (self.fast_renderer and line.get_animated()) or ax.get_xscale() != 'linear' or \
+                ax.get_yscale() != 'linear':
+            ax.draw_artist(line)
+            return
+        if not line.get_visible():
+            return
+        buffer = np.asarray(self.figure.canvas.get_renderer().buffer_rgba())
+        height = buffer.shape[0]
+        x0, y0, x1, y1 = ax.bbox.extents
+        # The buffer rows run from the top of the figure, matplotlib pixels from the bottom
+        plot_area = buffer[height - int(round(y1)):height - int(round(y0)), int(round(x0)):int(round(x1))]
+        color = [int(round(255 * c)) for c in to_rgba(line.get_color(), line.get_alpha())]
+        draw_trace(plot_area, np.asarray(line.get_xdata(), dtype=np.float64),
+                   np.asarray(line.get_ydata(), dtype=np.float64), ax.get_xlim(), ax.get_ylim(), color,
+                   linewidth=max(int(round(line.get_linewidth() * self.figure.dpi / 72)), 1))
+
+    def _fast_draw(self):
+        """ blit the data area of every axes during pan and zoom (the axes share the x axis) """
+        for ax in self.figure.axes:
+            ax.draw_artist(ax.patch)
+
+            # if you want the left spline during on_move (slower)
+            if self.draw_left_spline:
+                ax.draw_artist(list(ax.spines.values())[0])
+
+            for line in ax.lines:
+                self.draw_line(line)
+            self.figure.canvas.blit(ax.bbox)
+        self.figure.canvas.flush_events()
 
     def reset_touch(self) -> None:
         """ reset touch
@@ -141,15 +349,35 @@ class MatplotFigure(Widget):
     1.0.
     '''
 
-    def _draw_bitmap(self):
-        """ draw bitmap method. based on kivy scatter method"""
+    def _draw_bitmap(self, bbox=None):
+        """ draw bitmap method. based on kivy scatter method
+
+        When the texture already has the right size only the region inside
+        bbox (in figure pixels) is uploaded, otherwise the whole bitmap.
+        """
         if self._bitmap is None:
             print("No bitmap!")
             return
-        self._img_texture = Texture.create(size=(self.bt_w, self.bt_h))
-        self._img_texture.blit_buffer(
-            bytes(self._bitmap), colorfmt="rgba", bufferfmt='ubyte')
-        self._img_texture.flip_vertical()
+        if self._img_texture is None or tuple(self._img_texture.size) != (self.bt_w, self.bt_h):
+            texture = Texture.create(size=(self.bt_w, self.bt_h))
+            texture.blit_buffer(bytes(self._bitmap), colorfmt="rgba", bufferfmt='ubyte')
+            texture.flip_vertical()
+            self._img_texture = texture
+            return
+        if bbox is None:
+            self._img_texture.blit_buffer(bytes(self._bitmap), colorfmt="rgba", bufferfmt='ubyte')
+        else:
+            # The bitmap rows run from the top of the figure, matplotlib pixels from the bottom
+            x0 = max(int(math.floor(bbox.x0)), 0)
+            x1 = min(int(math.ceil(bbox.x1)), self.bt_w)
+            y0 = max(self.bt_h - int(math.ceil(bbox.y1)), 0)
+            y1 = min(self.bt_h - int(math.floor(bbox.y0)), self.bt_h)
+            if x1 <= x0 or y1 <= y0:
+                return
+            region = np.ascontiguousarray(np.asarray(self._bitmap)[y0:y1, x0:x1])
+            self._img_texture.blit_buffer(region.tobytes(), pos=(x0, y0), size=(x1 - x0, y1 - y0), colorfmt="rgba",
+                                          bufferfmt='ubyte')
+        self.canvas.ask_update()
 
     def transform_with_touch(self, event):
         """ manage touch behaviour. based on kivy scatter method"""
@@ -220,13 +448,14 @@ class MatplotFigure(Widget):
             elif event.is_double_tap:
 
                 ax = self.axes
-                ax.set_xlim(self.xmin, self.xmax)
                 yoffset = abs(self.ymax - self.ymin) * 0.01
-                ax.set_ylim(self.ymin - yoffset, self.ymax + yoffset)
+                self._pending_view = None
+                for axes in ax.figure.axes:
+                    axes.set_xlim(self.xmin, self.xmax)
+                    axes.set_ylim(self.ymin - yoffset, self.ymax + yoffset)
 
                 self.reset_touch()
-                ax.figure.canvas.draw_idle()
-                ax.figure.canvas.flush_events()
+                self.request_render(full=True)
                 return True
 
             else:
@@ -252,20 +481,20 @@ class MatplotFigure(Widget):
 
         if event.is_double_tap:
             ax = self.axes
-            ax.set_xlim(self.xmin, self.xmax)
             yoffset = abs(self.ymax - self.ymin) * 0.01
-            ax.set_ylim(self.ymin - yoffset, self.ymax + yoffset)
+            self._pending_view = None
+            for axes in ax.figure.axes:
+                axes.set_xlim(self.xmin, self.xmax)
+                axes.set_ylim(self.ymin - yoffset, self.ymax + yoffset)
 
             self.reset_touch()
-            ax.figure.canvas.draw_idle()
-            ax.figure.canvas.flush_events()
+            self.request_render(full=True)
             return True
 
         # scale/translate
         if event in self._touches and event.grab_current == self:
 
-            if self.transform_with_touch(event):
-                self.transform_with_touch(event)
+            self.transform_with_touch(event)
             self._last_touch_pos[event] = event.pos
 
         # stop propagating if its within our bounds
@@ -290,95 +519,32 @@ class MatplotFigure(Widget):
             if self.do_update:
                 self.update_lim()
 
-            ax = self.axes
-            ax.figure.canvas.draw_idle()
-            ax.figure.canvas.flush_events()
+            self.request_render(full=True)
 
             return True
 
     def apply_zoom(self, scale_factor, ax, anchor=(0, 0), new_line=None):
-        """ zoom touch method """
+        """ zoom touch method, rendered at the next frame """
 
         x = anchor[0]
         y = anchor[1] - self.pos[1]
 
-        trans = ax.transData.inverted()
-        xdata, ydata = trans.transform_point((x + new_line.x / 2, y + new_line.y / 2))
-
-        cur_xlim = ax.get_xlim()
-        cur_ylim = ax.get_ylim()
-
-        new_width = (cur_xlim[1] - cur_xlim[0]) * scale_factor
-        new_height = (cur_ylim[1] - cur_ylim[0]) * scale_factor
-
-        relx = (cur_xlim[1] - xdata) / (cur_xlim[1] - cur_xlim[0])
-        rely = (cur_ylim[1] - ydata) / (cur_ylim[1] - cur_ylim[0])
-
-        ax.set_xlim([xdata - new_width * (1 - relx), xdata + new_width * (relx)])
-        ax.set_ylim([ydata - new_height * (1 - rely), ydata + new_height * (rely)])
-
-        if self.fast_draw:
-            # use blit method
-            ax.draw_artist(ax.patch)
-
-            # if you want the left spline during on_move (slower)
-            if self.draw_left_spline:
-                ax.draw_artist(list(ax.spines.values())[0])
-
-            for line in ax.lines:
-                ax.draw_artist(line)
-            ax.figure.canvas.blit(ax.bbox)
-            ax.figure.canvas.flush_events()
-        else:
-            ax.figure.canvas.draw_idle()
-            ax.figure.canvas.flush_events()
+        self._zoom_view(scale_factor, x + new_line.x / 2, y + new_line.y / 2)
+        self.request_render()
 
     def apply_pan(self, ax, event):
-        """ pan method """
-
-        trans = ax.transData.inverted()
-        xdata, ydata = trans.transform_point((event.x, event.y))
-        xpress, ypress = trans.transform_point((self._last_touch_pos[event][0], self._last_touch_pos[event][1]))
-        dx = xdata - xpress
-        dy = ydata - ypress
-
-        cur_xlim = ax.get_xlim()
-        cur_ylim = ax.get_ylim()
-        cur_xlim -= dx
-        cur_ylim -= dy
-        ax.set_xlim(cur_xlim)
-        ax.set_ylim(cur_ylim)
-
-        if self.fast_draw:
-            # use blit method
-            ax.draw_artist(ax.patch)
-            # if you want the left spline during on_move (slower)
-            if self.draw_left_spline:
-                ax.draw_artist(list(ax.spines.values())[0])
+        """ pan method, rendered at the next frame """
 
-            for line in ax.lines:
-                ax.draw_artist(line)
-
-            ax.figure.canvas.blit(ax.bbox)
-            ax.figure.canvas.flush_events()
-
-        else:
-            ax.figure.canvas.draw_idle()
-            ax.figure.canvas.flush_events()
+        self._pan_view(event.x - self._last_touch_pos[event][0], event.y - self._last_touch_pos[event][1])
+        self.request_render()
 
     def zoom_factory(self, event, ax, base_scale=1.1):
-        """ zoom with scrolling mouse method """
+        """ zoom with scrolling mouse method, rendered at the next frame """
 
         newcoord = self.to_widget(event.x, event.y, relative=True)
         x = newcoord[0]
         y = newcoord[1]
 
-        trans = ax.transData.inverted()
-        xdata, ydata = trans.transform_point((x, y))
-
-        cur_xlim = ax.get_xlim()
-        cur_ylim = ax.get_ylim()
-
         if event.button == 'scrolldown':
             # deal with zoom in
             scale_factor = 1 / base_scale
@@ -390,17 +556,8 @@ class MatplotFigure(Widget):
             scale_factor = 1
             print(event.button)
 
-        new_width = (cur_xlim[1] - cur_xlim[0]) * scale_factor
-        new_height = (cur_ylim[1] - cur_ylim[0]) * scale_factor
-
-        relx = (cur_xlim[1] - xdata) / (cur_xlim[1] - cur_xlim[0])
-        rely = (cur_ylim[1] - ydata) / (cur_ylim[1] - cur_ylim[0])
-
-        ax.set_xlim([xdata - new_width * (1 - relx), xdata + new_width * (relx)])
-        ax.set_ylim([ydata - new_height * (1 - rely), ydata + new_height * (rely)])
-
-        ax.figure.canvas.draw_idle()
-        ax.figure.canvas.flush_events()
+        self._zoom_view(scale_factor, x, y)
+        self.request_render(full=True)
 
     def _onSize(self, o, size):
         """ _onsize method """
@@ -425,6 +582,8 @@ class MatplotFigure(Widget):
         ax = self.axes
 
         self.do_update = False
+        # the box replaces any pan or zoom not yet applied
+        self._pending_view = None
 
         ax.set_xlim(left=min(self.x0_box, self.x1_box), right=max(self.x0_box, self.x1_box))
         ax.set_ylim(bottom=min(self.y0_box, self.y1_box), top=max(self.y0_box, self.y1_box))
@@ -553,6 +712,12 @@ class _FigureCanvas(FigureCanvasAgg):
         Render the figure using agg.
         """
         super(_FigureCanvas, self).draw()
+        # Cache the backgrounds before drawing the animated lines over them
+        self.widget.store_backgrounds()
+        for ax in self.figure.axes:
+            for line in ax.lines:
+                if line.get_animated():
+                    self.widget.draw_line(line)
         agg = self.get_renderer()
         w, h = agg.width, agg.height
         self._isDrawn = True
@@ -571,7 +736,7 @@ class _FigureCanvas(FigureCanvasAgg):
         self.widget._bitmap = agg.buffer_rgba()
         self.widget.bt_w = w
         self.widget.bt_h = h
-        self.widget._draw_bitmap()
+        self.widget._draw_bitmap(bbox)
 
 
 from kivy.factory import Factory
@@ -0,0 +1,347 @@
+"""
+kivy_graph.py: Graph widget drawing its traces with native Kivy vertex instructions, an alternative backend to the
+matplotlib based MatplotFigure. Each trace is a Mesh in line_strip mode whose vertex buffer is refilled in place from
+the (decimated) data, so a frame costs time proportional to the number of vertices: nothing is rendered off-screen and
+no texture is uploaded. The frame, ticks and labels are only rebuilt when the limits or the widget size change. Pan and
+scroll zoom accumulate the change of view, which is applied to the limits once per frame, like MatplotFigure does.
+
+Only OpenGL ES 2 features are used (meshes, lines and the stencil buffer for clipping), so the widget also runs under a
+software OpenGL renderer on headless Linux, e.g. Mesa llvmpipe with LIBGL_ALWAYS_SOFTWARE=1 under xvfb-run.
+
+KivyGraph keeps the interface the app uses on MatplotFigure: xmin/xmax/ymin/ymax with home(), touch_mode 'pan' or
+'zoombox', get_xlim(), plot_width, line1 with set_data() and update_lines(). Double tap returns home and the mouse
+wheel zooms around the cursor.
+"""
+
+import math
+
+import numpy as np
+from kivy.clock import Clock
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Color, InstructionGroup, Line, Mesh, Rectangle, StencilPop, StencilPush, StencilUnUse, \
+    StencilUse
+from kivy.metrics import dp
+from kivy.properties import ListProperty, StringProperty
+from kivy.uix.widget import Widget
+
+from waveform import decimate_minmax
+
+# Mesh indices are unsigned shorts
+MAX_VERTICES = 65535
+# matplotlib's default color cycle, so both backends look alike
+TRACE_COLORS = [(0.122, 0.467, 0.706, 1), (1.0, 0.498, 0.055, 1), (0.173, 0.627, 0.173, 1), (0.839, 0.153, 0.157, 1),
+                (0.580, 0.404, 0.741, 1), (0.549, 0.337, 0.294, 1)]
+
+
+def nice_ticks(vmin, vmax, max_ticks=8):
+    """
+    Returns round tick values (1, 2 or 5 times a power of ten apart) within [vmin, vmax].
+    """
+    span = vmax - vmin
+    if not span > 0 or not math.isfinite(span):
+        return []
+    raw_step = span / max_ticks
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    for multiple in (1, 2, 5, 10):
+        if multiple * magnitude >= raw_step:
+            break
+    step = multiple * magnitude
+    return [i * step for i in range(int(math.ceil(vmin / step)), int(math.floor(vmax / step)) + 1)]
+
+
+class KivyTrace:
+    """
+    One trace of a KivyGraph, drawn as a line strip Mesh. set_data mirrors the matplotlib line method.
+    """
+
+    def __init__(self, graph, color):
+        self.graph = graph
+        self.color = Color(*color)
+        self.mesh = Mesh(mode='line_strip')
+        self.xdata = np.empty(shape=(0,))
+        self.ydata = np.empty(shape=(0,))
+        # Vertex (x, y, u, v) and index buffers, grown as needed and refilled in place
+        self._vertices = np.zeros(shape=(0, 4), dtype=np.float32)
+        self._indices = np.zeros(shape=(0,), dtype=np.uint16)
+
+    def set_data(self, xdata, ydata):
+        """
+        Sets the data of the trace. The vertices are updated on the next frame, or right away by update_lines(). Data
+        with more points than a mesh holds is decimated to its minimum and maximum per bucket.
+        """
+        xdata = np.asarray(xdata, dtype=np.float64)
+        ydata = np.asarray(ydata, dtype=np.float64)
+        if xdata.shape[0] > MAX_VERTICES:
+            # Two points per bucket plus a remainder shorter than the bucket count fit in three per bucket
+            xdata, ydata = decimate_minmax(xdata, ydata, MAX_VERTICES // 3)
+        self.xdata = xdata
+        self.ydata = ydata
+        self.graph.mark_dirty(self)
+
+    def update_vertices(self):
+        """
+        Maps the data to widget pixels and hands the vertex buffer to the mesh.
+        """
+        n = self.xdata.shape[0]
+        if self._vertices.shape[0] < n:
+            self._vertices = np.zeros(shape=(n, 4), dtype=np.float32)
+            self._indices = np.arange(n, dtype=np.uint16)
+        (x0, y0), (sx, sy), (xmin, ymin) = self.graph.data_transform()
+        vertices = self._vertices[:n]
+        vertices[:, 0] = x0 + (self.xdata - xmin) * sx
+        vertices[:, 1] = y0 + (self.ydata - ymin) * sy
+        self.mesh.vertices = vertices.reshape(-1)
+        self.mesh.indices = self._indices[:n]
+
+
+class KivyGraph(Widget):
+    """
+    Graph widget with native Kivy rendering. See the module docstring.
+    """
+
+    xlim = ListProperty([0.0, 1.0])
+    ylim = ListProperty([-1.0, 1.0])
+    xlabel = StringProperty('Time (s)')
+    ylabel = StringProperty('Voltage (V)')
+
+    def __init__(self, n_traces=1, **kwargs):
+        super(KivyGraph, self).__init__(**kwargs)
+        # home limits
+        self.xmin = 0.0
+        self.xmax = 1.0
+        self.ymin = -1.0
+        self.ymax = 1.0
+        self.touch_mode = 'pan'
+        # room for the tick labels around the plot area
+        self.margins = (dp(60), dp(45), dp(20), dp(25))  # left, bottom, right, top
+
+        self._label_cache = {}
+        self._dirty = set()
+        # pan and zoom accumulated since the last frame as [xmin, xmax, ymin, ymax], and whether the frame, ticks and
+        # labels need a rebuild
+        self._pending_view = None
+        self._axes_dirty = False
+        self._trigger_redraw = Clock.create_trigger(self._redraw)
+        self._box_start = None
+
+        with self.canvas:
+            Color(1, 1, 1, 1)
+            self._background = Rectangle()
+            Color(0, 0, 0, 1)
+            self._frame = Line(width=1)
+            self._tick_marks = Mesh(mode='lines')
+            self._labels = InstructionGroup()
+            # Clip the traces to the plot area with the stencil buffer
+            StencilPush()
+            self._stencil = Rectangle()
+            StencilUse()
+        self.lines = []
+        for i in range(n_traces):
+            trace = KivyTrace(self, TRACE_COLORS[i % len(TRACE_COLORS)])
+            self.canvas.add(trace.color)
+            self.canvas.add(trace.mesh)
+            self.lines.append(trace)
+        self.line1 = self.lines[0]
+        with self.canvas:
+            StencilUnUse()
+            self._stencil_clear = Rectangle()
+            StencilPop()
+        with self.canvas.after:
+            Color(0, 0, 1, 0.3)
+            self._box = Rectangle(size=(0, 0))
+
+        self.bind(pos=self._on_layout, size=self._on_layout, xlim=self._on_limits, ylim=self._on_limits)
+
+    def home(self):
+        """ reset data axis """
+        self._pending_view = None
+        self.xlim = [self.xmin, self.xmax]
+        self.ylim = [self.ymin, self.ymax]
+
+    def get_xlim(self):
+        """ x limits including pending pan and zoom """
+        self._apply_pending_view()
+        return tuple(self.xlim)
+
+    @property
+    def plot_width(self):
+        """ width of the plot area in pixels """
+        return max(self.width - self.margins[0] - self.margins[2], 1)
+
+    def plot_area(self):
+        """ (x, y, width, height) of the plot area in window coordinates """
+        left, bottom, right, top = self.margins
+        return (self.x + left, self.y + bottom, max(self.width - left - right, 1),
+                max(self.height - bottom - top, 1))
+
+    def data_transform(self):
+        """ ((x0, y0), (sx, sy), (xmin, ymin)) mapping data values to pixels: x0 + (x - xmin) * sx """
+        x, y, width, height = self.plot_area()
+        (xmin, xmax), (ymin, ymax) = self.xlim, self.ylim
+        return (x, y), (width / ((xmax - xmin) or 1.0), height / ((ymax - ymin) or 1.0)), (xmin, ymin)
+
+    def to_data(self, px, py):
+        """ converts window coordinates to data values """
+        (x0, y0), (sx, sy), (xmin, ymin) = self.data_transform()
+        return xmin + (px - x0) / sx, ymin + (py - y0) / sy
+
+    def mark_dirty(self, trace):
+        """ schedules a vertex update of a trace for the next frame """
+        self._dirty.add(trace)
+        self._trigger_redraw()
+
+    def update_lines(self, lines):
+        """ updates the vertices of the given traces right away """
+        for trace in lines:
+            self._dirty.discard(trace)
+            trace.update_vertices()
+
+    def request_update_lines(self, lines):
+        """ updates the vertices of the given traces at the next frame """
+        for trace in lines:
+            self.mark_dirty(trace)
+
+    def _redraw(self, *args):
+        self._apply_pending_view()
+        if self._axes_dirty:
+            self._axes_dirty = False
+            self._update_axes()
+        self.update_lines(list(self._dirty))
+
+    def _view(self):
+        """ the pending view as [xmin, xmax, ymin, ymax], starting from the current limits """
+        if self._pending_view is None:
+            self._pending_view = list(self.xlim) + list(self.ylim)
+            self._trigger_redraw()
+        return self._pending_view
+
+    def _apply_pending_view(self):
+        """ set the limits of the pending view, once for all the input since the last frame """
+        if self._pending_view is None:
+            return
+        view, self._pending_view = self._pending_view, None
+        self.xlim = view[:2]
+        self.ylim = view[2:]
+
+    def _on_layout(self, *args):
+        x, y, width, height = self.plot_area()
+        self._background.pos = self.pos
+        self._background.size = self.size
+        self._stencil.pos = self._stencil_clear.pos = (x, y)
+        self._stencil.size = self._stencil_clear.size = (width, height)
+        self._on_limits()
+
+    def _on_limits(self, *args):
+        self._axes_dirty = True
+        for trace in self.lines:
+            self.mark_dirty(trace)
+
+    def _label(self, text):
+        """ returns the (cached) texture of a label """
+        texture = self._label_cache.get(text)
+        if texture is None:
+            label = CoreLabel(text=text, font_size=dp(12), color=(0, 0, 0, 1))
+            label.refresh()
+            texture = self._label_cache[text] = label.texture
+        return texture
+
+    def _add_label(self, text, x, y, anchor_x, anchor_y):
+        texture = self._label(text)
+        width, height = texture.size
+        self._labels.add(Rectangle(texture=texture, size=texture.size,
+                                   pos=(x - width * anchor_x, y - height * anchor_y)))
+
+    def _update_axes(self):
+        """ rebuilds the frame, tick marks and labels for the current limits and size """
+        x, y, width, height = self.plot_area()
+        (x0, y0), (sx, sy), (xmin, ymin) = self.data_transform()
+        self._frame.rectangle = (x, y, width, height)
+        self._labels.clear()
+        self._labels.add(Color(0, 0, 0, 1))
+        tick_length = dp(5)
+        vertices = []
+        for value in nice_ticks(*self.xlim, max_ticks=max(int(width / dp(80)), 2)):
+            px = x0 + (value - xmin) * sx
+            vertices += [px, y, 0, 0, px, y - tick_length, 0, 0]
+            self._add_label('{:g}'.format(round(value, 12)), px, y - tick_length - dp(2), 0.5, 1)
+        for value in nice_ticks(*self.ylim, max_ticks=max(int(height / dp(40)), 2)):
+            py = y0 + (value - ymin) * sy
+            vertices += [x, py, 0, 0, x - tick_length, py, 0, 0]
+            self._add_label('{:g}'.format(round(value, 12)), x - tick_length - dp(2), py, 1, 0.5)
+        self._add_label(self.xlabel, x + width / 2, self.y + dp(2), 0.5, 0)
+        self._add_label(self.ylabel, self.x + dp(2), y + height + dp(4), 0, 0)
+        self._tick_marks.vertices = vertices
+        self._tick_marks.indices = list(range(len(vertices) // 4))
+
+    def _apply_box(self, start, end):
+        """ zooms to the box between two window positions, on one axis only when the box is a thin band """
+        self._apply_pending_view()
+        box_width, box_height = abs(end[0] - start[0]), abs(end[1] - start[1])
+        (x0, y0), (x1, y1) = self.to_data(*start), self.to_data(*end)
+        if box_width > dp(50) and box_height > dp(50):
+            self.xlim = [min(x0, x1), max(x0, x1)]
+            self.ylim = [min(y0, y1), max(y0, y1)]
+        elif box_width < dp(20) and box_height > dp(50):
+            self.ylim = [min(y0, y1), max(y0, y1)]
+        elif box_height < dp(20) and box_width > dp(50):
+            self.xlim = [min(x0, x1), max(x0, x1)]
+
+    def on_touch_down(self, touch):
+        """ Manage Mouse/touch press """
+        if not self.collide_point(*touch.pos):
+            return False
+        if touch.is_mouse_scrolling:
+            # same directions as MatplotFigure.zoom_factory
+            if touch.button == 'scrolldown':
+                self.zoom(touch.pos, 1 / 1.2)
+            elif touch.button == 'scrollup':
+                self.zoom(touch.pos, 1.2)
+        elif touch.is_double_tap:
+            self.home()
+        else:
+            touch.grab(self)
+            if self.touch_mode == 'zoombox':
+                self._box_start = touch.pos
+        return True
+
+    def on_touch_move(self, touch):
+        """ Manage Mouse/touch move while pressed """
+        if touch.grab_current is not self:
+            return self.collide_point(*touch.pos)
+        if self.touch_mode == 'pan':
+            view = self._view()
+            _, _, width, height = self.plot_area()
+            dx = touch.dx * (view[1] - view[0]) / width
+            dy = touch.dy * (view[3] - view[2]) / height
+            view[:] = [view[0] - dx, view[1] - dx, view[2] - dy, view[3] - dy]
+        elif self.touch_mode == 'zoombox' and self._box_start is not None:
+            x, y, width, height = self.plot_area()
+            end_x = min(max(touch.x, x), x + width)
+            end_y = min(max(touch.y, y), y + height)
+            self._box.pos = self._box_start
+            self._box.size = (end_x - self._box_start[0], end_y - self._box_start[1])
+        return True
+
+    def on_touch_up(self, touch):
+        """ Manage Mouse/touch release """
+        if touch.grab_current is not self:
+            return self.collide_point(*touch.pos)
+        touch.ungrab(self)
+        if self._box_start is not None:
+            box_x, box_y = self._box.pos
+            box_width, box_height = self._box.size
+            self._apply_box((box_x, box_y), (box_x + box_width, box_y + box_height))
+            self._box_start = None
+            self._box.size = (0, 0)
+        return True
+
+    def zoom(self, pos, scale_factor):
+        """ zooms both axes by scale_factor around a window position, at the next frame """
+        view = self._view()
+        x, y, width, height = self.plot_area()
+        xmin, xmax, ymin, ymax = view
+        # the data values of the pending view shown at pos
+        xdata = xmin + (pos[0] - x) / width * (xmax - xmin)
+        ydata = ymin + (pos[1] - y) / height * (ymax - ymin)
+        view[:] = [xdata - (xdata - xmin) * scale_factor, xdata + (xmax - xdata) * scale_factor,
+                   ydata - (ydata - ymin) * scale_factor, ydata + (ymax - ydata) * scale_factor]
@@ -0,0 +1,230 @@
+"""
+log_index.py: Chunk summary index of session logs. DataWriter writes a '<filename>.idx' sidecar as it logs, holding the
+sample range, min, max and mean of every chunk of the log (65536 samples by default) as fixed size binary records.
+Searches consult the index first and only read the chunks whose min and max show they can contain a match, so a
+threshold search over months of logs touches a handful of chunks.
+
+Only binary logs are indexed. They are memory-mapped, so skipping a chunk skips reading it from disk, whereas CSV logs
+are parsed in full when opened. CSV logs can still be searched, as a single chunk.
+
+Logs written without an index (e.g. by older versions) can be indexed afterwards. Usage:
+
+    python log_index.py --above 4.5 logs/*.bin
+    python log_index.py --above -0.1 --below 0.1 --min-samples 100 run1.bin
+    python log_index.py --build logs/*.bin
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from session_log import SessionLog
+
+INDEX_DTYPE = np.dtype([('start', '<i8'), ('stop', '<i8'), ('min', '<f8'), ('max', '<f8'), ('mean', '<f8')])
+DEFAULT_CHUNK_SAMPLES = 65536
+
+
+def index_filename(filename):
+    return filename + '.idx'
+
+
+def summarize(samples, start, chunk_samples):
+    """
+    Computes the index records of consecutive chunks of samples.
+
+    :param samples: The samples, starting at a chunk boundary
+    :param start: Sample number of samples[0]
+    :param chunk_samples: Samples per chunk. The last chunk may be shorter.
+    :return: An array of INDEX_DTYPE records
+    """
+    n = samples.shape[0]
+    boundaries = np.arange(0, n, chunk_samples)
+    records = np.empty(shape=boundaries.shape, dtype=INDEX_DTYPE)
+    if n == 0:
+        return records
+    records['start'] = start + boundaries
+    records['stop'] = start + np.append(boundaries[1:], n)
+    # fmin and fmax ignore NaN, so a chunk holding a NaN is still found by its other samples
+    records['min'] = np.fmin.reduceat(samples, boundaries)
+    records['max'] = np.fmax.reduceat(samples, boundaries)
+    records['mean'] = np.add.reduceat(samples, boundaries, dtype=np.float64) / (records['stop'] - records['start'])
+    return records
+
+
+class IndexWriter:
+    """
+    Appends the summary of every completed chunk of samples to an index file. Used by DataWriter.
+    """
+
+    def __init__(self, filename, chunk_samples=DEFAULT_CHUNK_SAMPLES):
+        """
+        :param filename: The index file, see index_filename()
+        :param chunk_samples: Samples per chunk
+        """
+        self.chunk_samples = chunk_samples
+        self._file = open(filename, 'wb')
+        # Samples of the chunk being filled
+        self._pending = []
+        self._pending_count = 0
+        self._start = 0
+
+    def add(self, samples):
+        """
+        Adds the next samples of the log.
+        """
+        # Copied, as the caller may reuse its buffer, in the sample dtype (summarize computes the mean in float64)
+        self._pending.append(np.array(samples))
+        self._pending_count += samples.shape[0]
+        if self._pending_count >= self.chunk_samples:
+            samples = np.concatenate(self._pending)
+            complete = samples.shape[0] - samples.shape[0] % self.chunk_samples
+            self._write(samples[:complete])
+            self._pending = [samples[complete:]]
+            self._pending_count = samples.shape[0] - complete
+
+    def _write(self, samples):
+        self._file.write(summarize(samples, self._start, self.chunk_samples).tobytes())
+        self._start += samples.shape[0]
+
+    def close(self):
+        """
+        Writes the last, partial chunk and closes the index.
+        """
+        if self._pending_count:
+            self._write(np.concatenate(self._pending))
+            self._pending = []
+            self._pending_count = 0
+        self._file.close()
+
+
+def build_index(session_log, chunk_samples=DEFAULT_CHUNK_SAMPLES, block_chunks=64):
+    """
+    Writes the index of a log that was written without one.
+
+    :param session_log: The SessionLog to index
+    :param chunk_samples: Samples per chunk
+    :param block_chunks: Number of chunks summarized at once
+    """
+    if session_log.file_format != 'binary':
+        raise ValueError('Invalid log format ' + session_log.file_format + '. Valid options include binary')
+    with open(index_filename(session_log.filename), 'wb') as f:
+        step = chunk_samples * block_chunks
+        for start in range(0, len(session_log), step):
+            f.write(summarize(session_log.samples[start:start + step], start, chunk_samples).tobytes())
+
+
+class LogIndex:
+    """
+    The chunk index of a session log.
+    """
+
+    def __init__(self, session_log):
+        """
+        Loads the index of a log. A log without an index, or the part of a log its index does not cover (e.g. after a
+        crash), is treated as one chunk that can match anything, so searches stay correct, only slower.
+
+        :param session_log: An open SessionLog
+        """
+        self.session_log = session_log
+        filename = index_filename(session_log.filename)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # Ignore a record cut short by a crash
+            records = np.frombuffer(data[:len(data) - len(data) % INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+            self.records = records[records['stop'] <= len(session_log)]
+        else:
+            self.records = np.empty(shape=(0,), dtype=INDEX_DTYPE)
+        covered = int(self.records['stop'][-1]) if self.records.shape[0] else 0
+        if covered < len(session_log):
+            tail = np.array([(covered, len(session_log), -np.inf, np.inf, np.nan)], dtype=INDEX_DTYPE)
+            self.records = np.concatenate((self.records, tail))
+
+    def candidates(self, above=None, below=None):
+        """
+        Returns the records of the chunks that may hold samples greater than above and less than below.
+        """
+        mask = np.ones(shape=self.records.shape, dtype=bool)
+        if above is not None:
+            mask &= self.records['max'] > above
+        if below is not None:
+            mask &= self.records['min'] < below
+        return self.records[mask]
+
+    def spans(self, above=None, below=None):
+        """
+        Returns the (start, stop) sample ranges of runs of adjacent candidate chunks.
+        """
+        records = self.candidates(above, below)
+        if records.shape[0] == 0:
+            return []
+        # A new span starts wherever a chunk does not directly follow the previous candidate
+        breaks = np.flatnonzero(records['start'][1:] != records['stop'][:-1]) + 1
+        starts = records['start'][np.concatenate(([0], breaks))]
+        stops = records['stop'][np.append(breaks - 1, records.shape[0] - 1)]
+        return list(zip(starts.tolist(), stops.tolist()))
+
+    def search(self, above=None, below=None, min_samples=1):
+        """
+        Finds the runs of consecutive samples greater than above and less than below (either bound may be None), e.g.
+        above=4.5 for every time the voltage exceeded 4.5 V, or above=-0.1, below=0.1 for a value range. Only the
+        chunks that can match are read.
+
+        :param above: Lower bound (exclusive) of the matching values
+        :param below: Upper bound (exclusive) of the matching values
+        :param min_samples: Shortest run reported
+        :return: A list of (start, stop) sample ranges
+        """
+        runs = []
+        for span_start, span_stop in self.spans(above, below):
+            values = self.session_log.samples[span_start:span_stop]
+            match = np.ones(shape=values.shape, dtype=bool)
+            if above is not None:
+                match &= values > above
+            if below is not None:
+                match &= values < below
+            edges = np.flatnonzero(np.diff(match.view(np.int8), prepend=0, append=0))
+            for start, stop in zip(edges[::2].tolist(), edges[1::2].tolist()):
+                if stop - start >= min_samples:
+                    runs.append((span_start + start, span_start + stop))
+        return runs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Search session logs using their chunk index.')
+    parser.add_argument('logs', nargs='+', help='Session logs written by DataWriter')
+    parser.add_argument('--above', type=float, help='Find samples greater than this value')
+    parser.add_argument('--below', type=float, help='Find samples less than this value')
+    parser.add_argument('--min-samples', type=int, default=1, help='Shortest run reported (default 1)')
+    parser.add_argument('--sample-rate', type=float, help='Sample rate for logs without block markers')
+    parser.add_argument('--build', action='store_true', help='(Re)build the index of each log instead of searching')
+    parser.add_argument('--chunk-samples', type=int, default=DEFAULT_CHUNK_SAMPLES,
+                        help='Samples per chunk when building (default {})'.format(DEFAULT_CHUNK_SAMPLES))
+    args = parser.parse_args(argv)
+    if not args.build and args.above is None and args.below is None:
+        parser.error('give --above and/or --below, or --build')
+
+    for filename in args.logs:
+        session_log = SessionLog(filename, sample_rate=args.sample_rate)
+        if args.build:
+            if session_log.file_format != 'binary':
+                print('{}: only binary logs are indexed, skipped'.format(filename))
+                continue
+            build_index(session_log, args.chunk_samples)
+            print('{}: indexed {} samples'.format(filename, len(session_log)))
+            continue
+        log_index = LogIndex(session_log)
+        read = sum(stop - start for start, stop in log_index.spans(args.above, args.below))
+        runs = log_index.search(args.above, args.below, args.min_samples)
+        for start, stop in runs:
+            values = session_log.samples[start:stop]
+            print('{}: samples {}-{} t={:.6f}s n={} min={:.4f} max={:.4f}'.format(
+                filename, start, stop, session_log.time_at(start), stop - start, values.min(), values.max()))
+        print('{}: {} runs, read {} of {} samples'.format(filename, len(runs), read, len(session_log)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
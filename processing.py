@@ -0,0 +1,290 @@
+"""
+processing.py: Per-block processing stages between the reader and its consumers. A stage is a function taking the
+samples of a block (a 1-D numpy array) and returning the processed samples, e.g. a calibration, a unit conversion or a
+derived signal. A stage may return fewer or more samples than it was given to resample the block; the block keeps its
+time span and covered acquired samples, so its sample period is scaled to match. A derived signal replaces the acquired
+one: stages cannot add channels, as every consumer of the blocks (display, stream and log) handles a single channel.
+The stages listed in the 'stages' entry of the task configuration are chained in order, and the processed blocks reach
+the UI queue, the stream subscribers and the data writer in acquisition order.
+
+Each stage runs in one of three modes:
+
+    1. inline - in the acquisition loop, for cheap stages
+    2. thread - in a thread pool, for stages that release the GIL (most numpy operations on large arrays)
+    3. process - in a process pool, so CPU-heavy stages spread across cores
+
+Pooled stages work on several blocks at once while the reader keeps reading, so they must not keep state from one block
+to the next. A stage is named by a name registered with register_stage() or by a 'module:function' path, and process
+stages must be module-level functions so they can be pickled. For example:
+
+    'stages': [{'function': 'scale', 'kwargs': {'gain': 100.0, 'offset': -0.5}},
+               {'function': 'my_filters:notch', 'kwargs': {'frequency': 50.0}, 'mode': 'process', 'workers': 4}]
+"""
+
+import collections
+import importlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+
+STAGE_MODES = ('inline', 'thread', 'process')
+
+# Stage functions by name, see register_stage
+STAGES = {}
+
+
+def register_stage(name, function=None):
+    """
+    Registers a stage function under a name for the 'stages' configuration. Use as a decorator or call directly.
+    """
+    if function is None:
+        return lambda f: register_stage(name, f)
+    STAGES[name] = function
+    return function
+
+
+@register_stage('scale')
+def scale(samples, gain=1.0, offset=0.0):
+    """
+    Linear calibration or unit conversion: samples * gain + offset.
+    """
+    return samples * gain + offset
+
+
+@register_stage('clip')
+def clip(samples, minimum=None, maximum=None):
+    """
+    Limits the samples to [minimum, maximum].
+    """
+    return np.clip(samples, minimum, maximum)
+
+
+def resolve_stage(function):
+    """
+    Returns the stage function registered under a name or found at a 'module:function' path.
+    """
+    if callable(function):
+        return function
+    if function in STAGES:
+        return STAGES[function]
+    module, _, name = function.partition(':')
+    if not name:
+        raise ValueError('Invalid stage ' + function + '. Valid options include ' + ', '.join(STAGES) +
+                         ' and module:function paths')
+    return getattr(importlib.import_module(module), name)
+
+
+def _run_stage(function, kwargs, samples):
+    """
+    Runs a stage function on the samples of one block, in the acquisition loop or a pool worker.
+
+    :return: A (processed samples, seconds spent) tuple
+    """
+    start = perf_counter()
+    result = np.asarray(function(samples, **kwargs))
+    return result, perf_counter() - start
+
+
+def _start_worker():
+    """
+    Does nothing. Submitted once per worker when a process stage is created, as the pool only spawns its workers when
+    tasks arrive.
+    """
+
+
+class StageTiming:
+    """
+    Time a stage spends processing blocks, measured where it runs.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.blocks = 0
+        self.total = 0.0
+        self.max_time = 0.0
+
+    def add(self, seconds):
+        self.blocks += 1
+        self.total += seconds
+        self.max_time = max(self.max_time, seconds)
+
+    def summary(self):
+        """
+        Returns a one line report in milliseconds.
+        """
+        mean = self.total / self.blocks if self.blocks else 0.0
+        return '{} blocks, mean {:.3f} ms, max {:.3f} ms, total {:.3f} s'.format(self.blocks, mean * 1e3,
+                                                                               self.max_time * 1e3, self.total)
+
+
+class Stage:
+    """
+    One configured stage and the pool it runs in.
+    """
+
+    def __init__(self, configuration):
+        """
+        :param configuration: A dict of 'function' (a registered name or 'module:function' path), 'kwargs' (keyword
+                    arguments of the function, default none), 'mode' (see STAGE_MODES, default 'inline'), 'workers'
+                    (pool size, default one per core) and 'name' (for the timing reports, default the function)
+        """
+        self.function = resolve_stage(configuration['function'])
+        self.kwargs = configuration.get('kwargs') or {}
+        self.mode = configuration.get('mode', 'inline')
+        if self.mode not in STAGE_MODES:
+            raise ValueError('Invalid stage mode ' + str(self.mode) + '. Valid options include ' +
+                             ', '.join(STAGE_MODES))
+        self.workers = configuration.get('workers') or os.cpu_count()
+        self.name = configuration.get('name') or str(configuration['function'])
+        self.timing = StageTiming()
+        self.executor = None
+        if self.mode == 'thread':
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stage-' + self.name)
+        elif self.mode == 'process':
+            # Spawned on every platform: forking the reader process would copy its running threads' locks
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+            # Start the workers now rather than on the first block, which would stall the acquisition
+            for future in [self.executor.submit(_start_worker) for _ in range(self.workers)]:
+                future.result()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+class _PendingBlock:
+    """
+    A block on its way through the stages.
+    """
+
+    __slots__ = ('block', 'samples', 'stage', 'future', 'submitted')
+
+    def __init__(self, block):
+        self.block = block
+        self.samples = block.samples
+        # Index of the next stage to run, and the result of the stage running in a pool
+        self.stage = 0
+        self.future = None
+        self.submitted = perf_counter()
+
+
+class ProcessingPipeline:
+    """
+    Runs every block through a chain of stages and returns the processed blocks in the order they were submitted.
+    Inline stages run when the pipeline is called, pooled stages in the background. The number of blocks in flight is
+    bounded, so a pipeline slower than the acquisition holds up the reader (and shows as read jitter or, at worst, a
+    DAQmx buffer overflow) instead of growing without limit.
+    """
+
+    def __init__(self, stage_configurations, max_pending=None):
+        """
+        :param stage_configurations: A list of stage configurations, see Stage
+        :param max_pending: Most blocks in flight (default twice the largest pool)
+        """
+        self.stages = []
+        try:
+            for configuration in stage_configurations:
+                self.stages.append(Stage(configuration))
+        except BaseException:
+            self.close()
+            raise
+        self.max_pending = max_pending or 2 * max([stage.workers for stage in self.stages
+                                                   if stage.executor is not None] or [1])
+        self._pending = collections.deque()
+        self.reset_timing()
+
+    def reset_timing(self):
+        """
+        Clears the timing of the stages and the latency, e.g. at the start of an acquisition.
+        """
+        for stage in self.stages:
+            stage.timing.reset()
+        self.latency = StageTiming()
+
+    def submit(self, block):
+        """
+        Starts processing a block. Waits for the oldest block first if max_pending blocks are in flight.
+        """
+        pending = _PendingBlock(block)
+        self._pending.append(pending)
+        self._advance(pending, wait=False)
+        if len(self._pending) > self.max_pending:
+            self._advance(self._pending[0], wait=True)
+
+    def ready(self):
+        """
+        Returns the processed blocks that are next in order, without waiting.
+        """
+        for pending in self._pending:
+            self._advance(pending, wait=False)
+        return self._pop_finished()
+
+    def drain(self):
+        """
+        Waits for every block in flight and returns them, processed, in order.
+        """
+        for pending in self._pending:
+            self._advance(pending, wait=True)
+        return self._pop_finished()
+
+    def _advance(self, pending, wait):
+        """
+        Runs a block through the stages until it is finished or, unless wait is set, a pooled stage is still working on
+        it.
+        """
+        while pending.stage < len(self.stages):
+            stage = self.stages[pending.stage]
+            if pending.future is None:
+                if stage.executor is None:
+                    samples, seconds = _run_stage(stage.function, stage.kwargs, pending.samples)
+                    self._finish_stage(pending, stage, samples, seconds)
+                    continue
+                pending.future = stage.executor.submit(_run_stage, stage.function, stage.kwargs, pending.samples)
+            if not wait and not pending.future.done():
+                return
+            samples, seconds = pending.future.result()
+            pending.future = None
+            self._finish_stage(pending, stage, samples, seconds)
+
+    def _finish_stage(self, pending, stage, samples, seconds):
+        if samples.ndim != 1:
+            raise ValueError('Invalid result of stage {}: an array of shape {}. Valid options include 1-D '
+                             'arrays'.format(stage.name, samples.shape))
+        # A resampling stage keeps the time span of the block, which still covers the same acquired samples
+        if samples.shape[0] != pending.samples.shape[0] and samples.shape[0] and pending.samples.shape[0]:
+            pending.block.dt *= pending.samples.shape[0] / samples.shape[0]
+        stage.timing.add(seconds)
+        pending.samples = samples
+        pending.stage += 1
+
+    def _pop_finished(self):
+        blocks = []
+        while self._pending and self._pending[0].stage == len(self.stages):
+            pending = self._pending.popleft()
+            # Keep the dtype of the acquisition, so consumers see the same blocks as without processing
+            pending.block.samples = np.ascontiguousarray(pending.samples, dtype=pending.block.samples.dtype)
+            self.latency.add(perf_counter() - pending.submitted)
+            blocks.append(pending.block)
+        return blocks
+
+    def summary(self):
+        """
+        Returns one line per stage and one for the latency from submit to delivery.
+        """
+        lines = ['{} ({}): {}'.format(stage.name, stage.mode, stage.timing.summary()) for stage in self.stages]
+        lines.append('latency: ' + self.latency.summary())
+        return lines
+
+    def close(self):
+        """
+        Shuts down the pools, dropping the blocks in flight. Call drain() first to keep them.
+        """
+        for stage in self.stages:
+            stage.close()
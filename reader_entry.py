@@ -0,0 +1,208 @@
+"""
+reader_entry.py: Lightweight entry point for launching an AnalogInputReader in a child process. Only the standard
+library is imported at module level, so this module (and any caller that only needs the command constants, the
+control channel, the Process wrapper or the entry functions) loads quickly. nidaqmx, numpy and the reader itself are
+imported lazily inside the child process when the entry function runs.
+"""
+
+import multiprocessing
+import queue
+import time
+from multiprocessing.queues import Queue as MultiprocessingQueue
+from multiprocessing.reduction import ForkingPickler
+
+# Global Constants
+GLOBAL_ACK = 'F'
+# Commands understood by a persistent reader (see AnalogInputReader.serve). Every command is sent over the
+# ControlChannel as a (command, argument) tuple.
+CMD_START = 'R'
+CMD_CONFIGURE = 'C'
+CMD_QUIT = 'Q'
+# Readiness messages sent back over the ControlChannel by a persistent reader
+READY_ACK = 'Y'
+STARTED_ACK = 'G'
+# Put on the UI queue after the last block of an acquisition
+END_OF_DATA = None
+# END_OF_DATA as it travels through a multiprocessing queue, see discard_blocks
+_END_OF_DATA_PICKLE = bytes(ForkingPickler.dumps(END_OF_DATA))
+
+
+def reader_class(task_configuration):
+    """
+    Returns the reader class for a task configuration: ReplayReader when it names a 'replay_file', SimulatedReader when
+    it holds a 'simulate' entry, otherwise AnalogInputReader.
+    """
+    if task_configuration.get('replay_file'):
+        from replay import ReplayReader
+        return ReplayReader
+    # An empty 'simulate' entry simulates a device with the default settings
+    if task_configuration.get('simulate') is not None:
+        from simulated import SimulatedReader
+        return SimulatedReader
+    from daqmx_reader import AnalogInputReader
+    return AnalogInputReader
+
+
+def run_reader(task_configuration, ui_queue, control):
+    """
+    Process target performing a single acquisition. See AnalogInputReader.run.
+    """
+    reader_class(task_configuration)(task_configuration, ui_queue, control).run()
+
+
+def serve_reader(task_configuration, ui_queue, control):
+    """
+    Process target running a persistent reader worker. See AnalogInputReader.serve. The reader class is chosen when the
+    worker starts, so switching between live and replayed data requires a new worker.
+    """
+    reader_class(task_configuration)(task_configuration, ui_queue, control).serve()
+
+
+def discard_blocks(ui_queue, process, poll_interval=0.05):
+    """
+    Discards the blocks a reader has queued for the caller, up to the END_OF_DATA it sends once its acquisition has
+    stopped, or until the reader dies. The items of a multiprocessing queue are read from its pipe and dropped without
+    unpickling them, so even a large backlog is discarded quickly. Call this before joining a reader process, which
+    cannot exit while its queued data has not been read.
+
+    :param ui_queue: The ui_queue given to the reader
+    :param process: The Process (or thread) running the reader
+    :param poll_interval: How often, in seconds, to check whether the process is still alive
+    """
+    # Reading the pipe directly relies on the private _rlock, _reader and _sem attributes of CPython's
+    # multiprocessing.Queue. Other queues, or a Queue without them, are emptied through get() instead.
+    if not (isinstance(ui_queue, MultiprocessingQueue) and
+            all(hasattr(ui_queue, name) for name in ('_rlock', '_reader', '_sem'))):
+        while True:
+            try:
+                if ui_queue.get(block=True, timeout=poll_interval) is END_OF_DATA:
+                    return
+            except queue.Empty:
+                if not process.is_alive():
+                    return
+    while True:
+        alive = process.is_alive()
+        # Same steps as Queue.get, minus the unpickling
+        with ui_queue._rlock:
+            data = ui_queue._reader.recv_bytes() if ui_queue._reader.poll(poll_interval if alive else 0) else None
+        if data is None:
+            if alive:
+                continue
+            return
+        ui_queue._sem.release()
+        if data == _END_OF_DATA_PICKLE:
+            return
+
+
+class ControlChannel:
+    """
+    Low latency control channel between a caller and a reader. Commands and ACKs travel over a duplex Pipe, which wakes
+    up the waiting side as soon as a message arrives. Stop requests are signalled through an Event that the reader also
+    checks while waiting for samples, so a stop interrupts a pending read instead of waiting for it to complete.
+
+    Pass the channel to the reader process as a Process argument. It also works between threads of one process.
+    """
+
+    def __init__(self):
+        self._caller_conn, self._reader_conn = multiprocessing.Pipe()
+        self._stop_event = multiprocessing.Event()
+
+    def send(self, command, argument=None):
+        """
+        Sends a (command, argument) tuple to the reader.
+        """
+        self._caller_conn.send((command, argument))
+
+    def stop(self):
+        """
+        Asks the reader to stop the running acquisition. It answers GLOBAL_ACK once the task is stopped and the log
+        file closed.
+        """
+        self._stop_event.set()
+
+    def wait_for_ack(self, expected, process, timeout=None, poll_interval=0.05):
+        """
+        Waits for the expected ACK from the reader, discarding any other ACKs received in the meantime.
+
+        :param expected: The ACK to wait for, e.g. READY_ACK
+        :param process: The Process (or thread) running the reader. Waiting stops if it dies.
+        :param timeout: Longest wait in seconds, None to wait as long as the process is alive
+        :param poll_interval: How often, in seconds, to check whether the process is still alive
+        :return: True if the ACK was received, False if the process died or the timeout expired first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self._caller_conn.poll(poll_interval):
+                if self._caller_conn.recv() == expected:
+                    return True
+            elif not process.is_alive():
+                return False
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    def receive(self):
+        """
+        Reader side: blocks until the next (command, argument) tuple arrives.
+        """
+        return self._reader_conn.recv()
+
+    def poll_command(self):
+        """
+        Reader side: returns the next (command, argument) tuple if one has arrived, otherwise None. Does not block.
+        """
+        if self._reader_conn.poll():
+            return self._reader_conn.recv()
+        return None
+
+    def ack(self, message):
+        """
+        Reader side: sends an ACK to the caller.
+        """
+        self._reader_conn.send(message)
+
+    def stop_requested(self):
+        """
+        Reader side: returns True once the caller asked to stop the acquisition.
+        """
+        return self._stop_event.is_set()
+
+    def wait_for_stop(self, timeout=None):
+        """
+        Reader side: waits up to timeout seconds (forever for None) for a stop request.
+
+        :return: True if a stop was requested
+        """
+        return self._stop_event.wait(timeout)
+
+    def clear_stop(self):
+        """
+        Clears a stop request once it has been handled. The caller clears it too, in case no reader was there to
+        handle it.
+        """
+        self._stop_event.clear()
+
+
+class Process(multiprocessing.Process):
+    """
+    Class which returns child Exceptions to Parent.
+    https://stackoverflow.com/a/33599967/4992248
+    """
+
+    def __init__(self, *args, **kwargs):
+        multiprocessing.Process.__init__(self, *args, **kwargs)
+        self._parent_conn, self._child_conn = multiprocessing.Pipe()
+        self._exception = None
+
+    def run(self):
+        try:
+            multiprocessing.Process.run(self)
+            self._child_conn.send(None)
+        except Exception as e:
+            exception = str(e)
+            self._child_conn.send(exception)
+
+    @property
+    def exception(self):
+        if self._parent_conn.poll():
+            self._exception = self._parent_conn.recv()
+        return self._exception
@@ -0,0 +1,107 @@
+"""
+replay.py: Replays a session log written by DataWriter through the live pipeline. ReplayReader is a drop-in
+replacement for AnalogInputReader: it speaks the same ControlChannel protocol and sends the recorded samples as
+WaveformBlocks to the same UI queue, stream subscribers and trigger that live data goes through, so field issues can be
+reproduced and the display and processing stages load-tested with real signals.
+
+Replay runs at 1x (real time), Nx or as fast as possible (speed 0). The reader processes use it when the task
+configuration holds a 'replay_file' entry, for example:
+
+    {'replay_file': 'Output_Data.bin', 'replay_speed': 10, 'replay_loop': True, 'samples_per_read': 1000, ...}
+"""
+
+from time import perf_counter
+
+from daqmx_reader import AnalogInputReader
+from session_log import SessionLog
+from waveform import SAMPLE_DTYPES
+
+
+class ReplayReader(AnalogInputReader):
+    """
+    AnalogInputReader whose samples come from a session log instead of a DAQmx task.
+    """
+
+    def configure(self, task_configuration):
+        """
+        Stores a new configuration. Besides the usual keys (sample_rate is only used for logs without block markers):
+
+            'replay_file' - the log to replay
+            'replay_speed' - 1 for real time, N for N times faster, 0 for as fast as possible (default 1)
+            'replay_loop' - start over at the end of the log instead of waiting for a stop (default False)
+            'replay_output_file' - log the replayed data again to this file (default None, no logging)
+
+        Without a 'sample_dtype' entry, binary logs are replayed in the dtype they were recorded in.
+        """
+        super().configure(task_configuration)
+        self._sample_dtype_configured = 'sample_dtype' in task_configuration
+        self.replay_file = task_configuration['replay_file']
+        self.replay_speed = task_configuration.get('replay_speed', 1.0)
+        self.replay_loop = task_configuration.get('replay_loop', False)
+        # Never log to output_file by default, it could be the very file being replayed
+        self.output_file = task_configuration.get('replay_output_file')
+        self.session_log = None
+        self._blocks = None
+
+    def create_task(self):
+        """
+        Opens the session log. Binary logs are memory-mapped, so this is quick regardless of the log size.
+        """
+        self.session_log = SessionLog(self.replay_file, sample_rate=self.sample_rate)
+        if not self._sample_dtype_configured and self.session_log.dtype.name in SAMPLE_DTYPES:
+            self.sample_dtype = self.session_log.dtype
+
+    def update_task(self, previous_configuration):
+        """
+        Reopens the (possibly different) log, so a live reconfiguration replays it again from the start.
+        """
+        self.create_task()
+        return True
+
+    def close_task(self):
+        self.session_log = None
+
+    def start_task(self):
+        self._blocks = self._iter_blocks()
+        self._start_time = perf_counter()
+        self._t_first = None
+
+    def stop_task(self):
+        self._blocks = None
+
+    def _iter_blocks(self):
+        """
+        Yields (samples, t0, dt) for every block of the log, shifting t0 on every loop so time keeps increasing.
+        """
+        offset = 0.0
+        while len(self.session_log):
+            t_end = 0.0
+            for block in self.session_log.blocks(self.samples_per_read):
+                yield block.samples, block.t0 + offset, block.dt
+                t_end = block.t_end + offset
+            if not self.replay_loop:
+                return
+            offset = t_end
+
+    def read(self):
+        """
+        Returns the next block of the log, waiting until it is due when replaying at a finite speed. A stop request
+        interrupts the wait.
+        """
+        try:
+            samples, t0, dt = next(self._blocks)
+        except StopIteration:
+            return None
+        if self._t_first is None:
+            self._t_first = t0
+        if self.replay_speed:
+            # Release the block when its last sample would have been acquired at replay_speed times real time
+            elapsed = t0 - self._t_first + samples.shape[0] * dt
+            delay = self._start_time + elapsed / self.replay_speed - perf_counter()
+            if delay > 0 and self.control.wait_for_stop(delay):
+                return None
+        # make_block derives dt from the sample rate, which may change between segments of the log
+        self.sample_rate = 1 / dt
+        # Nothing is buffered ahead of the replay
+        self.samples_acquired = self.samples_read + samples.shape[0]
+        return samples, round(t0 / dt)
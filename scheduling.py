@@ -0,0 +1,135 @@
+"""
+scheduling.py: CPU affinity and scheduling priority of the pipeline's processes and threads, and jitter measurement of
+their periodic work. Pinning the reader to cores the UI does not use, and raising its priority, keeps UI redraw spikes
+from delaying reads, which shows as read jitter and, at worst, DAQmx buffer overflows.
+
+The settings apply to the calling thread and to the threads it starts afterwards, so call apply_scheduling() at the
+start of a process (or of a thread running the reader) to cover everything it does. The data writer runs in the
+reader's acquisition loop, so it shares the reader's settings. Threads that are already running keep their settings:
+when a reconfiguration changes them, the UI queue sender and the stream threads started earlier in the acquisition
+keep the previous ones until the reader process is restarted. Only the standard library is imported.
+
+Affinity and priority are set through the Linux scheduler interface. Settings the platform or the user's permissions do
+not allow are logged as warnings and skipped, so the same configuration runs everywhere.
+"""
+
+import collections
+import logging
+import math
+import os
+from time import perf_counter
+
+log = logging.getLogger('scheduling')
+
+
+def apply_scheduling(cpu_affinity=None, nice=None, realtime_priority=None, name='process'):
+    """
+    Sets the CPU affinity and priority of the calling thread. None leaves a setting unchanged.
+
+    :param cpu_affinity: The cores to run on, e.g. [2, 3]
+    :param nice: The nice level, from -20 (highest priority) to 19 (lowest). Lowering it needs CAP_SYS_NICE
+                 (or a matching RLIMIT_NICE).
+    :param realtime_priority: The SCHED_FIFO real-time priority, from 1 to 99. Needs CAP_SYS_NICE (or RLIMIT_RTPRIO).
+                 A real-time thread that never blocks starves the rest of its cores, and the reader blocks while it
+                 waits for samples.
+    :param name: What is being configured, for the log messages
+    :return: True if every requested setting was applied
+    """
+    if nice is not None and not -20 <= nice <= 19:
+        raise ValueError('Invalid nice level {}. Valid options include -20 to 19'.format(nice))
+    if realtime_priority is not None and not 1 <= realtime_priority <= 99:
+        raise ValueError('Invalid real-time priority {}. Valid options include 1 to 99'.format(realtime_priority))
+    applied = True
+    if cpu_affinity is not None:
+        applied &= _apply(name, 'CPU affinity', 'sched_setaffinity', lambda: os.sched_setaffinity(0, cpu_affinity))
+    if nice is not None:
+        applied &= _apply(name, 'nice level', 'setpriority', lambda: os.setpriority(os.PRIO_PROCESS, 0, nice))
+    if realtime_priority is not None:
+        applied &= _apply(name, 'real-time priority', 'sched_setscheduler', lambda: os.sched_setscheduler(
+            0, os.SCHED_FIFO, os.sched_param(realtime_priority)))
+    return applied
+
+
+def _apply(name, setting, function, apply):
+    if not hasattr(os, function):
+        log.warning('Cannot set the %s of the %s: not supported on this platform', setting, name)
+        return False
+    try:
+        apply()
+    except PermissionError:
+        log.warning('Cannot set the %s of the %s: permission denied', setting, name)
+        return False
+    except OSError as e:
+        log.warning('Cannot set the %s of the %s: %s', setting, name, e)
+        return False
+    log.info('Set the %s of the %s', setting, name)
+    return True
+
+
+class JitterMonitor:
+    """
+    Measures how much the intervals between the iterations of a periodic loop (reads, display frames) deviate from
+    the nominal period. Positive deviations are late iterations; a loop catching up after a late one runs early.
+    """
+
+    def __init__(self, period, keep=4096):
+        """
+        :param period: The nominal interval in seconds
+        :param keep: Number of most recent deviations kept for the percentile
+        """
+        self.period = period
+        self._recent = collections.deque(maxlen=keep)
+        self.reset()
+
+    def reset(self, period=None):
+        """
+        Clears the measurements, e.g. at the start of an acquisition, optionally with a new nominal period.
+        """
+        if period is not None:
+            self.period = period
+        self.count = 0
+        self.max_late = 0.0
+        self._sum = 0.0
+        self._sum_squares = 0.0
+        self._last = None
+        self._recent.clear()
+
+    def tick(self, now=None):
+        """
+        Records an iteration at time now (default perf_counter()).
+        """
+        now = perf_counter() if now is None else now
+        if self._last is not None:
+            deviation = now - self._last - self.period
+            self.count += 1
+            self._sum += deviation
+            self._sum_squares += deviation * deviation
+            self.max_late = max(self.max_late, deviation)
+            self._recent.append(abs(deviation))
+        self._last = now
+
+    @property
+    def std(self):
+        """
+        Standard deviation of the intervals, in seconds.
+        """
+        if not self.count:
+            return math.nan
+        mean = self._sum / self.count
+        return math.sqrt(max(self._sum_squares / self.count - mean * mean, 0.0))
+
+    def percentile(self, q):
+        """
+        Returns the q-th percentile of the absolute deviation over the recent iterations, in seconds.
+        """
+        if not self._recent:
+            return math.nan
+        recent = sorted(self._recent)
+        return recent[min(int(len(recent) * q / 100), len(recent) - 1)]
+
+    def summary(self):
+        """
+        Returns a one line report in milliseconds.
+        """
+        return '{} intervals of {:.3f} ms: jitter std {:.3f} ms, p99 {:.3f} ms, up to {:.3f} ms late'.format(
+            self.count, self.period * 1e3, self.std * 1e3, self.percentile(99) * 1e3, self.max_late * 1e3)
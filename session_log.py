@@ -0,0 +1,147 @@
+"""
+session_log.py: Reads logs written by DataWriter. Binary logs are memory-mapped, so opening a session of any size is
+immediate and only the chunks that are actually used are read from disk. CSV logs are parsed in bulk.
+
+The time axis is rebuilt from the block markers DataWriter records at every discontinuity: each segment is a run of
+contiguous samples starting at a known sample index with a known t0 and dt.
+"""
+
+import bisect
+import json
+import os
+import re
+
+import numpy as np
+
+from waveform import WaveformBlock
+
+BLOCK_MARKER = re.compile(r'Block (\d+) t0=(\S+) dt=(\S+)')
+
+
+class Segment:
+    """
+    A run of contiguous samples in a session log.
+    """
+
+    __slots__ = ('start', 'stop', 't0', 'dt')
+
+    def __init__(self, start, stop, t0, dt):
+        self.start = start
+        self.stop = stop
+        self.t0 = t0
+        self.dt = dt
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __repr__(self):
+        return 'Segment(start={}, stop={}, t0={}, dt={})'.format(self.start, self.stop, self.t0, self.dt)
+
+
+class SessionLog:
+    """
+    A session log opened for reading.
+    """
+
+    def __init__(self, filename, sample_rate=None, csv_chunk_lines=1000000):
+        """
+        Opens a log written by DataWriter. The format is detected from the presence of the '.meta' sidecar.
+
+        :param filename: The data file
+        :param sample_rate: Sample rate to assume for logs without block markers (e.g. logs from older versions)
+        :param csv_chunk_lines: Number of CSV lines converted to numbers at once
+        """
+        self.filename = filename
+        self.markers = []
+        starts = []
+        default_dt = 1 / sample_rate if sample_rate else None
+        if os.path.exists(filename + '.meta'):
+            self.file_format = 'binary'
+            dtype = np.float64
+            with open(filename + '.meta') as f:
+                for line in f:
+                    record = json.loads(line)
+                    if 'dtype' in record:
+                        dtype = np.dtype(record['dtype'])
+                    elif 'marker' in record:
+                        self.markers.append((record['sample'], record['marker']))
+                    else:
+                        starts.append((record['sample'], record['t0'], record['dt']))
+            if os.path.getsize(filename):
+                self.samples = np.memmap(filename, dtype=dtype, mode='r')
+            else:
+                self.samples = np.empty(shape=(0,), dtype=dtype)
+        else:
+            self.file_format = 'csv'
+            self.samples = self._read_csv(starts, csv_chunk_lines)
+        if not starts or starts[0][0] > 0:
+            starts.insert(0, (0, 0.0, default_dt))
+        self.segments = [Segment(start, stop, t0, dt) for (start, t0, dt), (stop, _, _) in
+                         zip(starts, starts[1:] + [(self.samples.shape[0], None, None)])]
+
+    def _read_csv(self, starts, chunk_lines):
+        chunks = []
+        lines = []
+        count = 0
+        with open(self.filename) as f:
+            for line in f:
+                if line.startswith('#'):
+                    text = line[1:].strip()
+                    match = BLOCK_MARKER.fullmatch(text)
+                    if match:
+                        starts.append((count + len(lines), float(match.group(2)), float(match.group(3))))
+                    elif text != 'Voltage (V)':
+                        self.markers.append((count + len(lines), text))
+                    continue
+                lines.append(line.rstrip())
+                if len(lines) == chunk_lines:
+                    chunks.append(np.array(lines, dtype=np.float64))
+                    count += len(lines)
+                    lines = []
+        chunks.append(np.array(lines, dtype=np.float64))
+        return np.concatenate(chunks)
+
+    def __len__(self):
+        return self.samples.shape[0]
+
+    @property
+    def dtype(self):
+        return self.samples.dtype
+
+    @property
+    def duration(self):
+        """
+        Total acquired time covered by the log in seconds, not counting gaps between segments.
+        """
+        return sum(len(segment) * segment.dt for segment in self.segments if segment.dt)
+
+    def time_at(self, sample):
+        """
+        Returns the acquisition time in seconds of a sample number.
+        """
+        starts = [segment.start for segment in self.segments]
+        segment = self.segments[max(bisect.bisect_right(starts, sample) - 1, 0)]
+        if segment.dt is None:
+            raise ValueError('The log has no block markers, so a sample_rate must be given')
+        return segment.t0 + (sample - segment.start) * segment.dt
+
+    def blocks(self, block_size, start=0, stop=None):
+        """
+        Yields the samples in [start, stop) as WaveformBlocks of at most block_size samples. Blocks never span two
+        segments, so their t0 is always exact. For binary logs the samples are views of the memory-mapped file.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        seq = 0
+        for segment in self.segments:
+            if segment.stop <= start or segment.start >= stop:
+                continue
+            if segment.dt is None:
+                raise ValueError('The log has no block markers, so a sample_rate must be given')
+            position = max(segment.start, start)
+            end = min(segment.stop, stop)
+            while position < end:
+                n = min(block_size, end - position)
+                t0 = segment.t0 + (position - segment.start) * segment.dt
+                yield WaveformBlock(seq, t0, segment.dt, self.samples[position:position + n], first_sample=position)
+                seq += 1
+                position += n
@@ -0,0 +1,116 @@
+"""
+simulated.py: Simulated signal source for load testing. SimulatedReader is a drop-in replacement for
+AnalogInputReader, like ReplayReader: it speaks the same ControlChannel protocol and sends its blocks through the same
+UI queue, stream subscribers, trigger and data writer, but the samples come from a simulated device clocked by the wall
+clock instead of a DAQmx task.
+
+Like the DAQmx driver, the simulated device keeps acquiring whether or not the reader keeps up. The acquired samples
+wait in a buffer of the DAQmx default size for the sample rate, and a read that finds the buffer overflowed fails with
+the same error the driver reports (-200279). The reader processes use it when the task configuration holds a 'simulate'
+entry, for example:
+
+    {'simulate': {'frequency': 50.0, 'amplitude': 1.0, 'noise': 0.1}, 'sample_rate': 100000, 'samples_per_read': 10000,
+     ...}
+"""
+
+from time import perf_counter
+
+import numpy as np
+
+from daqmx_reader import MAX_STOP_LATENCY, AnalogInputReader
+
+
+class BufferOverflowError(Exception):
+    """
+    The simulated device acquired more samples than its buffer holds before they were read.
+    """
+
+
+def default_buffer_samples(sample_rate):
+    """
+    Returns the size of the buffer DAQmx allocates for a continuous acquisition at sample_rate.
+    """
+    if sample_rate <= 100:
+        return 1000
+    if sample_rate <= 10000:
+        return 10000
+    if sample_rate <= 1000000:
+        return 100000
+    return 1000000
+
+
+class SimulatedReader(AnalogInputReader):
+    """
+    AnalogInputReader whose samples come from a simulated device: a sine wave plus optional Gaussian noise.
+    """
+
+    def configure(self, task_configuration):
+        """
+        Stores a new configuration. Besides the usual keys, 'simulate' holds a dict of:
+
+            'frequency' - frequency of the sine wave in Hz (default 50)
+            'amplitude' - amplitude of the sine wave in volts (default 1)
+            'noise' - standard deviation of the added noise in volts (default 0)
+            'buffer_samples' - size of the device buffer (default: the DAQmx default for the sample rate)
+            'seed' - seed of the noise generator (default 0)
+        """
+        super().configure(task_configuration)
+        simulation = task_configuration['simulate']
+        if not isinstance(simulation, dict):
+            simulation = {}
+        self.frequency = simulation.get('frequency', 50.0)
+        self.amplitude = simulation.get('amplitude', 1.0)
+        self.noise = simulation.get('noise', 0.0)
+        self.buffer_samples = simulation.get('buffer_samples') or default_buffer_samples(self.sample_rate)
+        self._rng = np.random.default_rng(simulation.get('seed', 0))
+        self._start_time = None
+
+    def create_task(self):
+        pass
+
+    def update_task(self, previous_configuration):
+        return True
+
+    def close_task(self):
+        pass
+
+    def start_task(self):
+        self._start_time = perf_counter()
+
+    def stop_task(self):
+        self._start_time = None
+
+    def acquired(self):
+        """
+        Returns the number of samples the simulated device has acquired, counted from the start of the acquisition.
+        """
+        return self.sample_offset + int((perf_counter() - self._start_time) * self.sample_rate)
+
+    def read(self):
+        """
+        Waits until the device has acquired the next samples_per_read samples and returns them. A stop request
+        interrupts the wait.
+
+        :raises BufferOverflowError: if the reader fell behind the device by more than the buffer size
+        """
+        needed = self.samples_read + self.samples_per_read
+        while True:
+            acquired = self.acquired()
+            if acquired - self.samples_read > self.buffer_samples:
+                raise BufferOverflowError(
+                    'DAQmx error -200279: The application is not able to keep up with the hardware acquisition. '
+                    '{} samples were acquired, {} read, with a buffer of {} samples'.format(
+                        acquired, self.samples_read, self.buffer_samples))
+            missing = needed - acquired
+            if missing <= 0:
+                break
+            if self.control.wait_for_stop(min(missing / self.sample_rate, MAX_STOP_LATENCY)):
+                return None
+        first_sample = self.samples_read - self.sample_offset
+        phase = 2 * np.pi * self.frequency / self.sample_rate
+        np.sin(np.arange(first_sample, first_sample + self.samples_per_read) * phase, out=self.input_data)
+        self.input_data *= self.amplitude
+        if self.noise:
+            self.input_data += self._rng.normal(0.0, self.noise, size=self.samples_per_read)
+        self.samples_acquired = acquired
+        return self.input_data, first_sample
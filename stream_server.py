@@ -0,0 +1,329 @@
+"""
+stream_server.py: Fans out acquired blocks to any number of local subscribers (analysis scripts, a second viewer, a
+recorder, ...) over a TCP or Unix-domain socket.
+
+Every block is sent as one binary frame: a fixed size header followed by the raw samples.
+
+    magic (4 bytes, b'DAQC') | sequence number (uint64) | first sample number (int64) | samples acquired (int64) |
+    source samples (uint32) | t0 in seconds (float64) | dt in seconds (float64) | numpy dtype string (4 bytes,
+    e.g. b'<f8') | number of samples (uint32) | samples
+
+All header fields are little-endian. The sample accounting fields are those of WaveformBlock, with -1 for unknown.
+
+Each subscriber has its own BlockBuffer (see block_buffer.py) with a memory budget, served by its own sender thread, so
+publish() never waits for a subscriber. When a slow subscriber's buffer is full, the slow client policy applies: one of
+the block_buffer.py overflow policies that drop data ('drop-oldest' by default, 'drop-newest' or 'decimate'), or
+'disconnect' to disconnect it. Dropped samples are counted per subscriber.
+
+Addresses are given as 'tcp://host:port' or 'unix:///path/to/socket'. To watch a running stream, use:
+
+    python stream_server.py tcp://127.0.0.1:5555
+"""
+
+import logging
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from block_buffer import OVERFLOW_POLICIES, BlockBuffer
+from waveform import ContinuityChecker, WaveformBlock
+
+log = logging.getLogger('stream_server')
+
+MAGIC = b'DAQC'
+HEADER = struct.Struct('<4sQqqIdd4sI')
+# The 'block' overflow policy is not offered: a subscriber must never slow the acquisition down
+SLOW_CLIENT_POLICIES = tuple(policy for policy in OVERFLOW_POLICIES if policy != 'block') + ('disconnect',)
+
+
+def parse_address(address):
+    """
+    Converts a 'tcp://host:port' or 'unix:///path' address into a (socket family, socket address) tuple.
+    """
+    if address.startswith('unix://'):
+        return socket.AF_UNIX, address[len('unix://'):]
+    if address.startswith('tcp://'):
+        host, _, port = address[len('tcp://'):].rpartition(':')
+        return socket.AF_INET, (host, int(port))
+    raise ValueError('Invalid stream address ' + address + ". Use 'tcp://host:port' or 'unix:///path'")
+
+
+def encode_block(block):
+    """
+    Returns the frame for one WaveformBlock.
+    """
+    samples = np.ascontiguousarray(block.samples)
+    header = HEADER.pack(MAGIC, block.seq, -1 if block.first_sample is None else block.first_sample,
+                         -1 if block.acquired is None else block.acquired, block.source_samples, block.t0, block.dt,
+                         samples.dtype.str.encode('ascii'), samples.shape[0])
+    return header + samples.tobytes()
+
+
+def _receive_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            return None
+        received += n
+    return buffer
+
+
+def read_block(sock):
+    """
+    Reads one frame from a socket.
+
+    :return: A WaveformBlock, or None when the server closed the connection
+    """
+    header = _receive_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    magic, seq, first_sample, acquired, source_samples, t0, dt, dtype, count = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError('Invalid frame received, the stream is out of sync')
+    # struct pads the dtype field with NUL bytes
+    dtype = np.dtype(dtype.rstrip(b'\x00').decode('ascii'))
+    payload = _receive_exactly(sock, count * dtype.itemsize)
+    if payload is None:
+        return None
+    return WaveformBlock(seq, t0, dt, np.frombuffer(payload, dtype=dtype), None if first_sample < 0 else first_sample,
+                         None if acquired < 0 else acquired, source_samples)
+
+
+class _Subscriber:
+    """
+    A connected client with its own bounded block buffer and sender thread.
+    """
+
+    def __init__(self, sock, name, max_buffered_bytes, policy):
+        self.sock = sock
+        self.name = name
+        self.disconnect_when_full = policy == 'disconnect'
+        # Disconnecting needs to know the buffer is full, which the 'drop-newest' policy reports
+        self.blocks = BlockBuffer(max_buffered_bytes, 'drop-newest' if self.disconnect_when_full else policy)
+        self.closed = False
+        self._thread = threading.Thread(target=self._send_loop, name='stream-' + name, daemon=True)
+        self._thread.start()
+
+    def offer(self, block):
+        """
+        Queues a block for sending, without waiting. Returns False if the subscriber is too slow and must be
+        disconnected.
+        """
+        if self.closed:
+            return False
+        return self.blocks.put(block) or not self.disconnect_when_full
+
+    def _send_loop(self):
+        while not self.closed:
+            try:
+                block = self.blocks.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self.sock.sendall(encode_block(block))
+            except OSError:
+                break
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.blocks.clear()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class BlockServer:
+    """
+    Publishes blocks to every connected subscriber.
+    """
+
+    def __init__(self, address, max_buffered_bytes=16 * 2 ** 20, slow_client_policy='drop-oldest'):
+        """
+        Creates a new BlockServer. Call start() to begin accepting subscribers.
+
+        :param address: 'tcp://host:port' or 'unix:///path' to listen on
+        :param max_buffered_bytes: Memory budget of each subscriber's block buffer, in bytes of samples
+        :param slow_client_policy: One of SLOW_CLIENT_POLICIES. 'drop' is accepted as the former name of 'drop-oldest'.
+        """
+        if slow_client_policy == 'drop':
+            slow_client_policy = 'drop-oldest'
+        if slow_client_policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError('Invalid slow client policy. Valid options include ' + ', '.join(SLOW_CLIENT_POLICIES))
+        self.family, self.address = parse_address(address)
+        self.max_buffered_bytes = max_buffered_bytes
+        self.slow_client_policy = slow_client_policy
+        self.subscribers = []
+        self.disconnected = 0
+        # Samples dropped for subscribers that have since disconnected
+        self._dropped_samples = 0
+        self._dropped_blocks = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._sock = None
+        self._accept_thread = None
+
+    def start(self):
+        """
+        Opens the listening socket and starts accepting subscribers in a background thread.
+        """
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            # Remove a socket file left behind by a previous run
+            os.unlink(self.address)
+        self._sock = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(self.address)
+        self._sock.listen()
+        # Wake up periodically so close() does not depend on accept() being interrupted
+        self._sock.settimeout(0.5)
+        self._accept_thread = threading.Thread(target=self._accept_loop, name='stream-accept', daemon=True)
+        self._accept_thread.start()
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                conn, peer = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            conn.settimeout(None)
+            if self.family == socket.AF_INET:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = _Subscriber(conn, str(peer) or 'unix', self.max_buffered_bytes, self.slow_client_policy)
+            with self._lock:
+                self.subscribers.append(subscriber)
+            log.info('Subscriber %s connected', subscriber.name)
+
+    def publish(self, block):
+        """
+        Queues one WaveformBlock for every subscriber. Never waits: a subscriber whose buffer is full gets its slow
+        client policy applied.
+        """
+        # Offered outside the lock, so accepting subscribers and reading the counters never wait for the offers
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            if not subscriber.offer(block):
+                log.info('Disconnecting subscriber %s', subscriber.name)
+                self._remove(subscriber, disconnected=True)
+            elif subscriber.closed:
+                # The subscriber went away on its own
+                self._remove(subscriber)
+
+    def _remove(self, subscriber, disconnected=False):
+        subscriber.close()
+        with self._lock:
+            # close() may have removed it meanwhile
+            if subscriber not in self.subscribers:
+                return
+            self.subscribers.remove(subscriber)
+            self._dropped_samples += subscriber.blocks.dropped_samples
+            self._dropped_blocks += subscriber.blocks.dropped_blocks
+            if disconnected:
+                self.disconnected += 1
+
+    @property
+    def dropped_samples(self):
+        """
+        Total number of samples dropped (or removed by decimation) for slow subscribers.
+        """
+        with self._lock:
+            return self._dropped_samples + sum(subscriber.blocks.dropped_samples for subscriber in self.subscribers)
+
+    @property
+    def dropped_blocks(self):
+        """
+        Total number of blocks dropped for slow subscribers.
+        """
+        with self._lock:
+            return self._dropped_blocks + sum(subscriber.blocks.dropped_blocks for subscriber in self.subscribers)
+
+    def close(self):
+        """
+        Disconnects every subscriber and stops listening.
+        """
+        self._closed.set()
+        if self._accept_thread is not None:
+            self._accept_thread.join()
+        if self._sock is not None:
+            self._sock.close()
+            if self.family == socket.AF_UNIX and os.path.exists(self.address):
+                os.unlink(self.address)
+        with self._lock:
+            for subscriber in self.subscribers:
+                subscriber.close()
+            self.subscribers = []
+
+
+class BlockSubscriber:
+    """
+    Client side of a BlockServer. Iterating over it yields WaveformBlocks until the server closes.
+    """
+
+    def __init__(self, address):
+        family, address = parse_address(address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        self._sock.connect(address)
+
+    def receive(self):
+        """
+        Waits for the next block. Returns None once the server has closed the connection.
+        """
+        return read_block(self._sock)
+
+    def __iter__(self):
+        while True:
+            block = self.receive()
+            if block is None:
+                return
+            yield block
+
+    def close(self):
+        self._sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 1:
+        print('Usage: python stream_server.py <tcp://host:port | unix:///path>')
+        return 2
+    # Subscribers may connect in the middle of an acquisition
+    checker = ContinuityChecker(join_late=True)
+    with BlockSubscriber(argv[0]) as subscriber:
+        for block in subscriber:
+            if block.seq == 0 and checker.blocks:
+                print('New acquisition. Previous one: ' + checker.summary())
+                checker.reset()
+            lost_blocks, lost_samples = checker.lost_blocks, checker.lost_samples
+            checker.check(block)
+            if checker.lost_blocks > lost_blocks or checker.lost_samples > lost_samples:
+                print('LOST {} blocks'.format(checker.lost_blocks - lost_blocks) +
+                      (', samples {}-{}'.format(*checker.gaps[-1]) if checker.lost_samples > lost_samples else ''))
+            print('block {} t0={:.6f}s dt={:g}s n={} min={:.4f} max={:.4f}'.format(
+                block.seq, block.t0, block.dt, len(block), block.samples.min(), block.samples.max()))
+    print(checker.summary())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
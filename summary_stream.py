@@ -0,0 +1,220 @@
+"""
+summary_stream.py: Decimated summary streams of session logs. Next to a full-rate log, DataWriter can write one or more
+'<filename>.<decimation>.sum' files holding the minimum, maximum and mean of every run of <decimation> samples, e.g. at
+1 kHz for a 1 MS/s capture. They are written incrementally from each block, so an overview of a day-long run is
+available as soon as it ends, and reading it touches megabytes instead of the gigabytes of the full-rate log.
+
+Each record also holds the time of its first sample, so a summary stream is read without opening the log itself (which
+for CSV logs would mean parsing all of it). Records never span a discontinuity of the log, so their times are exact.
+
+Usage:
+
+    python summary_stream.py Output_Data.bin
+    python summary_stream.py Output_Data.bin --decimation 1000 --plot overview.png
+    python summary_stream.py Output_Data.bin --build 1000 100000
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+
+import numpy as np
+
+from log_index import summarize
+from session_log import SessionLog
+
+SUMMARY_DTYPE = np.dtype([('start', '<i8'), ('stop', '<i8'), ('t0', '<f8'), ('min', '<f8'), ('max', '<f8'),
+                          ('mean', '<f8')])
+
+
+def summary_filename(filename, decimation):
+    return '{}.{}.sum'.format(filename, decimation)
+
+
+def summary_decimations(filename):
+    """
+    Returns the decimations of the summary streams written for a log, finest first.
+    """
+    pattern = re.compile(re.escape(filename) + r'\.(\d+)\.sum')
+    decimations = []
+    for path in glob.glob(glob.escape(filename) + '.*.sum'):
+        match = pattern.fullmatch(path)
+        if match:
+            decimations.append(int(match.group(1)))
+    return sorted(decimations)
+
+
+def remove_summaries(filename, keep=()):
+    """
+    Removes the summary streams of a log except those with a decimation in keep, as they would not match new data
+    written under the same name.
+    """
+    for decimation in summary_decimations(filename):
+        if decimation not in keep:
+            os.remove(summary_filename(filename, decimation))
+
+
+class SummaryWriter:
+    """
+    Appends the summary of every completed run of decimation samples to a summary stream. Used by DataWriter.
+    """
+
+    def __init__(self, filename, decimation):
+        """
+        :param filename: The summary stream, see summary_filename()
+        :param decimation: Samples per record
+        """
+        if decimation < 1:
+            raise ValueError('Invalid decimation {}. Valid options include integers >= 1'.format(decimation))
+        self.decimation = int(decimation)
+        self._file = open(filename, 'wb')
+        # Samples of the record being filled, the time of the first one and the time just after the last one
+        self._pending = []
+        self._pending_count = 0
+        self._start = 0
+        self._t0 = None
+        self._t_end = None
+        self._dt = None
+
+    def add(self, samples, t0, dt):
+        """
+        Adds the next samples of the log, starting at time t0 with sample period dt. A partial record is completed
+        early where the samples do not directly follow the previous ones.
+        """
+        n = samples.shape[0]
+        if self._pending_count and (dt != self._dt or abs(t0 - self._t_end) > dt / 2):
+            self._write(np.concatenate(self._pending))
+        if not self._pending_count:
+            self._t0 = t0
+        self._dt = dt
+        self._t_end = t0 + n * dt
+        # Copied, as the caller may reuse its buffer
+        self._pending.append(np.array(samples))
+        self._pending_count += n
+        if self._pending_count >= self.decimation:
+            samples = np.concatenate(self._pending)
+            complete = samples.shape[0] - samples.shape[0] % self.decimation
+            self._write(samples[:complete])
+            if complete < samples.shape[0]:
+                self._pending = [samples[complete:]]
+                self._pending_count = samples.shape[0] - complete
+
+    def _write(self, samples):
+        index = summarize(samples, self._start, self.decimation)
+        records = np.empty(shape=index.shape, dtype=SUMMARY_DTYPE)
+        for field in index.dtype.names:
+            records[field] = index[field]
+        records['t0'] = self._t0 + (records['start'] - self._start) * self._dt
+        self._file.write(records.tobytes())
+        self._start += samples.shape[0]
+        self._t0 += samples.shape[0] * self._dt
+        self._pending = []
+        self._pending_count = 0
+
+    def close(self):
+        """
+        Writes the last, partial record and closes the stream.
+        """
+        if self._pending_count:
+            self._write(np.concatenate(self._pending))
+        self._file.close()
+
+
+def build_summary(session_log, decimation, block_records=1024):
+    """
+    Writes a summary stream of a log that was written without it.
+
+    :param session_log: The SessionLog to summarize
+    :param decimation: Samples per record
+    :param block_records: Number of records summarized at once
+    """
+    writer = SummaryWriter(summary_filename(session_log.filename, decimation), decimation)
+    try:
+        for block in session_log.blocks(decimation * block_records):
+            writer.add(block.samples, block.t0, block.dt)
+    finally:
+        writer.close()
+
+
+class SummaryStream:
+    """
+    A summary stream opened for reading.
+    """
+
+    def __init__(self, filename, decimation=None):
+        """
+        Loads a summary stream of a log. A record cut short by a crash is ignored.
+
+        :param filename: The log (which need not be opened)
+        :param decimation: The decimation of the stream, or None for the coarsest one written
+        :raises FileNotFoundError: if the log has no such summary stream
+        """
+        if decimation is None:
+            decimations = summary_decimations(filename)
+            if not decimations:
+                raise FileNotFoundError('No summary stream found for ' + filename)
+            decimation = decimations[-1]
+        self.filename = filename
+        self.decimation = decimation
+        with open(summary_filename(filename, decimation), 'rb') as f:
+            data = f.read()
+        self.records = np.frombuffer(data[:len(data) - len(data) % SUMMARY_DTYPE.itemsize], dtype=SUMMARY_DTYPE)
+
+    def __len__(self):
+        return self.records.shape[0]
+
+    def between(self, t_start, t_end):
+        """
+        Returns the records whose first sample lies in [t_start, t_end).
+        """
+        start, stop = np.searchsorted(self.records['t0'], [t_start, t_end])
+        return self.records[start:stop]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the overview of a session log from its summary stream.')
+    parser.add_argument('log', help='Session log written by DataWriter')
+    parser.add_argument('--decimation', type=int, help='Summary stream to read (default: the coarsest)')
+    parser.add_argument('--plot', help='Save a min/max/mean overview plot to this image file')
+    parser.add_argument('--build', type=int, nargs='+', metavar='DECIMATION',
+                        help='(Re)build summary streams with these decimations from the full-rate log instead')
+    parser.add_argument('--sample-rate', type=float, help='Sample rate for logs without block markers (--build)')
+    args = parser.parse_args(argv)
+
+    if args.build:
+        session_log = SessionLog(args.log, sample_rate=args.sample_rate)
+        for decimation in args.build:
+            build_summary(session_log, decimation)
+            print('{}: wrote {}'.format(args.log, summary_filename(args.log, decimation)))
+        return 0
+
+    stream = SummaryStream(args.log, args.decimation)
+    records = stream.records
+    if not len(stream):
+        print('{}: the summary stream is empty'.format(args.log))
+        return 0
+    samples = int(records['stop'][-1])
+    print('{}: {} records of {} samples, {} samples from t={:.6f}s to t={:.6f}s'.format(
+        args.log, len(stream), stream.decimation, samples, records['t0'][0], records['t0'][-1]))
+    print('  min={:.6g} max={:.6g} mean={:.6g}'.format(
+        np.nanmin(records['min']), np.nanmax(records['max']),
+        np.sum(records['mean'] * (records['stop'] - records['start'])) / samples))
+    if args.plot:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(12, 4))
+        ax.fill_between(records['t0'], records['min'], records['max'], step='post', alpha=0.4, label='min/max')
+        ax.step(records['t0'], records['mean'], where='post', linewidth=0.8, label='mean')
+        ax.set_xlabel('Time (s)')
+        ax.set_ylabel('Voltage (V)')
+        ax.legend(loc='upper right')
+        fig.savefig(args.plot, dpi=100, bbox_inches='tight')
+        print('  saved ' + args.plot)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
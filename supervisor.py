@@ -0,0 +1,247 @@
+"""
+supervisor.py: Runs one AnalogInputReader per device (or task) in parallel, each in its own process so the readers
+spread across CPU cores. The supervisor monitors the health and exception pipe of every reader, restarts readers that
+fail, writes a separate log file per device and merges the acquired data into an aggregated live view.
+
+Usage:
+
+    python supervisor.py --config devices.json
+
+where devices.json holds a list of task configurations (same keys as daqmx_headless.py), one per reader, e.g.
+
+    [{"dev_name": "PXI1Slot2", "sample_rate": 1000, "samples_per_read": 100, "cpu_affinity": [2]},
+     {"dev_name": "PXI1Slot3", "sample_rate": 1000, "samples_per_read": 100, "cpu_affinity": [3]}]
+
+Pinning each reader to its own core (and the supervisor elsewhere, e.g. with taskset) keeps the readers from delaying
+each other's reads.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+from time import monotonic
+
+from block_buffer import BlockQueue
+from file_writer import FILE_EXTENSIONS
+from reader_entry import GLOBAL_ACK, END_OF_DATA, ControlChannel, Process, run_reader
+from trigger import RingBuffer
+from waveform import ContinuityChecker
+
+log = logging.getLogger('supervisor')
+
+
+def reader_name(task_configuration):
+    """
+    Returns the name identifying a reader, e.g. PXI1Slot2/ai0.
+    """
+    return task_configuration['dev_name'] + '/ai' + str(task_configuration['channel'])
+
+
+class SupervisedReader:
+    """
+    Book-keeping for one reader process managed by the ReaderSupervisor.
+    """
+
+    def __init__(self, name, task_configuration):
+        self.name = name
+        self.task_configuration = task_configuration
+        self.process = None
+        self.ui_queue = None
+        self.control = None
+        self.restarts = 0
+        self.restart_at = None
+        self.samples_received = 0
+        self.last_error = None
+        self.continuity = None
+
+    def output_file(self):
+        """
+        Per-device log file. Each restart writes to a new file so data acquired before a failure is kept.
+        """
+        base, extension = os.path.splitext(self.task_configuration['output_file'])
+        if self.restarts:
+            return base + '_' + str(self.restarts) + extension
+        return base + extension
+
+
+class ReaderSupervisor:
+    """
+    Launches, monitors and restarts a set of reader processes and merges their outputs.
+    """
+
+    def __init__(self, task_configurations, max_restarts=3, restart_delay=1.0, view_length=1000,
+                 view_buffer_bytes=16 * 2 ** 20):
+        """
+        Creates a new ReaderSupervisor.
+
+        :param task_configurations: A list of task configurations, one per reader. Configurations without an
+                    'output_file' get one named after their device and channel, with the extension of their
+                    'file_format'.
+        :param max_restarts: How many times a failed reader is restarted before it is given up on
+        :param restart_delay: Seconds to wait before restarting a failed reader
+        :param view_length: Number of most recent samples per reader kept in the live view
+        :param view_buffer_bytes: Memory budget of each reader's queue to the live view. When the supervisor falls
+                    behind, the oldest blocks are dropped (the per-device log files are unaffected).
+        """
+        self.max_restarts = max_restarts
+        self.view_buffer_bytes = view_buffer_bytes
+        self.restart_delay = restart_delay
+        self.readers = collections.OrderedDict()
+        for task_configuration in task_configurations:
+            name = reader_name(task_configuration)
+            if name in self.readers:
+                raise ValueError('Duplicate reader ' + name)
+            task_configuration = dict(task_configuration)
+            extension = FILE_EXTENSIONS.get(task_configuration.get('file_format', 'csv'), '.csv')
+            task_configuration.setdefault('output_file', 'Output_Data_' + name.replace('/', '_') + extension)
+            self.readers[name] = SupervisedReader(name, task_configuration)
+        # Ring buffers take each block with one copy of its newest samples, however long the block is
+        self._view = {name: RingBuffer(view_length, dtype=reader.task_configuration.get('sample_dtype', 'float64'))
+                      for name, reader in self.readers.items()}
+
+    def _launch(self, reader):
+        reader.ui_queue = BlockQueue(self.view_buffer_bytes, 'drop-oldest')
+        # Sequence numbers start over in the new process
+        reader.continuity = ContinuityChecker(contiguous=not reader.task_configuration.get('trigger'))
+        reader.control = ControlChannel()
+        task_configuration = dict(reader.task_configuration, output_file=reader.output_file())
+        reader.process = Process(target=run_reader, args=(task_configuration, reader.ui_queue, reader.control),
+                                 name='reader-' + reader.name)
+        reader.process.start()
+        reader.restart_at = None
+        log.info('Started reader %s (pid %d), logging to %s', reader.name, reader.process.pid,
+                 task_configuration['output_file'])
+
+    def start(self):
+        """
+        Starts every reader.
+        """
+        for reader in self.readers.values():
+            self._launch(reader)
+
+    def _drain(self, reader):
+        """
+        Moves everything queued by a reader into the live view.
+        """
+        view = self._view[reader.name]
+        while True:
+            try:
+                block = reader.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            if block is END_OF_DATA:
+                break
+            if not reader.continuity.check(block):
+                continue
+            view.extend(block.samples)
+            reader.samples_received += len(block)
+
+    def poll(self):
+        """
+        Collects new data from every reader and checks their health, restarting failed readers once their restart
+        delay has passed. Call this periodically.
+        """
+        now = monotonic()
+        for reader in self.readers.values():
+            if reader.process is None:
+                continue
+            self._drain(reader)
+            if reader.process.is_alive() and not reader.process.exception:
+                continue
+            if reader.restart_at is None:
+                # The reader died (or is about to); record why and schedule a restart
+                reader.last_error = reader.process.exception
+                # The process cannot exit while blocks it queued are unread
+                reader.ui_queue.discard(reader.process)
+                reader.process.join()
+                log.error('Reader %s failed: %s', reader.name, reader.last_error)
+                if reader.restarts >= self.max_restarts:
+                    log.error('Reader %s exceeded %d restarts, giving up', reader.name, self.max_restarts)
+                    reader.process = None
+                    continue
+                reader.restart_at = now + self.restart_delay
+            elif now >= reader.restart_at:
+                reader.restarts += 1
+                self._launch(reader)
+
+    def live_view(self):
+        """
+        Returns the most recent samples of every reader as a dict of reader name to numpy array of samples.
+        """
+        return {name: view.get() for name, view in self._view.items()}
+
+    def running(self):
+        """
+        Returns the names of the readers that are currently running or waiting to be restarted.
+        """
+        return [reader.name for reader in self.readers.values() if reader.process is not None]
+
+    def stop(self):
+        """
+        Stops every reader, waiting for each one to close its task and log file.
+        """
+        for reader in self.readers.values():
+            if reader.process is not None and reader.process.is_alive():
+                reader.control.stop()
+        for reader in self.readers.values():
+            if reader.process is None:
+                continue
+            if reader.process.is_alive():
+                reader.control.wait_for_ack(GLOBAL_ACK, reader.process)
+            # Discard what is left in the UI queue in bulk, so the join cannot block on queued data
+            reader.ui_queue.discard(reader.process)
+            reader.process.join()
+            reader.process = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run one DAQmx reader per device in parallel processes.')
+    parser.add_argument('--config', required=True, help='JSON file holding a list of task configurations')
+    parser.add_argument('--stats-interval', type=float, default=5.0,
+                        help='Seconds between throughput log messages (default 5)')
+    parser.add_argument('--max-restarts', type=int, default=3, help='Restarts allowed per reader (default 3)')
+    parser.add_argument('--log-level', default='INFO', help='Logging level (default INFO)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(message)s')
+
+    from daqmx_headless import DEFAULT_TASK_CONFIGURATION
+    # Readers get per-device log files unless their configuration names one
+    defaults = dict(DEFAULT_TASK_CONFIGURATION)
+    del defaults['output_file']
+    with open(args.config) as f:
+        task_configurations = [dict(defaults, **task_configuration) for task_configuration in json.load(f)]
+
+    supervisor = ReaderSupervisor(task_configurations, max_restarts=args.max_restarts)
+    shutdown = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: shutdown.set())
+    signal.signal(signal.SIGTERM, lambda *_: shutdown.set())
+
+    supervisor.start()
+    last_stats = monotonic()
+    last_counts = {name: 0 for name in supervisor.readers}
+    while not shutdown.wait(0.05) and supervisor.running():
+        supervisor.poll()
+        now = monotonic()
+        if now - last_stats >= args.stats_interval:
+            total = 0.0
+            for name, reader in supervisor.readers.items():
+                rate = (reader.samples_received - last_counts[name]) / (now - last_stats)
+                last_counts[name] = reader.samples_received
+                total += rate
+                log.info('%s: %.1f S/s, %d restarts', name, rate, reader.restarts)
+                if reader.continuity is not None and not reader.continuity.ok:
+                    log.warning('%s live view: %s', name, reader.continuity.summary())
+            log.info('Total: %.1f S/s', total)
+            last_stats = now
+    supervisor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
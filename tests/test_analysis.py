@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from analysis import RunningStats, Spectrum, TriggerEvents, analyze
+from file_writer import DataWriter
+from trigger import LevelTrigger
+from waveform import WaveformBlock
+
+TRIGGER = {'mode': 'rising', 'level': 0.5, 'hysteresis': 0.2, 'holdoff': 50, 'post_samples': 120}
+
+
+def signal(n=20000, seed=0):
+    rng = np.random.default_rng(seed)
+    return 3.0 + np.sin(np.arange(n) * 2 * np.pi * 50 / 1000) + rng.normal(0.0, 0.1, n)
+
+
+def merged(kernel_class, samples, bounds, **kwargs):
+    """
+    Runs a fresh kernel over every chunk between bounds and merges the partial results in order, like analyze().
+    """
+    result = kernel_class(**kwargs)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        kernel = kernel_class(**kwargs)
+        kernel.update(samples[start:stop])
+        result.merge(kernel)
+    return result
+
+
+def test_merged_running_stats_match_numpy():
+    samples = signal()
+    stats = merged(RunningStats, samples, [0, 1, 1, 777, 5000, 5001, 13000, 20000])
+    assert stats.count == samples.shape[0]
+    assert stats.mean == pytest.approx(np.mean(samples), rel=1e-12)
+    assert stats.std == pytest.approx(np.std(samples), rel=1e-10)
+    assert stats.m2 / stats.count == pytest.approx(np.var(samples), rel=1e-10)
+    assert stats.rms == pytest.approx(np.sqrt(np.mean(np.square(samples))), rel=1e-12)
+    assert (stats.min, stats.max) == (samples.min(), samples.max())
+
+
+def test_merged_spectrum_matches_a_single_pass_and_finds_the_tone():
+    samples = signal()
+    single = Spectrum(nfft=1000)
+    single.update(samples)
+    spectrum = merged(Spectrum, samples, [0, 3000, 4000, 20000], nfft=1000)
+    assert spectrum.segments == single.segments == 20
+    assert np.allclose(spectrum.power, single.power)
+    frequencies, density = spectrum.density(0.001)
+    assert frequencies[np.argmax(density)] == pytest.approx(50.0)
+    # The density integrates to the power of the signal without its mean (sine 0.5 V**2, noise 0.01 V**2)
+    assert np.sum(density) * (frequencies[1] - frequencies[0]) == pytest.approx(0.51, rel=0.05)
+
+
+def live_triggers(samples, block_size):
+    trigger = LevelTrigger(**TRIGGER)
+    events = []
+    for start in range(0, samples.shape[0], block_size):
+        events += [sample for sample, _ in trigger.process(samples[start:start + block_size])]
+    return events
+
+
+def test_batch_triggers_equal_live_trigger_events():
+    samples = signal() - 3.0
+    expected = live_triggers(samples, 1000)
+    assert expected
+    # Chunk boundaries inside the hysteresis band and right at an edge
+    bounds = [0, 1, 2000, 2001, 7003, 7013, 12345, 20000]
+    assert merged(TriggerEvents, samples, bounds, **TRIGGER).trigger_samples() == expected
+    assert merged(TriggerEvents, samples, list(range(0, 20001, 97)) + [20000], **TRIGGER).trigger_samples() == \
+           expected
+
+
+def test_analyze_reduces_the_chunks_of_a_log_in_order(tmp_path):
+    samples = signal() - 3.0
+    filename = str(tmp_path / 'log.bin')
+    writer = DataWriter(filename, 'binary', index_chunk_samples=None)
+    for seq, start in enumerate(range(0, samples.shape[0], 1000)):
+        writer.write_block(WaveformBlock(seq, start * 0.001, 0.001, samples[start:start + 1000]))
+    writer.close_file()
+
+    results = analyze(filename, {'stats': {}, 'spectrum': {'nfft': 1000}, 'trigger': TRIGGER}, workers=2,
+                      chunk_samples=1500)
+    assert results['stats'].count == samples.shape[0]
+    assert results['stats'].mean == pytest.approx(np.mean(samples), abs=1e-12)
+    assert results['stats'].std == pytest.approx(np.std(samples), rel=1e-10)
+    assert results['spectrum'].segments == 20
+    assert results['trigger'].trigger_samples() == live_triggers(samples, 1000)
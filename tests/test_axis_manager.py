@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from axis_manager import AxisManager, nice_step
+from waveform import WaveformBlock
+
+
+def block(seq, t0, samples, dt=0.01):
+    return WaveformBlock(seq, t0, dt, np.asarray(samples, dtype=np.float64))
+
+
+def test_nice_step():
+    assert nice_step(10, 8) == 2
+    assert nice_step(1, 8) == pytest.approx(0.2)
+    assert nice_step(3, 8) == pytest.approx(0.5)
+
+
+def test_growing_x_axis_steps_ahead_by_a_quarter():
+    axes = AxisManager(autoscale_y=False)
+    axes.reset(0.0, 1.0, -1.0, 1.0)
+    # Within the limits nothing changes
+    assert not axes.update(0.0, 0.5)
+    assert axes.update(0.0, 2.0)
+    assert axes.xlim == (0.0, 2.5)
+    assert not axes.update(0.0, 2.4)
+    assert axes.update(0.0, 2.6)
+    assert axes.xlim == (0.0, 3.25)
+    assert (axes.updates, axes.steps) == (4, 2)
+    assert axes.ylim == (-1.0, 1.0)
+
+
+def test_window_scrolls_in_steps():
+    axes = AxisManager(window=10.0, autoscale_y=False)
+    axes.reset(0.0, 10.0, -1.0, 1.0)
+    assert not axes.update(0.0, 9.0)
+    assert axes.update(0.0, 12.0)
+    assert axes.xlim == (4.5, 14.5)
+    assert not axes.update(0.0, 14.0)
+    # Data older than the window, e.g. after a restart, moves the window back
+    assert axes.update(0.0, 1.0)
+    assert axes.xlim == (-6.5, 3.5)
+
+
+def test_y_axis_grows_at_once_and_is_rounded_to_the_tick_step():
+    axes = AxisManager()
+    axes.reset(0.0, 1.0, -0.1, 0.1)
+    axes.add(block(0, 0.0, [-0.3, 0.8]))
+    assert axes.update(0.0, 0.02)
+    assert axes.ylim == pytest.approx((-0.4, 1.0))
+    # Data within the limits leaves them alone, data outside grows them right away
+    axes.add(block(1, 0.02, [0.9, 0.0]))
+    assert not axes.update(0.0, 0.04)
+    axes.add(block(2, 0.04, [3.0, 0.0]))
+    assert axes.update(0.0, 0.06)
+    assert axes.ylim[0] <= -0.3 and axes.ylim[1] >= 3.0
+
+
+def test_y_axis_only_shrinks_once_the_data_uses_less_than_half_of_it():
+    axes = AxisManager(window=1.0)
+    # One second of large samples, then smaller ones that scroll the large ones out of view
+    for seq in range(10):
+        axes.add(block(seq, seq * 0.1, [-2.0, 2.0], dt=0.05))
+    axes.update(0.0, 1.0)
+    large = axes.ylim
+    for seq in range(10, 30):
+        axes.add(block(seq, seq * 0.1, [-1.5, 1.5], dt=0.05))
+        axes.update(0.0, (seq + 1) * 0.1)
+    # [-1.5, 1.5] still uses more than half of the axis
+    assert axes.ylim == large
+    for seq in range(30, 50):
+        axes.add(block(seq, seq * 0.1, [-0.1, 0.1], dt=0.05))
+        axes.update(0.0, (seq + 1) * 0.1)
+    assert axes.ylim[0] >= -0.2 and axes.ylim[1] <= 0.2
+
+
+def test_non_finite_samples_do_not_scale_the_y_axis():
+    axes = AxisManager()
+    axes.reset(0.0, 1.0, -0.1, 0.1)
+    axes.add(block(0, 0.0, [np.nan, -np.inf, 0.5, -0.5]))
+    axes.add(block(1, 0.04, [np.nan, np.nan]))
+    axes.update(0.0, 0.06)
+    assert axes.ylim == pytest.approx((-0.6, 0.6))
+
+
+def test_invalid_settings_are_rejected():
+    with pytest.raises(ValueError):
+        AxisManager(window=0)
+    with pytest.raises(ValueError):
+        AxisManager(step_fraction=1.5)
@@ -0,0 +1,101 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from block_buffer import BlockBuffer
+from reader_entry import END_OF_DATA
+from waveform import WaveformBlock
+
+# Room for two blocks of 10 float64 samples
+BUDGET = 200
+
+
+def block(seq, n=10):
+    return WaveformBlock(seq, seq * n * 0.001, 0.001, np.arange(seq * n, (seq + 1) * n, dtype=np.float64),
+                         first_sample=seq * n)
+
+
+def drain(buffer):
+    blocks = []
+    while len(buffer):
+        blocks.append(buffer.get(timeout=0))
+    return blocks
+
+
+def test_drop_oldest_makes_room_for_the_incoming_block():
+    buffer = BlockBuffer(BUDGET, 'drop-oldest')
+    assert [buffer.put(block(seq)) for seq in range(5)] == [True] * 5
+    assert (buffer.dropped_blocks, buffer.dropped_samples, buffer.nbytes) == (3, 30, 160)
+    assert [b.seq for b in drain(buffer)] == [3, 4]
+    assert buffer.nbytes == 0
+
+
+def test_drop_newest_keeps_the_buffered_blocks():
+    buffer = BlockBuffer(BUDGET, 'drop-newest')
+    assert [buffer.put(block(seq)) for seq in range(5)] == [True, True, False, False, False]
+    assert (buffer.dropped_blocks, buffer.dropped_samples, buffer.nbytes) == (3, 30, 160)
+    assert [b.seq for b in drain(buffer)] == [0, 1]
+
+
+def test_decimate_halves_the_oldest_blocks_first():
+    buffer = BlockBuffer(BUDGET, 'decimate')
+    for seq in range(3):
+        assert buffer.put(block(seq))
+    # Halving block 0 frees just enough for block 2
+    assert (buffer.dropped_blocks, buffer.dropped_samples, buffer.nbytes) == (0, 5, 200)
+    oldest = drain(buffer)[0]
+    assert oldest.samples.tolist() == [0, 2, 4, 6, 8]
+    assert (oldest.dt, oldest.t0, oldest.first_sample, oldest.source_samples) == (0.002, 0.0, 0, 10)
+
+
+def test_decimate_drops_the_oldest_block_once_nothing_can_be_halved():
+    buffer = BlockBuffer(16, 'decimate')
+    for seq in range(4):
+        assert buffer.put(block(seq, n=1))
+    assert (buffer.dropped_blocks, buffer.dropped_samples) == (2, 2)
+    assert [b.seq for b in drain(buffer)] == [2, 3]
+
+
+def test_block_waits_for_the_consumer_or_gives_up_on_abort():
+    buffer = BlockBuffer(BUDGET, 'block')
+    assert buffer.put(block(0)) and buffer.put(block(1))
+    assert not buffer.put(block(2), abort=lambda: True)
+    assert (buffer.dropped_blocks, buffer.dropped_samples) == (1, 10)
+
+    consumer = threading.Timer(0.2, buffer.get)
+    consumer.start()
+    start = time.monotonic()
+    assert buffer.put(block(3), abort=lambda: False)
+    assert time.monotonic() - start >= 0.15
+    consumer.join()
+    assert buffer.dropped_blocks == 1
+    assert [b.seq for b in drain(buffer)] == [1, 3]
+
+
+def test_end_of_data_and_oversized_blocks_always_fit():
+    buffer = BlockBuffer(BUDGET, 'drop-newest')
+    assert buffer.put(block(0, n=100))
+    assert buffer.put(END_OF_DATA)
+    assert not buffer.put(block(1))
+    assert drain(buffer)[1] is END_OF_DATA
+
+
+def test_wait_nonempty_does_not_take_the_block():
+    buffer = BlockBuffer(BUDGET)
+    assert not buffer.wait_nonempty(0.05)
+    threading.Timer(0.1, buffer.put, args=(block(0),)).start()
+    assert buffer.wait_nonempty(5.0)
+    assert len(buffer) == 1
+    assert buffer.peek_nbytes() == 80
+    buffer.clear()
+    assert (len(buffer), buffer.nbytes, buffer.dropped_blocks) == (0, 0, 0)
+    with pytest.raises(queue.Empty):
+        buffer.get(timeout=0)
+
+
+def test_invalid_policy_is_rejected():
+    with pytest.raises(ValueError):
+        BlockBuffer(BUDGET, 'drop-all')
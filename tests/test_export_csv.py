@@ -0,0 +1,43 @@
+import numpy as np
+
+from export_csv import export, format_fixed, plan_chunks
+from file_writer import DataWriter
+from session_log import SessionLog
+from waveform import WaveformBlock
+
+
+def write_log(filename):
+    writer = DataWriter(filename, 'binary', index_chunk_samples=None)
+    writer.write_block(WaveformBlock(0, 0.0, 0.001, np.arange(10, dtype=np.float64)))
+    writer.write_marker('Trigger at sample 5')
+    writer.write_block(WaveformBlock(1, 0.01, 0.001, np.arange(10, 20, dtype=np.float64)))
+    writer.write_marker('Read jitter: 2 intervals')
+    writer.close_file()
+
+
+def test_markers_after_the_last_sample_are_exported(tmp_path):
+    filename = str(tmp_path / 'log.bin')
+    write_log(filename)
+    chunks = plan_chunks(SessionLog(filename), 4, with_time=False)
+    assert chunks[-1][:2] == (20, 20)
+    assert chunks[-1][4] == '# Read jitter: 2 intervals\n'
+
+    output = str(tmp_path / 'log.csv')
+    assert export(filename, output, workers=1) == 20
+    with open(output) as f:
+        lines = f.read().splitlines()
+    assert lines[-1] == '# Read jitter: 2 intervals'
+    assert lines[-2] == '19.000000'
+    assert '# Trigger at sample 5' in lines
+
+
+def test_fixed_formatting_matches_printf():
+    rng = np.random.default_rng(0)
+    # Values whose scaled product rounds to a half, exact halves and values rounding to zero
+    values = np.concatenate((rng.normal(0.0, 100.0, 10000), [9.9999995, -123.4567895, 0.5, 2.5, -0.25, 1e-7, 0.0]))
+    for precision in (0, 1, 6):
+        lines = format_fixed([values], precision).decode('ascii').splitlines()
+        expected = ['%.{}f'.format(precision) % value for value in values.tolist()]
+        # Values rounding to zero never get a minus sign
+        expected = [text[1:] if text.startswith('-') and float(text) == 0 else text for text in expected]
+        assert lines == expected
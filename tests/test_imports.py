@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_simulated_and_replay_readers_import_without_nidaqmx():
+    # A None entry in sys.modules makes any import of nidaqmx fail, whether or not it is installed
+    code = ('import sys\n'
+            'sys.modules["nidaqmx"] = None\n'
+            'import simulated, replay\n'
+            'simulated.SimulatedReader\n'
+            'replay.ReplayReader\n')
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+
+from file_writer import DataWriter
+from log_index import LogIndex, index_filename
+from session_log import SessionLog
+from waveform import WaveformBlock
+
+
+def write_log(filename, file_format):
+    samples = np.zeros(1000)
+    samples[250:260] = 5.0
+    samples[700:703] = 6.0
+    writer = DataWriter(filename, file_format, index_chunk_samples=100)
+    writer.write_block(WaveformBlock(0, 0.0, 0.001, samples))
+    writer.close_file()
+
+
+def test_binary_logs_read_only_the_matching_chunks(tmp_path):
+    filename = str(tmp_path / 'log.bin')
+    write_log(filename, 'binary')
+    log_index = LogIndex(SessionLog(filename))
+    assert log_index.spans(above=4.5) == [(200, 300), (700, 800)]
+    assert log_index.search(above=4.5) == [(250, 260), (700, 703)]
+    assert log_index.search(above=4.5, min_samples=5) == [(250, 260)]
+
+
+def test_csv_logs_are_searched_without_an_index(tmp_path):
+    filename = str(tmp_path / 'log.csv')
+    write_log(filename, 'csv')
+    assert not os.path.exists(index_filename(filename))
+    log_index = LogIndex(SessionLog(filename))
+    assert log_index.spans(above=4.5) == [(0, 1000)]
+    assert log_index.search(above=4.5) == [(250, 260), (700, 703)]
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from processing import ProcessingPipeline
+from waveform import ContinuityChecker, WaveformBlock
+
+
+def jittered_offset(samples, offset):
+    """
+    Adds an offset after a delay that varies from block to block, so pooled blocks finish out of order.
+    """
+    time.sleep(0.02 * (int(samples[0]) % 3))
+    return samples + offset
+
+
+def failing(samples):
+    raise ZeroDivisionError('stage failed')
+
+
+def every_other(samples):
+    return samples[::2]
+
+
+def wait_for(samples, event):
+    event.wait(5.0)
+    return samples
+
+
+def blocks(count, n=10):
+    return [WaveformBlock(seq, seq * n * 0.001, 0.001, np.arange(seq * n, (seq + 1) * n, dtype=np.float64),
+                          first_sample=seq * n) for seq in range(count)]
+
+
+def run(pipeline, submitted):
+    processed = []
+    for block in submitted:
+        pipeline.submit(block)
+        processed += pipeline.ready()
+    return processed + pipeline.drain()
+
+
+@pytest.mark.parametrize('mode', ['inline', 'thread', 'process'])
+def test_stages_run_in_order_and_blocks_arrive_in_order(mode):
+    # Neither the stages nor the offsets commute, so their order shows in the result
+    pipeline = ProcessingPipeline([{'function': 'scale', 'kwargs': {'gain': 2.0}},
+                                   {'function': 'test_processing:jittered_offset', 'kwargs': {'offset': 1.0},
+                                    'mode': mode, 'workers': 3},
+                                   {'function': 'clip', 'kwargs': {'maximum': 100.0}, 'mode': mode, 'workers': 2}])
+    try:
+        processed = run(pipeline, blocks(20))
+    finally:
+        pipeline.close()
+    assert [block.seq for block in processed] == list(range(20))
+    samples = np.concatenate([block.samples for block in processed])
+    assert np.array_equal(samples, np.minimum(np.arange(200) * 2.0 + 1.0, 100.0))
+    assert [stage.timing.blocks for stage in pipeline.stages] == [20, 20, 20]
+    assert pipeline.latency.blocks == 20
+
+
+@pytest.mark.parametrize('mode', ['inline', 'thread', 'process'])
+def test_stage_errors_reach_the_caller(mode):
+    pipeline = ProcessingPipeline([{'function': 'test_processing:failing', 'mode': mode, 'workers': 1}])
+    try:
+        with pytest.raises(ZeroDivisionError):
+            run(pipeline, blocks(3))
+    finally:
+        pipeline.close()
+
+
+def test_multichannel_results_are_rejected():
+    pipeline = ProcessingPipeline([{'function': 'numpy:atleast_2d'}])
+    with pytest.raises(ValueError):
+        run(pipeline, blocks(1))
+
+
+@pytest.mark.parametrize('function, kwargs, n', [('numpy:repeat', {'repeats': 4}, 40),
+                                                  ('test_processing:every_other', {}, 5)])
+def test_resampling_stages_keep_the_time_span_of_the_block(function, kwargs, n):
+    pipeline = ProcessingPipeline([{'function': function, 'kwargs': kwargs, 'mode': 'thread'},
+                                   {'function': 'scale', 'kwargs': {'gain': 2.0}}])
+    checker = ContinuityChecker()
+    try:
+        processed = run(pipeline, blocks(5))
+    finally:
+        pipeline.close()
+    for block in processed:
+        assert len(block) == n
+        assert block.dt == pytest.approx(0.01 / n)
+        assert block.t_end == pytest.approx((block.seq + 1) * 0.01)
+        assert block.source_samples == 10
+        assert checker.check(block)
+    assert checker.ok
+    assert checker.decimated_samples == max(5 * (10 - n), 0)
+
+
+def test_a_full_pipeline_holds_up_submit_until_the_oldest_block_is_done():
+    release = threading.Event()
+    pipeline = ProcessingPipeline([{'function': wait_for, 'kwargs': {'event': release}, 'mode': 'thread',
+                                    'workers': 4}], max_pending=2)
+    submitted = blocks(3)
+    pipeline.submit(submitted[0])
+    pipeline.submit(submitted[1])
+    assert pipeline.ready() == []
+    # The third block would exceed max_pending, so submit waits for the first one
+    submitter = threading.Thread(target=pipeline.submit, args=(submitted[2],))
+    submitter.start()
+    submitter.join(0.3)
+    assert submitter.is_alive()
+    release.set()
+    submitter.join(5.0)
+    assert not submitter.is_alive()
+    assert [block.seq for block in pipeline.ready() + pipeline.drain()] == [0, 1, 2]
+    pipeline.close()
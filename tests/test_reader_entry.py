@@ -0,0 +1,66 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from reader_entry import END_OF_DATA, Process, discard_blocks
+from waveform import WaveformBlock
+
+TIMEOUT = 10.0
+
+
+def fill(ui_queue, blocks, after=None, crash=False):
+    """
+    Process target queuing blocks of 10000 samples like a reader, far more than the pipe holds, then END_OF_DATA and
+    an item of the next acquisition. With crash set, the process dies instead of sending END_OF_DATA.
+    """
+    for seq in range(blocks):
+        ui_queue.put(WaveformBlock(seq, seq * 0.01, 1e-6, np.full(10000, float(seq)), first_sample=seq * 10000))
+    if crash:
+        # Dies once its blocks are in the pipe, without END_OF_DATA
+        ui_queue.close()
+        ui_queue.join_thread()
+        os._exit(1)
+    ui_queue.put(END_OF_DATA)
+    if after is not None:
+        ui_queue.put(after)
+
+
+def test_a_full_queue_is_discarded_up_to_end_of_data_across_processes():
+    ui_queue = multiprocessing.Queue()
+    process = Process(target=fill, args=(ui_queue, 500, 'next'))
+    process.start()
+    # The reader cannot exit while its queued blocks are unread
+    process.join(0.5)
+    assert process.is_alive()
+    start = time.monotonic()
+    discard_blocks(ui_queue, process)
+    assert time.monotonic() - start < TIMEOUT
+    process.join(TIMEOUT)
+    assert process.exitcode == 0
+    # Everything after END_OF_DATA is left in the queue, intact
+    assert ui_queue.get(timeout=TIMEOUT) == 'next'
+    ui_queue.put('again')
+    assert ui_queue.get(timeout=TIMEOUT) == 'again'
+
+
+def test_discarding_ends_when_the_reader_dies():
+    ui_queue = multiprocessing.Queue()
+    process = Process(target=fill, args=(ui_queue, 50), kwargs={'crash': True})
+    process.start()
+    discard_blocks(ui_queue, process)
+    process.join(TIMEOUT)
+    assert process.exitcode == 1
+    assert ui_queue.empty()
+
+
+def test_other_queues_are_discarded_through_get():
+    ui_queue = queue.Queue()
+    thread = threading.Thread(target=fill, args=(ui_queue, 5, 'next'))
+    thread.start()
+    discard_blocks(ui_queue, thread)
+    thread.join(TIMEOUT)
+    assert ui_queue.get_nowait() == 'next'
@@ -0,0 +1,114 @@
+import pytest
+
+from block_buffer import BlockQueue
+from reader_entry import CMD_CONFIGURE, CMD_QUIT, CMD_START, END_OF_DATA, GLOBAL_ACK, READY_ACK, STARTED_ACK, \
+    ControlChannel, Process, serve_reader
+
+CONFIGURATION = {'simulate': {}, 'sample_clock_source': 'OnBoardClock', 'sample_rate': 1000, 'samples_per_read': 50,
+                 'channel': 0, 'dev_name': 'Sim', 'max_voltage': 5, 'min_voltage': -5,
+                 'terminal_configuration': 'DEFAULT', 'output_file': None}
+TIMEOUT = 10.0
+
+
+@pytest.fixture
+def worker():
+    workers = []
+
+    def start(configuration=CONFIGURATION):
+        ui_queue, control = BlockQueue(2 ** 20, 'drop-oldest'), ControlChannel()
+        process = Process(target=serve_reader, args=(configuration, ui_queue, control))
+        process.start()
+        workers.append(process)
+        assert control.wait_for_ack(READY_ACK, process, timeout=TIMEOUT)
+        return process, ui_queue, control
+
+    yield start
+    for process in workers:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+
+def next_block(ui_queue):
+    block = ui_queue.get(timeout=TIMEOUT)
+    assert block is not END_OF_DATA
+    return block
+
+
+def start(process, control):
+    control.send(CMD_START)
+    assert control.wait_for_ack(STARTED_ACK, process, timeout=TIMEOUT)
+
+
+def stop(process, ui_queue, control):
+    control.stop()
+    assert control.wait_for_ack(GLOBAL_ACK, process, timeout=TIMEOUT)
+    ui_queue.discard(process)
+
+
+def quit_worker(process, control):
+    control.send(CMD_QUIT)
+    assert control.wait_for_ack(GLOBAL_ACK, process, timeout=TIMEOUT)
+    process.join(TIMEOUT)
+    assert process.exitcode == 0
+    assert process.exception is None
+
+
+def test_start_stop_and_restart(worker):
+    process, ui_queue, control = worker()
+    for _ in range(2):
+        start(process, control)
+        blocks = [next_block(ui_queue) for _ in range(3)]
+        # Every acquisition counts its blocks and samples from zero
+        assert [block.seq for block in blocks] == [0, 1, 2]
+        assert [block.first_sample for block in blocks] == [0, 50, 100]
+        stop(process, ui_queue, control)
+    quit_worker(process, control)
+
+
+def test_stop_while_idle_is_not_answered_and_does_not_end_the_next_acquisition(worker):
+    process, ui_queue, control = worker()
+    control.stop()
+    # The idle worker waits for commands, not stop requests
+    assert not control.wait_for_ack(GLOBAL_ACK, process, timeout=0.3)
+    assert process.is_alive()
+    start(process, control)
+    assert next_block(ui_queue).seq == 0
+    assert next_block(ui_queue).seq == 1
+    stop(process, ui_queue, control)
+    quit_worker(process, control)
+
+
+def test_configure_while_idle_and_during_acquisition(worker):
+    process, ui_queue, control = worker()
+    control.send(CMD_CONFIGURE, dict(CONFIGURATION, samples_per_read=100))
+    assert control.wait_for_ack(READY_ACK, process, timeout=TIMEOUT)
+    start(process, control)
+    assert len(next_block(ui_queue)) == 100
+
+    control.send(CMD_CONFIGURE, dict(CONFIGURATION, sample_rate=2000, samples_per_read=100))
+    assert control.wait_for_ack(READY_ACK, process, timeout=TIMEOUT)
+    # The running acquisition carries on at the new rate, with its sequence numbers and time axis continued
+    block = next_block(ui_queue)
+    while block.dt != 1 / 2000:
+        previous, block = block, next_block(ui_queue)
+    assert block.seq == previous.seq + 1
+    assert block.t0 >= previous.t_end
+    stop(process, ui_queue, control)
+    quit_worker(process, control)
+
+
+def test_a_new_worker_starts_after_the_previous_one_died(worker):
+    # A device buffer smaller than a read overflows on the first read
+    process, ui_queue, control = worker(dict(CONFIGURATION, simulate={'buffer_samples': 10}))
+    start(process, control)
+    assert not control.wait_for_ack(GLOBAL_ACK, process, timeout=TIMEOUT)
+    ui_queue.discard(process)
+    process.join(TIMEOUT)
+    assert '-200279' in process.exception
+
+    process, ui_queue, control = worker()
+    start(process, control)
+    assert next_block(ui_queue).seq == 0
+    stop(process, ui_queue, control)
+    quit_worker(process, control)
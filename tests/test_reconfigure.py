@@ -0,0 +1,42 @@
+import threading
+
+import numpy as np
+
+from block_buffer import BlockBuffer
+from reader_entry import CMD_CONFIGURE, READY_ACK, STARTED_ACK, ControlChannel
+from simulated import SimulatedReader
+from waveform import WaveformStore
+
+CONFIGURATION = {'simulate': {}, 'sample_clock_source': 'OnBoardClock', 'sample_rate': 1000, 'samples_per_read': 50,
+                 'channel': 0, 'dev_name': 'Sim', 'max_voltage': 5, 'min_voltage': -5,
+                 'terminal_configuration': 'DEFAULT', 'output_file': None}
+TIMEOUT = 10.0
+
+
+def test_rate_change_keeps_the_times_of_earlier_samples():
+    ui_queue, control = BlockBuffer(2 ** 20), ControlChannel()
+    reader = SimulatedReader(CONFIGURATION, ui_queue, control)
+    acquisition = threading.Thread(target=reader.acquire)
+    acquisition.start()
+    assert control.wait_for_ack(STARTED_ACK, acquisition, timeout=TIMEOUT)
+    blocks = [ui_queue.get(timeout=TIMEOUT) for _ in range(2)]
+    # Applied by the acquisition loop after the block it is reading
+    control.send(CMD_CONFIGURE, dict(CONFIGURATION, sample_rate=10000, samples_per_read=100))
+    assert control.wait_for_ack(READY_ACK, acquisition, timeout=TIMEOUT)
+    while sum(block.dt == 0.0001 for block in blocks) < 3:
+        blocks.append(ui_queue.get(timeout=TIMEOUT))
+    control.stop()
+    acquisition.join(TIMEOUT)
+    assert not acquisition.is_alive()
+
+    store = WaveformStore()
+    for block in blocks:
+        store.append(block)
+    before = 50 * sum(block.dt == 0.001 for block in blocks)
+    assert np.allclose(store.times(0, before), np.arange(before) * 0.001)
+    assert store.index_at(0.025) == 25
+    times = store.times(before, before + 300)
+    # The new rate continues after the gap of the restart
+    assert times[0] >= before * 0.001
+    assert np.allclose(np.diff(times), 0.0001)
+    assert np.isclose(store.t_end, blocks[-1].t_end)
@@ -0,0 +1,96 @@
+import logging
+import math
+import os
+import threading
+
+import pytest
+
+from scheduling import JitterMonitor, apply_scheduling
+
+linux_only = pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason='Needs the Linux scheduler interface')
+
+
+def in_thread(function):
+    """
+    Runs function in a new thread, so its scheduling settings do not outlive the test, and returns its result.
+    """
+    result = []
+    thread = threading.Thread(target=lambda: result.append(function()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+@linux_only
+def test_affinity_applies_to_the_calling_thread_and_the_threads_it_starts():
+    core = min(os.sched_getaffinity(0))
+    main_affinity = os.sched_getaffinity(0)
+
+    def configure():
+        applied = apply_scheduling(cpu_affinity=[core], name='test')
+        return applied, os.sched_getaffinity(0), in_thread(lambda: os.sched_getaffinity(0))
+
+    assert in_thread(configure) == (True, {core}, {core})
+    assert os.sched_getaffinity(0) == main_affinity
+
+
+@linux_only
+def test_a_lower_priority_can_always_be_set():
+    nice = min(os.getpriority(os.PRIO_PROCESS, 0) + 1, 19)
+
+    def configure():
+        return apply_scheduling(nice=nice, name='test'), os.getpriority(os.PRIO_PROCESS, 0)
+
+    assert in_thread(configure) == (True, nice)
+
+
+def test_settings_that_cannot_be_applied_are_logged_and_skipped(monkeypatch, caplog):
+    def denied(*args):
+        raise PermissionError()
+
+    monkeypatch.setattr(os, 'sched_setscheduler', denied, raising=False)
+    monkeypatch.setattr(os, 'sched_param', lambda priority: priority, raising=False)
+    monkeypatch.setattr(os, 'SCHED_FIFO', 1, raising=False)
+    monkeypatch.delattr(os, 'sched_setaffinity', raising=False)
+    with caplog.at_level(logging.WARNING, logger='scheduling'):
+        assert not apply_scheduling(cpu_affinity=[0], realtime_priority=10, name='reader')
+    assert [record.getMessage() for record in caplog.records] == [
+        'Cannot set the CPU affinity of the reader: not supported on this platform',
+        'Cannot set the real-time priority of the reader: permission denied']
+
+
+@pytest.mark.parametrize('kwargs', [dict(nice=20), dict(nice=-21), dict(realtime_priority=0),
+                                    dict(realtime_priority=100)])
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        apply_scheduling(**kwargs)
+
+
+def test_jitter_of_late_and_early_iterations():
+    monitor = JitterMonitor(0.01)
+    assert math.isnan(monitor.std) and math.isnan(monitor.percentile(99))
+    # On time, 5 ms late, 5 ms early while catching up, on time
+    for now in (0.0, 0.01, 0.025, 0.03, 0.04):
+        monitor.tick(now)
+    assert monitor.count == 4
+    assert monitor.max_late == pytest.approx(0.005)
+    assert monitor.std == pytest.approx(math.sqrt(0.005 ** 2 / 2))
+    assert monitor.percentile(99) == pytest.approx(0.005)
+    assert monitor.percentile(0) == pytest.approx(0.0, abs=1e-12)
+    assert monitor.summary() == '4 intervals of 10.000 ms: jitter std 3.536 ms, p99 5.000 ms, up to 5.000 ms late'
+
+    monitor.reset(0.02)
+    assert (monitor.period, monitor.count, monitor.max_late) == (0.02, 0, 0.0)
+    # The first tick after a reset only sets the start
+    monitor.tick(1.0)
+    monitor.tick(1.02)
+    assert monitor.count == 1
+    assert monitor.std == pytest.approx(0.0, abs=1e-12)
+
+
+def test_jitter_percentile_covers_only_the_recent_iterations():
+    monitor = JitterMonitor(1.0, keep=3)
+    for now in (0.0, 1.5, 2.5, 3.5, 4.5):
+        monitor.tick(now)
+    assert monitor.max_late == pytest.approx(0.5)
+    assert monitor.percentile(100) == pytest.approx(0.0)
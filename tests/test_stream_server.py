@@ -0,0 +1,99 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from stream_server import BlockServer, BlockSubscriber, encode_block, read_block
+from waveform import WaveformBlock
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def address(tmp_path):
+    return 'unix://' + str(tmp_path / 'stream.sock')
+
+
+def test_frames_round_trip_over_a_socket():
+    sender, receiver = socket.socketpair()
+    blocks = [WaveformBlock(7, 1.5, 0.001, np.arange(5, dtype=np.float64), first_sample=1500, acquired=1600),
+              WaveformBlock(8, 1.505, 0.002, np.arange(3, dtype=np.float32), source_samples=6),
+              WaveformBlock(9, 1.511, 0.002, np.empty(shape=(0,), dtype=np.float32))]
+    for block in blocks:
+        sender.sendall(encode_block(block))
+    sender.close()
+    for block in blocks:
+        received = read_block(receiver)
+        assert (received.seq, received.t0, received.dt) == (block.seq, block.t0, block.dt)
+        assert (received.first_sample, received.acquired, received.source_samples) == \
+               (block.first_sample, block.acquired, block.source_samples)
+        assert received.samples.dtype == block.samples.dtype
+        assert np.array_equal(received.samples, block.samples)
+    # The closed connection ends the stream
+    assert read_block(receiver) is None
+    receiver.close()
+
+
+def test_frames_out_of_sync_are_rejected():
+    sender, receiver = socket.socketpair()
+    sender.sendall(b'XXXX' + encode_block(WaveformBlock(0, 0.0, 1.0, np.zeros(2)))[4:])
+    with pytest.raises(ValueError):
+        read_block(receiver)
+    sender.close()
+    receiver.close()
+
+
+def test_the_block_policy_is_not_offered(address):
+    with pytest.raises(ValueError):
+        BlockServer(address, slow_client_policy='block')
+
+
+def test_a_slow_subscriber_drops_blocks_without_holding_up_publish_or_other_subscribers(address):
+    server = BlockServer(address, max_buffered_bytes=2 ** 20, slow_client_policy='drop-oldest')
+    server.start()
+    received = []
+    with BlockSubscriber(address) as fast:
+        receiver = threading.Thread(target=lambda: received.extend(block.seq for block in fast), daemon=True)
+        receiver.start()
+        # Connects and never reads
+        slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        slow.connect(address[len('unix://'):])
+        wait_for(lambda: len(server.subscribers) == 2)
+
+        for seq in range(100):
+            start = time.monotonic()
+            server.publish(WaveformBlock(seq, seq * 0.1, 1e-6, np.zeros(100000)))
+            assert time.monotonic() - start < 0.5
+            # The fast subscriber keeps up
+            wait_for(lambda: len(received) > seq)
+        assert received == list(range(100))
+        assert server.dropped_blocks > 0
+        assert server.dropped_samples == server.dropped_blocks * 100000
+        server.close()
+        slow.close()
+        receiver.join(5.0)
+
+
+def test_a_slow_subscriber_is_disconnected_and_its_drops_stay_counted(address):
+    server = BlockServer(address, max_buffered_bytes=2 ** 20, slow_client_policy='disconnect')
+    server.start()
+    slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    slow.connect(address[len('unix://'):])
+    wait_for(lambda: len(server.subscribers) == 1)
+    for seq in range(100):
+        server.publish(WaveformBlock(seq, seq * 0.1, 1e-6, np.zeros(100000)))
+        if not server.subscribers:
+            break
+    assert server.subscribers == []
+    assert server.disconnected == 1
+    assert server.dropped_blocks == 1
+    assert server.dropped_samples == 100000
+    server.close()
+    slow.close()
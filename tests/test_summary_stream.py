@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+from file_writer import DataWriter
+from session_log import SessionLog
+from summary_stream import SummaryStream, build_summary, remove_summaries, summary_decimations, summary_filename
+from waveform import WaveformBlock
+
+DT = 0.001
+BLOCK = 333
+# The second half of the log follows a pause, so records restart at the discontinuity
+SEGMENTS = [(0, 4995, 0.0), (4995, 9990, 100.0)]
+
+
+def write_log(filename, decimations, file_format='binary'):
+    samples = np.random.default_rng(0).normal(0.0, 1.0, SEGMENTS[-1][1])
+    writer = DataWriter(filename, file_format, summary_decimations=decimations)
+    for start, stop, t0 in SEGMENTS:
+        for position in range(start, stop, BLOCK):
+            writer.write_block(WaveformBlock(position // BLOCK, t0 + (position - start) * DT, DT,
+                                             samples[position:position + BLOCK]))
+    writer.close_file()
+    return samples
+
+
+def expected_records(samples, decimation):
+    """
+    Records of every run of decimation samples from the start of each segment, ending with a partial one.
+    """
+    records = []
+    for start, stop, t0 in SEGMENTS:
+        for position in range(start, stop, decimation):
+            chunk = samples[position:min(position + decimation, stop)]
+            records.append((position, position + chunk.shape[0], t0 + (position - start) * DT, chunk.min(), chunk.max(),
+                            chunk.mean()))
+    return records
+
+
+def assert_records(records, expected):
+    assert len(records) == len(expected)
+    for field, column in zip(records.dtype.names, zip(*expected)):
+        if field in ('start', 'stop'):
+            assert records[field].tolist() == list(column)
+        else:
+            assert np.allclose(records[field], column, rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize('file_format', ['binary', 'csv'])
+def test_written_summaries_match_numpy_over_each_level(tmp_path, file_format):
+    filename = str(tmp_path / 'log')
+    samples = write_log(filename, (100, 7, 1000), file_format)
+    assert summary_decimations(filename) == [7, 100, 1000]
+    for decimation in (7, 100, 1000):
+        stream = SummaryStream(filename, decimation)
+        # 4995 samples per segment end each of them with a partial record
+        assert (stream.records['stop'] - stream.records['start']).tolist()[-1] == 4995 % decimation
+        assert_records(stream.records, expected_records(samples, decimation))
+
+
+def test_a_summary_built_from_the_log_matches_the_written_one(tmp_path):
+    filename = str(tmp_path / 'log.bin')
+    samples = write_log(filename, (100,))
+    assert_records(SummaryStream(filename, 100).records, expected_records(samples, 100))
+    remove_summaries(filename)
+    assert summary_decimations(filename) == []
+    build_summary(SessionLog(filename), 100, block_records=3)
+    assert_records(SummaryStream(filename, 100).records, expected_records(samples, 100))
+
+
+def test_reading_a_summary_stream(tmp_path):
+    filename = str(tmp_path / 'log.bin')
+    with pytest.raises(FileNotFoundError):
+        SummaryStream(filename)
+    write_log(filename, (10, 100))
+    stream = SummaryStream(filename)
+    assert stream.decimation == 100
+    assert len(stream) == 2 * 50
+    assert stream.between(0.1, 0.3)['start'].tolist() == [100, 200]
+    assert stream.between(100.0, 100.15)['start'].tolist() == [4995, 5095]
+    # A record cut short by a crash is ignored
+    with open(summary_filename(filename, 100), 'ab') as f:
+        f.write(b'\0' * 10)
+    assert len(SummaryStream(filename, 100)) == 100
@@ -0,0 +1,78 @@
+import numpy as np
+
+from trace_raster import column_spans, draw_trace
+
+RED = (255, 0, 0, 255)
+
+
+def naive_spans(x, y, xlim, width):
+    """
+    Column by column reference of column_spans: the trace at both column edges and every sample inside the column.
+    """
+    xmin, xmax = xlim
+    step = (xmax - xmin) / width
+    columns = [column for column in range(width) if x[0] < xmin + (column + 1) * step and
+               x[-1] >= xmin + column * step]
+    lo, hi = [], []
+    for column in columns:
+        left, right = xmin + column * step, xmin + (column + 1) * step
+        values = list(np.interp([left, right], x, y)) + y[(x >= left) & (x < right)].tolist()
+        lo.append(min(values))
+        hi.append(max(values))
+    return columns, lo, hi
+
+
+def check_spans(x, y, xlim, width):
+    first_column, lo, hi = column_spans(x, y, xlim, width)
+    columns, expected_lo, expected_hi = naive_spans(x, y, xlim, width)
+    assert list(range(first_column, first_column + lo.shape[0])) == columns
+    assert np.allclose(lo, expected_lo)
+    assert np.allclose(hi, expected_hi)
+
+
+def test_column_spans_match_a_naive_reduction():
+    rng = np.random.default_rng(0)
+    for n, xlim in ((5000, (0.0, 1.0)), (7, (0.0, 1.0)), (300, (0.25, 0.6)), (300, (-0.5, 0.7)), (50, (0.3, 2.0))):
+        x = np.sort(rng.uniform(0.0, 1.0, n))
+        y = rng.normal(0.0, 1.0, n)
+        for width in (1, 13, 100):
+            check_spans(x, y, xlim, width)
+
+
+def test_column_spans_of_a_trace_outside_the_columns_are_empty():
+    x = np.array([2.0, 3.0])
+    _, lo, hi = column_spans(x, np.zeros(2), (0.0, 1.0), 10)
+    assert lo.shape[0] == hi.shape[0] == 0
+
+
+def drawn(rgba):
+    return (rgba[..., 3] > 0).astype(int).tolist()
+
+
+def test_draw_trace_joins_a_line_across_the_columns():
+    rgba = np.zeros((4, 4, 4), dtype=np.uint8)
+    draw_trace(rgba, np.array([0.0, 4.0]), np.array([-1.0, 1.0]), (0.0, 4.0), (-1.0, 1.0), RED)
+    assert drawn(rgba) == [[0, 0, 0, 1],
+                           [0, 0, 1, 1],
+                           [0, 1, 1, 0],
+                           [1, 1, 0, 0]]
+    assert np.all(rgba[rgba[..., 3] > 0] == RED)
+
+
+def test_draw_trace_clips_spans_and_widens_them_to_the_linewidth():
+    rgba = np.zeros((4, 6, 4), dtype=np.uint8)
+    # A spike far above the image between flat parts, starting one column in
+    draw_trace(rgba, np.array([1.0, 2.0, 3.0, 4.0]), np.array([0.1, 0.1, 5.0, 0.1]), (0.0, 6.0), (-1.0, 1.0), RED,
+               linewidth=2)
+    assert drawn(rgba) == [[0, 0, 1, 1, 0, 0],
+                           [0, 1, 1, 1, 1, 0],
+                           [0, 1, 1, 1, 1, 0],
+                           [0, 0, 0, 0, 0, 0]]
+
+
+def test_draw_trace_leaves_traces_outside_the_image_out():
+    rgba = np.zeros((4, 4, 4), dtype=np.uint8)
+    draw_trace(rgba, np.array([0.0, 4.0]), np.array([3.0, 3.0]), (0.0, 4.0), (-1.0, 1.0), RED)
+    draw_trace(rgba, np.array([5.0, 6.0]), np.array([0.0, 0.0]), (0.0, 4.0), (-1.0, 1.0), RED)
+    draw_trace(rgba, np.empty(shape=(0,)), np.empty(shape=(0,)), (0.0, 4.0), (-1.0, 1.0), RED)
+    assert not rgba.any()
@@ -0,0 +1,120 @@
+import numpy as np
+import pytest
+
+from trigger import ARMED, FIRED, UNKNOWN, LevelTrigger, RingBuffer, find_edges, schmitt_states
+
+
+def naive_events(samples, mode='rising', level=0.0, upper_level=None, hysteresis=0.0, holdoff=0, pre_samples=0,
+                 post_samples=100):
+    """
+    Sample by sample reference of LevelTrigger over the whole signal.
+    """
+    state = UNKNOWN
+    next_allowed = 0
+    events = []
+    for i, value in enumerate(samples.tolist()):
+        if mode == 'rising':
+            code = FIRED if value >= level else ARMED if value <= level - hysteresis else UNKNOWN
+        elif mode == 'falling':
+            code = FIRED if value <= level else ARMED if value >= level + hysteresis else UNKNOWN
+        else:
+            inside = level + hysteresis <= value <= upper_level - hysteresis
+            code = FIRED if value < level or value > upper_level else ARMED if inside else UNKNOWN
+        previous, state = state, code if code != UNKNOWN else state
+        if previous == ARMED and state == FIRED and i >= next_allowed and i + post_samples <= samples.shape[0]:
+            events.append((i, samples[max(i - pre_samples, 0):i + post_samples]))
+            next_allowed = i + post_samples + holdoff
+    return events
+
+
+def run_blocks(trigger, samples, block_sizes):
+    events = []
+    position = 0
+    for size in block_sizes:
+        events += trigger.process(samples[position:position + size])
+        position += size
+    return events
+
+
+def test_schmitt_states_keep_the_last_decisive_state_inside_the_band():
+    codes = np.array([UNKNOWN, ARMED, UNKNOWN, FIRED, UNKNOWN, ARMED])
+    assert schmitt_states(codes).tolist() == [UNKNOWN, ARMED, ARMED, FIRED, FIRED, ARMED]
+    assert schmitt_states(codes, FIRED).tolist() == [FIRED, ARMED, ARMED, FIRED, FIRED, ARMED]
+
+
+def test_find_edges_only_reports_armed_to_fired():
+    states = np.array([FIRED, ARMED, FIRED, FIRED, ARMED, FIRED])
+    assert find_edges(states, UNKNOWN).tolist() == [2, 5]
+    # The state before the block decides whether its first sample is an edge
+    assert find_edges(states, ARMED).tolist() == [0, 2, 5]
+
+
+def test_ring_buffer_keeps_the_newest_samples_in_order():
+    ring = RingBuffer(5)
+    ring.extend([1, 2, 3])
+    assert ring.get().tolist() == [1, 2, 3]
+    ring.extend([4, 5, 6, 7])
+    assert ring.get().tolist() == [3, 4, 5, 6, 7]
+    ring.extend(np.arange(20, 32))
+    assert ring.get().tolist() == [27, 28, 29, 30, 31]
+    ring.clear()
+    assert ring.get().tolist() == []
+    empty = RingBuffer(0)
+    empty.extend([1, 2])
+    assert empty.get().tolist() == []
+
+
+def test_rising_and_falling_edges_with_hysteresis():
+    # Noise of +-0.05 around the level does not re-arm a trigger with a hysteresis of 0.1
+    samples = np.array([-1.0, -1.0, 0.0, 0.05, -0.05, 0.05, 1.0, 1.0, -1.0, 1.0, 0.5, -0.05, 0.0])
+    rising = LevelTrigger('rising', level=0.0, hysteresis=0.1, post_samples=1)
+    assert [trigger for trigger, _ in rising.process(samples)] == [2, 9]
+    falling = LevelTrigger('falling', level=0.0, hysteresis=0.1, post_samples=1)
+    assert [trigger for trigger, _ in falling.process(samples)] == [8, 11]
+
+
+def test_window_mode_fires_on_leaving_the_window():
+    samples = np.array([0.5, 0.5, 1.5, 0.5, -0.5, 0.5])
+    trigger = LevelTrigger('window', level=0.0, upper_level=1.0, post_samples=1)
+    assert [trigger for trigger, _ in trigger.process(samples)] == [2, 4]
+
+
+def test_holdoff_ignores_edges_after_a_capture():
+    # A rising edge every 4 samples
+    samples = np.tile([-1.0, -1.0, 1.0, 1.0], 10)
+    trigger = LevelTrigger('rising', post_samples=2, holdoff=5)
+    # Capture 2-3 and holdoff 4-8 ignore the edge at 6, and so on
+    assert [trigger for trigger, _ in trigger.process(samples)] == [2, 10, 18, 26, 34]
+
+
+def test_pre_and_post_trigger_windows():
+    samples = np.arange(20, dtype=np.float64)
+    trigger = LevelTrigger('rising', level=10.0, pre_samples=3, post_samples=4)
+    trigger.process(np.full(5, -1.0))
+    [(trigger_sample, event)] = trigger.process(samples)
+    assert trigger_sample == 15
+    assert event.tolist() == [7.0, 8.0, 9.0, 10.0, 11.0, 12.0, 13.0]
+
+
+def test_events_spanning_block_boundaries_match_a_single_pass():
+    rng = np.random.default_rng(0)
+    samples = np.sin(np.arange(5000) * 0.05) + rng.normal(0.0, 0.05, 5000)
+    configurations = [dict(mode='rising', level=0.2, hysteresis=0.1, holdoff=30, pre_samples=40, post_samples=70),
+                      dict(mode='falling', level=-0.3, hysteresis=0.2, pre_samples=200, post_samples=300),
+                      dict(mode='window', level=-0.8, upper_level=0.8, hysteresis=0.05, holdoff=5, pre_samples=10,
+                           post_samples=20)]
+    for configuration in configurations:
+        expected = naive_events(samples, **configuration)
+        assert expected
+        for block_sizes in ([5000], [1] * 5000, rng.integers(1, 400, 100).tolist()):
+            events = run_blocks(LevelTrigger(**configuration), samples, block_sizes)
+            assert [trigger for trigger, _ in events] == [trigger for trigger, _ in expected]
+            for (_, event), (_, reference) in zip(events, expected):
+                assert np.array_equal(event, reference)
+
+
+@pytest.mark.parametrize('kwargs', [dict(mode='up'), dict(mode='window', upper_level=-1.0), dict(hysteresis=-1.0),
+                                    dict(post_samples=0)])
+def test_invalid_settings_are_rejected(kwargs):
+    with pytest.raises(ValueError):
+        LevelTrigger(**kwargs)
@@ -0,0 +1,151 @@
+import numpy as np
+
+from waveform import ContinuityChecker, WaveformBlock, WaveformStore
+
+
+def test_store_keeps_the_dt_of_every_segment():
+    store = WaveformStore()
+    # One second at 100 Hz, then 0.1 s at 1 kHz
+    store.append(WaveformBlock(0, 0.0, 0.01, np.arange(100, dtype=np.float64)))
+    store.append(WaveformBlock(1, 1.0, 0.001, np.arange(100, dtype=np.float64)))
+    assert store.index_at(0.5) == 50
+    assert store.index_at(1.0505) == 151
+    assert np.isclose(store.t_end, 1.1)
+    times = store.times(0, len(store))
+    assert np.allclose(times[:100], np.arange(100) * 0.01)
+    assert np.allclose(times[100:], 1.0 + np.arange(100) * 0.001)
+    x, y = store.visible(0.0, 1.1)
+    assert np.allclose(x[y.shape[0] - 100:], times[100:])
+
+
+def test_decimated_blocks_keep_their_times():
+    from block_buffer import BlockBuffer
+
+    # Room for three of the six blocks, so the oldest ones are decimated, some more than once
+    buffer = BlockBuffer(3 * 8000, 'decimate')
+    for i in range(6):
+        # Every sample holds its own time
+        buffer.put(WaveformBlock(i, float(i), 0.001, i + np.arange(1000) * 0.001))
+    store = WaveformStore()
+    dts = set()
+    while len(buffer):
+        block = buffer.get()
+        dts.add(block.dt)
+        store.append(block)
+    assert len(dts) > 1
+    x, y = store.visible(0.0, 6.0)
+    assert np.allclose(x, y)
+    x, y = store.visible(1.4, 1.6)
+    assert np.allclose(x, y)
+    assert x[0] <= 1.4 and x[-1] >= 1.6
+
+
+def check_decimated(store, xmin, xmax, max_points):
+    x, y = store.visible(xmin, xmax, max_points)
+    start, stop = max(store.index_at(xmin) - 1, 0), min(store.index_at(xmax) + 1, len(store))
+    assert x.shape[0] <= max_points
+    assert np.all(np.diff(x) > 0)
+    # The extremes of the range are kept, and every point is a stored sample at its own time
+    assert y.min() == store.samples[start:stop].min() and y.max() == store.samples[start:stop].max()
+    times = store.times(0, len(store))
+    assert np.array_equal(store.samples[np.searchsorted(times, x - 1e-9)], y)
+
+
+def test_decimated_growing_and_scrolling_ranges_keep_every_extreme():
+    rng = np.random.default_rng(0)
+    store = WaveformStore()
+    t = 0.0
+    for seq in range(300):
+        dt = 0.001 if seq < 150 else 0.0005
+        n = int(rng.integers(50, 500))
+        if seq == 100:
+            # A gap in the data
+            t += 0.3
+        store.append(WaveformBlock(seq, t, dt, rng.normal(size=n)))
+        t += n * dt
+        # The whole history, then a scrolling window
+        check_decimated(store, 0.0, t * 1.25, 400)
+        check_decimated(store, t - 2.0, t + 0.5, 400)
+
+
+def test_growing_ranges_only_reduce_the_new_samples():
+    store = WaveformStore()
+    for seq in range(100):
+        store.append(WaveformBlock(seq, seq * 1.0, 0.001, np.sin(np.arange(1000) * 0.01)))
+    store.visible(0.0, 200.0, 1000)
+    timed = []
+    times = store.times
+    store.times = lambda start, stop: timed.append(stop - start) or times(start, stop)
+    for seq in range(100, 110):
+        store.append(WaveformBlock(seq, seq * 1.0, 0.001, np.sin(np.arange(1000) * 0.01)))
+        store.visible(0.0, 200.0, 1000)
+    # Ten blocks of new samples, plus the partial buckets at the ends of every range
+    assert sum(timed) < 10 * 1000 + 10 * 2 * 1000
+
+
+def checked(checker, seqs, n=10, **kwargs):
+    """
+    Checks a block of n samples for every sequence number, numbering the samples from the sequence number.
+    """
+    return [checker.check(WaveformBlock(seq, seq * n * 0.001, 0.001, np.zeros(n), first_sample=seq * n, **kwargs))
+            for seq in seqs]
+
+
+def test_continuity_of_a_complete_stream():
+    checker = ContinuityChecker()
+    assert checked(checker, range(5)) == [True] * 5
+    assert checker.ok
+    assert (checker.blocks, checker.samples, checker.lost_blocks, checker.lost_samples) == (5, 50, 0, 0)
+    assert list(checker.gaps) == []
+
+
+def test_lost_blocks_and_sample_ranges():
+    checker = ContinuityChecker()
+    assert checked(checker, [0, 1, 4, 5, 9]) == [True] * 5
+    assert not checker.ok
+    assert (checker.blocks, checker.lost_blocks, checker.lost_samples) == (5, 5, 50)
+    assert list(checker.gaps) == [(20, 40), (60, 90)]
+    assert 'lost sample ranges: 20-40, 60-90' in checker.summary()
+
+
+def test_duplicate_and_reordered_blocks_are_ignored():
+    checker = ContinuityChecker()
+    # Block 1 arrives twice, and block 3 after block 4
+    assert checked(checker, [0, 1, 1, 2, 4, 3, 5]) == [True, True, False, True, True, False, True]
+    assert (checker.duplicates, checker.reordered) == (1, 1)
+    # The late block was first counted as lost, with its samples
+    assert (checker.blocks, checker.samples, checker.lost_blocks, checker.lost_samples) == (5, 50, 1, 10)
+    assert list(checker.gaps) == [(30, 40)]
+    assert not checker.ok
+
+
+def test_a_late_joining_consumer_starts_from_its_first_block():
+    late = ContinuityChecker(join_late=True)
+    assert checked(late, [50, 51, 53]) == [True] * 3
+    assert (late.lost_blocks, late.lost_samples, list(late.gaps)) == (1, 10, [(520, 530)])
+    # The same blocks from the start of the acquisition lose everything before them
+    checker = ContinuityChecker()
+    checked(checker, [50, 51, 53])
+    assert (checker.lost_blocks, checker.lost_samples, list(checker.gaps)) == (51, 510, [(0, 500), (520, 530)])
+    late.reset()
+    checked(late, [7])
+    assert late.ok
+
+
+def test_non_contiguous_blocks_only_check_sequence_numbers():
+    checker = ContinuityChecker(contiguous=False)
+    assert checked(checker, [0, 2, 2, 3]) == [True, True, False, True]
+    assert (checker.lost_blocks, checker.lost_samples, checker.duplicates) == (1, 0, 1)
+    assert list(checker.gaps) == []
+
+
+def test_decimated_samples_and_backlog():
+    checker = ContinuityChecker()
+    for seq in range(3):
+        block = WaveformBlock(seq, seq * 0.02, 0.002, np.zeros(10), first_sample=seq * 20, acquired=seq * 20 + 35,
+                              source_samples=20)
+        assert checker.check(block)
+    assert checker.ok
+    assert (checker.samples, checker.decimated_samples, checker.max_backlog) == (30, 30, 15)
+    checker.reset()
+    assert (checker.blocks, checker.decimated_samples, checker.max_backlog) == (0, 0, 0)
@@ -0,0 +1,79 @@
+"""
+trace_raster.py: Fast rasterizer for streaming traces. Instead of going through matplotlib's artist and transform
+machinery, a trace is mapped to pixel columns and drawn as one vertical span per column, from the lowest to the highest
+value the trace takes within that column, straight into a numpy RGBA buffer. Spans include the values where the trace
+crosses the column edges, so consecutive columns join up whether the trace has many samples per column (min/max
+envelope) or fewer samples than columns (interpolated line).
+
+MatplotFigure uses it for animated lines when its fast_renderer option is enabled. matplotlib then only draws the axes
+and ticks, when the limits change.
+"""
+
+import numpy as np
+
+
+def column_spans(x, y, xlim, width):
+    """
+    Computes the vertical span of a trace in every pixel column it covers.
+
+    :param x: Sorted x values of the trace
+    :param y: y values of the trace
+    :param xlim: (xmin, xmax) mapped onto the columns [0, width)
+    :param width: Number of pixel columns
+    :return: (first_column, lo, hi) where lo[i] and hi[i] are the lowest and highest y values in column first_column + i
+    """
+    xmin, xmax = xlim
+    scale = width / (xmax - xmin)
+    columns = np.floor((x - xmin) * scale).astype(np.int64)
+    first_column = max(int(columns[0]), 0)
+    last_column = min(int(columns[-1]), width - 1)
+    if last_column < first_column:
+        return first_column, np.empty(shape=(0,)), np.empty(shape=(0,))
+
+    # Where the trace crosses the column edges (np.interp holds the end values beyond the data)
+    edges = np.interp(xmin + np.arange(first_column, last_column + 2) / scale, x, y)
+    lo = np.minimum(edges[:-1], edges[1:])
+    hi = np.maximum(edges[:-1], edges[1:])
+
+    # Fold in the samples inside each visible column
+    start, stop = np.searchsorted(columns, [first_column, last_column + 1])
+    if start < stop:
+        visible = columns[start:stop]
+        values = y[start:stop]
+        runs = np.concatenate(([0], np.flatnonzero(np.diff(visible)) + 1))
+        index = visible[runs] - first_column
+        lo[index] = np.minimum(lo[index], np.minimum.reduceat(values, runs))
+        hi[index] = np.maximum(hi[index], np.maximum.reduceat(values, runs))
+    return first_column, lo, hi
+
+
+def draw_trace(rgba, x, y, xlim, ylim, color, linewidth=1):
+    """
+    Draws a trace into an RGBA image covering xlim by ylim.
+
+    :param rgba: A (height, width, 4) uint8 array, row 0 at the top, e.g. a view of the plot area of a larger buffer
+    :param x: Sorted x values of the trace
+    :param y: y values of the trace
+    :param xlim: (xmin, xmax) of the image
+    :param ylim: (ymin, ymax) of the image
+    :param color: The RGBA color as 4 ints in [0, 255]
+    :param linewidth: Minimum height of each span in pixels
+    """
+    height, width = rgba.shape[:2]
+    if x.shape[0] == 0 or height == 0 or width == 0:
+        return
+    first_column, lo, hi = column_spans(x, y, xlim, width)
+    if lo.shape[0] == 0:
+        return
+    ymin, ymax = ylim
+    scale = height / (ymax - ymin)
+    top = np.floor((ymax - hi) * scale).astype(np.int64) - (linewidth - 1) // 2
+    bottom = np.floor((ymax - lo) * scale).astype(np.int64) + linewidth // 2
+    np.clip(top, 0, None, out=top)
+    np.clip(bottom, None, height - 1, out=bottom)
+    # Spans entirely above or below the image have top > bottom and are left out
+    lengths = np.maximum(bottom - top + 1, 0)
+    # Index only the pixels that are drawn, so the cost follows the length of the trace rather than the image area
+    columns = np.repeat(np.arange(first_column, first_column + lo.shape[0]), lengths)
+    offsets = np.arange(columns.shape[0]) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rgba[np.repeat(top, lengths) + offsets, columns] = color
@@ -0,0 +1,215 @@
+"""
+trigger.py: Level triggering for the DAQmx stream reader. Each block read from the DAQmx buffer is scanned for trigger
+conditions with vectorized numpy operations, and only the samples surrounding a trigger (the pre-trigger history kept in
+a ring buffer plus the requested number of post-trigger samples) are handed on for logging and display.
+
+Supported modes:
+
+    1. rising - fires when the signal crosses up through level after having been below level - hysteresis
+    2. falling - fires when the signal crosses down through level after having been above level + hysteresis
+    3. window - fires when the signal leaves the [level, upper_level] window after having been back inside it by at
+    least hysteresis
+"""
+
+import numpy as np
+
+# Schmitt trigger states. A trigger fires on every ARMED -> FIRED transition.
+ARMED = -1
+UNKNOWN = 0
+FIRED = 1
+
+TRIGGER_MODES = ('rising', 'falling', 'window')
+
+
+def schmitt_states(codes, state=UNKNOWN):
+    """
+    Runs a Schmitt trigger over per-sample FIRED/ARMED/UNKNOWN codes without a Python loop: samples inside the
+    hysteresis band (UNKNOWN) keep the state of the last decisive sample.
+
+    :param codes: Per-sample codes, see LevelTrigger.codes()
+    :param state: The state before the first sample
+    :return: The state after every sample
+    """
+    # Forward-fill the last decisive code over the hysteresis band
+    last = np.where(codes != UNKNOWN, np.arange(codes.shape[0]), -1)
+    np.maximum.accumulate(last, out=last)
+    return np.where(last >= 0, codes[np.maximum(last, 0)], state)
+
+
+def find_edges(states, state=UNKNOWN):
+    """
+    Returns the indices of the ARMED -> FIRED transitions, given the states returned by schmitt_states() and the state
+    before the first sample.
+    """
+    previous = np.empty_like(states)
+    previous[0] = state
+    previous[1:] = states[:-1]
+    return np.flatnonzero((previous == ARMED) & (states == FIRED))
+
+
+class RingBuffer:
+    """
+    Fixed size ring buffer holding the most recent samples of a stream.
+    """
+
+    def __init__(self, size, dtype=np.float64):
+        """
+        Creates a new ring buffer.
+
+        :param size: The number of most recent samples to keep
+        :param dtype: The numpy dtype of the stored samples
+        """
+        self.size = int(size)
+        self._data = np.zeros(shape=(self.size,), dtype=dtype)
+        self._index = 0
+        self._count = 0
+
+    def extend(self, samples):
+        """
+        Appends samples to the buffer, overwriting the oldest samples once it is full.
+        """
+        if self.size == 0:
+            return
+        samples = np.asarray(samples)[-self.size:]
+        n = samples.shape[0]
+        first = min(n, self.size - self._index)
+        self._data[self._index:self._index + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+        self._index = (self._index + n) % self.size
+        self._count = min(self._count + n, self.size)
+
+    def get(self):
+        """
+        Returns a copy of the buffered samples ordered from oldest to newest.
+        """
+        if self._count < self.size:
+            return self._data[:self._count].copy()
+        return np.concatenate((self._data[self._index:], self._data[:self._index]))
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+
+
+class LevelTrigger:
+    """
+    Vectorized level trigger with hysteresis, hold-off and pre/post-trigger capture. Feed every acquired block to
+    process(); it returns the list of events completed during that block.
+    """
+
+    def __init__(self, mode='rising', level=0.0, upper_level=None, hysteresis=0.0, holdoff=0, pre_samples=0,
+                 post_samples=100, dtype=np.float64):
+        """
+        Creates a new LevelTrigger.
+
+        :param mode: One of 'rising', 'falling' or 'window'
+        :param level: The trigger level in volts. In window mode this is the lower edge of the window
+        :param upper_level: The upper edge of the window in volts. Only used in window mode
+        :param hysteresis: How far (in volts) the signal must move back past the level before the trigger re-arms
+        :param holdoff: Number of samples after a completed capture during which new triggers are ignored
+        :param pre_samples: Number of samples before the trigger point included in each event
+        :param post_samples: Number of samples from the trigger point onward included in each event
+        :param dtype: The numpy dtype of the captured samples
+        """
+        if mode not in TRIGGER_MODES:
+            raise ValueError('Invalid trigger mode. Valid options include ' + ', '.join(TRIGGER_MODES))
+        if mode == 'window' and (upper_level is None or upper_level <= level):
+            raise ValueError('Window trigger requires an upper_level greater than level')
+        if hysteresis < 0 or holdoff < 0 or pre_samples < 0 or post_samples < 1:
+            raise ValueError('hysteresis, holdoff and pre_samples must be >= 0 and post_samples must be >= 1')
+        self.mode = mode
+        self.level = level
+        self.upper_level = upper_level
+        self.hysteresis = hysteresis
+        self.holdoff = int(holdoff)
+        self.pre_samples = int(pre_samples)
+        self.post_samples = int(post_samples)
+        self.dtype = dtype
+        self._history = RingBuffer(self.pre_samples, dtype=dtype)
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all trigger state, e.g. before a new acquisition.
+        """
+        self._state = UNKNOWN
+        self._history.clear()
+        self._capture = None
+        self._capture_fill = 0
+        self._capture_trigger = 0
+        self._holdoff_left = 0
+        self._samples_seen = 0
+
+    def codes(self, block):
+        """
+        Returns per-sample FIRED/ARMED/UNKNOWN codes for the configured mode. Samples inside the hysteresis band keep
+        the previous state.
+        """
+        if self.mode == 'rising':
+            fire = block >= self.level
+            arm = block <= self.level - self.hysteresis
+        elif self.mode == 'falling':
+            fire = block <= self.level
+            arm = block >= self.level + self.hysteresis
+        else:
+            fire = (block < self.level) | (block > self.upper_level)
+            arm = (block >= self.level + self.hysteresis) & (block <= self.upper_level - self.hysteresis)
+        return np.where(fire, FIRED, np.where(arm, ARMED, UNKNOWN))
+
+    def _find_edges(self, block):
+        """
+        Runs the Schmitt trigger over the block without a Python loop and returns the indices of all trigger edges.
+        """
+        states = schmitt_states(self.codes(block), self._state)
+        edges = find_edges(states, self._state)
+        self._state = states[-1]
+        return edges
+
+    def process(self, block):
+        """
+        Scans one block of samples for triggers.
+
+        :param block: A 1-D array of newly acquired samples
+        :return: A list of (trigger_sample, samples) tuples, one per completed event. trigger_sample is the absolute
+                 sample number of the trigger point and samples holds the pre- and post-trigger data.
+        """
+        block = np.asarray(block, dtype=self.dtype)
+        n = block.shape[0]
+        events = []
+        if n == 0:
+            return events
+        edges = self._find_edges(block)
+        pos = 0
+        while pos < n:
+            if self._capture is not None:
+                take = min(self._capture.shape[0] - self._capture_fill, n - pos)
+                self._capture[self._capture_fill:self._capture_fill + take] = block[pos:pos + take]
+                self._capture_fill += take
+                pos += take
+                if self._capture_fill == self._capture.shape[0]:
+                    events.append((self._capture_trigger, self._capture))
+                    self._capture = None
+                    self._holdoff_left = self.holdoff
+                continue
+            if self._holdoff_left:
+                skip = min(self._holdoff_left, n - pos)
+                self._holdoff_left -= skip
+                pos += skip
+                continue
+            i = np.searchsorted(edges, pos)
+            if i == edges.shape[0]:
+                break
+            edge = int(edges[i])
+            # Pre-trigger samples come from the ring buffer (previous blocks) and this block up to the edge
+            if self.pre_samples:
+                pre = np.concatenate((self._history.get(), block[:edge]))[-self.pre_samples:]
+            else:
+                pre = block[:0]
+            self._capture = np.empty(shape=(pre.shape[0] + self.post_samples,), dtype=self.dtype)
+            self._capture[:pre.shape[0]] = pre
+            self._capture_fill = pre.shape[0]
+            self._capture_trigger = self._samples_seen + edge
+            pos = edge
+        self._history.extend(block)
+        self._samples_seen += n
+        return events
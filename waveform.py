@@ -0,0 +1,353 @@
+"""
+waveform.py: The waveform block passed from the reader to its consumers, and the plot store used by the UI.
+
+A WaveformBlock carries a sequence number, the time of its first sample (t0, in seconds since the start of the
+acquisition, derived from the sample clock), the sample period dt and a contiguous array of samples. Time values are
+never stored; they are derived from (t0, dt) when needed.
+
+Blocks are also stamped for loss accounting: the number of the first acquired sample they hold, the DAQmx
+total-samples-acquired counter at read time and the number of acquired samples they cover (more than they hold once a
+buffer decimated them). Every consumer runs a ContinuityChecker over the blocks it receives to report lost, duplicated
+and reordered blocks and the exact sample ranges that were lost.
+
+Samples are float64 by default. float32 (the 'sample_dtype' task configuration entry) is plenty for the 16-bit ADCs of
+most DAQ devices and halves the memory and bandwidth of every stage: blocks, queues, stream, log and plot store.
+"""
+
+import collections
+import math
+
+import numpy as np
+
+# Sample dtypes the pipeline can carry
+SAMPLE_DTYPES = ('float64', 'float32')
+
+
+class WaveformBlock:
+    """
+    One block of samples with an implicit time axis.
+    """
+
+    __slots__ = ('seq', 't0', 'dt', 'samples', 'first_sample', 'acquired', 'source_samples')
+
+    def __init__(self, seq, t0, dt, samples, first_sample=None, acquired=None, source_samples=None):
+        """
+        Creates a new WaveformBlock.
+
+        :param seq: Sequence number of the block within the acquisition
+        :param t0: Time of the first sample in seconds
+        :param dt: Sample period in seconds
+        :param samples: A contiguous 1-D numpy array of samples. The block keeps a reference, so pass a copy of any
+                    buffer that will be reused.
+        :param first_sample: Number of the first sample within the acquisition, or None if unknown
+        :param acquired: Total number of samples acquired when the block was read (the DAQmx
+                    total_samp_per_chan_acquired counter, counted from the start of the acquisition), or None if unknown
+        :param source_samples: Number of acquired samples the block covers. Defaults to the number of samples.
+        """
+        self.seq = seq
+        self.t0 = t0
+        self.dt = dt
+        self.samples = samples
+        self.first_sample = first_sample
+        self.acquired = acquired
+        self.source_samples = samples.shape[0] if source_samples is None else source_samples
+
+    def __len__(self):
+        return self.samples.shape[0]
+
+    def __repr__(self):
+        return 'WaveformBlock(seq={}, t0={}, dt={}, n={}, dtype={})'.format(self.seq, self.t0, self.dt, len(self),
+                                                                           self.samples.dtype)
+
+    @property
+    def t_end(self):
+        """
+        Time just after the last sample, i.e. the t0 of a directly following block.
+        """
+        return self.t0 + len(self) * self.dt
+
+    def times(self, start=0, stop=None):
+        """
+        Returns the time of every sample in samples[start:stop].
+        """
+        start, stop, _ = slice(start, stop).indices(len(self))
+        return self.t0 + np.arange(start, stop) * self.dt
+
+
+class ContinuityChecker:
+    """
+    Verifies that the blocks a consumer receives form a complete, ordered stream. Sequence numbers reveal lost,
+    duplicated and reordered blocks; sample numbers give the exact sample ranges that were lost. Decimated blocks are
+    counted separately, as their sample range is complete but thinned out.
+    """
+
+    def __init__(self, contiguous=True, join_late=False, max_gaps=1000):
+        """
+        :param contiguous: False when the blocks are not meant to follow each other (trigger events), so only their
+                    sequence numbers are checked
+        :param join_late: True when the consumer may start in the middle of an acquisition (e.g. a stream subscriber),
+                    so the first block received sets the expected sequence and sample numbers
+        :param max_gaps: Number of most recent lost sample ranges kept in gaps
+        """
+        self.contiguous = contiguous
+        self.join_late = join_late
+        # (start, stop) sample ranges lost, most recent last
+        self.gaps = collections.deque(maxlen=max_gaps)
+        self._recent = collections.deque(maxlen=1024)
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all counts, e.g. at the start of a new acquisition.
+        """
+        self.blocks = 0
+        self.samples = 0
+        self.lost_blocks = 0
+        self.lost_samples = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.decimated_samples = 0
+        # Largest number of samples left in the DAQmx buffer after a read
+        self.max_backlog = 0
+        self.gaps.clear()
+        self._recent.clear()
+        self._next_seq = 0
+        self._next_sample = 0
+
+    @property
+    def ok(self):
+        return not (self.lost_blocks or self.lost_samples or self.duplicates or self.reordered)
+
+    def check(self, block):
+        """
+        Accounts for a received block.
+
+        :return: False if the block is a duplicate or arrived out of order, and so should be ignored
+        """
+        if self.join_late and not self.blocks:
+            self._next_seq = block.seq
+            if block.first_sample is not None:
+                self._next_sample = block.first_sample
+        if block.seq < self._next_seq:
+            if block.seq in self._recent:
+                self.duplicates += 1
+            else:
+                self.reordered += 1
+            return False
+        self.lost_blocks += block.seq - self._next_seq
+        self._next_seq = block.seq + 1
+        self._recent.append(block.seq)
+        self.blocks += 1
+        self.samples += len(block)
+        # Blocks upsampled by a processing stage hold more samples than they cover
+        self.decimated_samples += max(block.source_samples - len(block), 0)
+        if block.first_sample is not None:
+            if self.contiguous and block.first_sample > self._next_sample:
+                self.gaps.append((self._next_sample, block.first_sample))
+                self.lost_samples += block.first_sample - self._next_sample
+            self._next_sample = block.first_sample + block.source_samples
+            if block.acquired is not None:
+                self.max_backlog = max(self.max_backlog, block.acquired - self._next_sample)
+        return True
+
+    def summary(self):
+        """
+        Returns a one line report of the counts.
+        """
+        text = '{} blocks, {} samples received, {} blocks and {} samples lost, {} duplicates, {} reordered'.format(
+            self.blocks, self.samples, self.lost_blocks, self.lost_samples, self.duplicates, self.reordered)
+        if self.decimated_samples:
+            text += ', {} samples decimated'.format(self.decimated_samples)
+        if self.max_backlog:
+            text += ', up to {} samples behind the hardware'.format(self.max_backlog)
+        if self.gaps:
+            text += ', lost sample ranges: ' + ', '.join('{}-{}'.format(start, stop) for start, stop in
+                                                         list(self.gaps)[-10:])
+        return text
+
+
+def decimate_minmax(x, y, n_buckets):
+    """
+    Reduces a trace to the minimum and maximum of each of n_buckets equal buckets, keeping their order, so the decimated
+    trace looks the same when drawn at a resolution of about n_buckets pixels.
+
+    :return: The decimated (x, y) arrays
+    """
+    bucket = y.shape[0] // n_buckets
+    if bucket < 2:
+        return x, y
+    xs, ys = minmax_buckets(x, y, bucket)
+    # Keep the samples that do not fill a whole bucket as they are
+    n = bucket * n_buckets
+    return np.concatenate((xs, x[n:])), np.concatenate((ys, y[n:]))
+
+
+def minmax_buckets(x, y, bucket):
+    """
+    Reduces every complete bucket of bucket consecutive samples to its minimum and maximum, keeping their order. The
+    samples after the last complete bucket are left out.
+
+    :return: The (x, y) arrays of two points per bucket
+    """
+    n_buckets = y.shape[0] // bucket
+    n = bucket * n_buckets
+    xb = x[:n].reshape(n_buckets, bucket)
+    yb = y[:n].reshape(n_buckets, bucket)
+    imin = yb.argmin(axis=1)
+    imax = yb.argmax(axis=1)
+    first = np.minimum(imin, imax)
+    second = np.maximum(imin, imax)
+    rows = np.arange(n_buckets)
+    xs = np.column_stack((xb[rows, first], xb[rows, second])).ravel()
+    ys = np.column_stack((yb[rows, first], yb[rows, second])).ravel()
+    return xs, ys
+
+
+class WaveformStore:
+    """
+    Growable store of the samples received by the plot. Only the samples are stored; blocks that continue the previous
+    block are merged into one segment and time values are computed from the segment t0 and dt for the visible range
+    only. Each segment keeps its own dt, so blocks decimated under load or acquired before a change of sample rate keep
+    their times.
+
+    Decimated visible ranges are built from min/max buckets aligned to fixed sample indexes. The buckets of the last
+    range are kept, so while the range grows with the incoming data or scrolls, only the new samples are reduced.
+    """
+
+    def __init__(self, capacity=4096, dtype=np.float64):
+        self._samples = np.empty(shape=(capacity,), dtype=dtype)
+        self._size = 0
+        # First sample index, t0 and dt of every contiguous segment
+        self._starts = []
+        self._t0s = []
+        self._dts = []
+        self._segments = None
+        # dt of the newest segment
+        self.dt = None
+        # Buckets of the last decimated visible range: (max_points, bucket size, index of the first bucket, x, y)
+        self._buckets = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def samples(self):
+        return self._samples[:self._size]
+
+    @property
+    def t_start(self):
+        return self._t0s[0] if self._t0s else 0.0
+
+    @property
+    def t_end(self):
+        """
+        Time just after the last stored sample.
+        """
+        if not self._t0s:
+            return 0.0
+        return self._t0s[-1] + (self._size - self._starts[-1]) * self._dts[-1]
+
+    def append(self, block):
+        """
+        Appends the samples of a WaveformBlock, growing the store if needed.
+        """
+        n = len(block)
+        if self._size + n > self._samples.shape[0]:
+            grown = np.empty(shape=(max(2 * self._samples.shape[0], self._size + n),), dtype=self._samples.dtype)
+            grown[:self._size] = self._samples[:self._size]
+            self._samples = grown
+        # Start a new segment unless the block directly continues the previous one
+        if not self._t0s or block.dt != self.dt or abs(block.t0 - self.t_end) > block.dt / 2:
+            self._starts.append(self._size)
+            self._t0s.append(block.t0)
+            self._dts.append(block.dt)
+            self._segments = None
+        self.dt = block.dt
+        self._samples[self._size:self._size + n] = block.samples
+        self._size += n
+
+    def clear(self):
+        self._size = 0
+        self._starts = []
+        self._t0s = []
+        self._dts = []
+        self._segments = None
+        self.dt = None
+        self._buckets = None
+
+    def _segment_arrays(self):
+        if self._segments is None:
+            self._segments = (np.array(self._starts), np.array(self._t0s), np.array(self._dts))
+        return self._segments
+
+    def index_at(self, t):
+        """
+        Returns the index of the first stored sample at or after time t.
+        """
+        if not self._size:
+            return 0
+        starts, t0s, dts = self._segment_arrays()
+        segment = np.searchsorted(t0s, t, side='right') - 1
+        if segment < 0:
+            return 0
+        end = starts[segment + 1] if segment + 1 < starts.shape[0] else self._size
+        index = starts[segment] + math.ceil((t - t0s[segment]) / dts[segment])
+        return int(min(max(index, starts[segment]), end))
+
+    def times(self, start, stop):
+        """
+        Returns the time of every sample in samples[start:stop].
+        """
+        starts, t0s, dts = self._segment_arrays()
+        index = np.arange(start, stop)
+        segment = np.searchsorted(starts, index, side='right') - 1
+        return t0s[segment] + (index - starts[segment]) * dts[segment]
+
+    def visible(self, xmin, xmax, max_points=None):
+        """
+        Returns the (x, y) data needed to draw the time range [xmin, xmax], including one sample on either side so the
+        trace reaches the edges. With max_points set, longer ranges are min/max decimated.
+        """
+        if not self._size:
+            return np.empty(shape=(0,)), self._samples[:0]
+        start = max(self.index_at(xmin) - 1, 0)
+        stop = min(self.index_at(xmax) + 1, self._size)
+        if not max_points or stop - start <= max_points:
+            return self.times(start, stop), self._samples[start:stop]
+        n_buckets = max_points // 2
+        if self._buckets is not None and self._buckets[0] == max_points and \
+                n_buckets // 2 <= (stop - start) // self._buckets[1] <= n_buckets - 2:
+            _, bucket, cached_first, xs, ys = self._buckets
+        else:
+            # Start with 80% of the points, so the range can grow by a quarter before the buckets are chosen again
+            bucket = max(2, math.ceil((stop - start) / (0.8 * n_buckets)))
+            cached_first, xs, ys = 0, np.empty(shape=(0,)), self._samples[:0]
+        first = -(-start // bucket)
+        last = stop // bucket
+        if last <= first:
+            return decimate_minmax(self.times(start, stop), self._samples[start:stop], n_buckets)
+        if not cached_first <= first <= cached_first + xs.shape[0] // 2:
+            cached_first, xs, ys = first, xs[:0], ys[:0]
+        # Forget the buckets that scrolled out of the range and reduce the new ones
+        xs, ys = xs[2 * (first - cached_first):], ys[2 * (first - cached_first):]
+        cached_last = first + xs.shape[0] // 2
+        if last > cached_last:
+            new_x, new_y = minmax_buckets(self.times(cached_last * bucket, last * bucket),
+                                          self._samples[cached_last * bucket:last * bucket], bucket)
+            xs, ys = np.concatenate((xs, new_x)), np.concatenate((ys, new_y))
+        self._buckets = (max_points, bucket, first, xs, ys)
+        # The partial buckets at either end of the range are reduced on their own
+        head = self._minmax(start, first * bucket)
+        tail = self._minmax(last * bucket, stop)
+        n = 2 * (last - first)
+        return np.concatenate((head[0], xs[:n], tail[0])), np.concatenate((head[1], ys[:n], tail[1]))
+
+    def _minmax(self, start, stop):
+        """
+        Returns the (x, y) of the minimum and maximum of samples[start:stop] in order, or all of them if there are
+        fewer.
+        """
+        x, y = self.times(start, stop), self._samples[start:stop]
+        if y.shape[0] <= 2:
+            return x, y
+        return minmax_buckets(x, y, y.shape[0])